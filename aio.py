@@ -0,0 +1,105 @@
+# Run scripts inside an asyncio event loop, a slice at a time, so that
+# many of them share one loop without blocking it.
+# Run: python aio.py [--slice N] [--seconds S] FILE...
+
+import argparse
+import asyncio
+
+import lexer as lx
+import astt
+import iterative
+import resolver
+
+
+# loop iterations and statements a script runs before it yields
+SLICE = 1000
+
+
+class AsyncSemantiff(iterative.IterativeSemantiff):
+    """IterativeSemantiff whose runs give way to the event loop.
+
+    await interpreter.find_async() runs the program `slice_steps` steps
+    at a time (steps are while iterations and statements, so a loop
+    yields at its back-edges however short its body is) and yields to
+    the loop between slices. Every script waiting to go on is queued
+    behind the others that are ready, so scripts sharing a loop take
+    turns a slice each, whatever their length.
+
+    `seconds` is a deadline for the run, checked between slices: going
+    past it raises lexer.LimitExceeded. Cancelling the task that awaits
+    find_async() stops the script at its next slice boundary, with the
+    symtab as it was there. A budget set with set_budget() is checked
+    between slices too, as in IterativeSemantiff.
+
+    Parsing and resolving happen in one go before the first slice.
+    """
+
+    def __init__(self, parser, slice_steps=SLICE, seconds=None):
+        super().__init__(parser)
+        self.slice_steps = slice_steps
+        self.seconds = seconds
+        self.slices = 0
+
+    async def find_async(self):
+        self.astt = self.parser.parse()
+        self.resolve(self.astt)
+        return await self.run_async()
+
+    async def run_async(self):
+        loop = asyncio.get_running_loop()
+        deadline = None
+        if self.seconds is not None:
+            deadline = loop.time() + self.seconds
+        started = loop.time()
+        self.start(self.astt)
+        self.slices = 0
+        while True:
+            self.slices += 1
+            if self.run_slice(self.slice_steps):
+                return self.value
+            if deadline is not None and loop.time() > deadline:
+                raise lx.LimitExceeded('seconds', loop.time() - started,
+                                       self.seconds)
+            # behind every task that is ready to run
+            await asyncio.sleep(0)
+
+
+async def run_script(script, bindings=None, slice_steps=SLICE, seconds=None):
+    """Final globals of `script` run with the initial globals in dict
+    `bindings`, without blocking the event loop for more than a slice."""
+    interpreter = AsyncSemantiff(astt.Parser(lx.FastLexer(script)),
+                                 slice_steps, seconds)
+    interpreter.symtab = resolver.GlobalsView(bindings or {})
+    await interpreter.find_async()
+    return dict(interpreter.symtab.items())
+
+
+async def _run_files(paths, slice_steps, seconds):
+    scripts = []
+    for path in paths:
+        with open(path) as f:
+            scripts.append(f.read())
+    results = await asyncio.gather(
+        *(run_script(script, None, slice_steps, seconds)
+          for script in scripts),
+        return_exceptions=True)
+    for path, result in zip(paths, results):
+        if isinstance(result, BaseException):
+            result = getattr(result, 'message', result)
+        print('{}: {}'.format(path, result))
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Run scripts side by side on one event loop.')
+    arg_parser.add_argument('paths', nargs='+', metavar='FILE')
+    arg_parser.add_argument('--slice', type=int, default=SLICE,
+                            help='steps between yields to the loop')
+    arg_parser.add_argument('--seconds', type=float, default=None,
+                            help='deadline for every script')
+    args = arg_parser.parse_args()
+    asyncio.run(_run_files(args.paths, args.slice, args.seconds))
+
+
+if __name__ == '__main__':
+    main()
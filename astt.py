@@ -1,19 +1,27 @@
+import operator
+
 import lexer as lx
 
 
 class AST(object):
-    pass
+    # Nodes have no __dict__: generated programs reach millions of nodes.
+    __slots__ = ()
 
 class While(AST): #while loop
+    __slots__ = ('test', 'body')
     def __init__(self, test, body):
         self.test = test
         self.body = body
 
 class BinOp(AST):
+    """`function` is the Python callable of the operator, None for 'and'
+    and 'or'."""
+    __slots__ = ('left', 'token', 'op', 'right', 'function')
     def __init__(self, left, op, right):
         self.left = left
         self.token = self.op = op
         self.right = right
+        self.function = ARITHMETIC_FUNCTIONS.get(op.kind)
 
 """class BoolOp(AST):
     def __init__(self, op, left, right):
@@ -22,6 +30,7 @@ class BinOp(AST):
         self.right = right"""
 
 class If(AST):
+    __slots__ = ('test', 'body', 'alt')
     def __init__(self, test, body, alt):
         self.test = test
         self.body = body
@@ -29,35 +38,44 @@ class If(AST):
     
 
 class Compare(AST):
+    __slots__ = ('left', 'right', 'op', 'function')
     def __init__(self, left, op, right):
         self.left = left
         self.right = right
         self.op = op
+        self.function = COMPARE_FUNCTIONS.get(op.kind)
 
 class Num(AST):
+    __slots__ = ('token', 'value')
     def __init__(self, token):
         self.token = token
         self.value = token.value
 
 class BoolVal(AST):
+    __slots__ = ('token', 'value')
     def __init__(self, token):
         self.token = token
-        self.value = token.value    
+        # the token value is the keyword text, 'TRUE' or 'FALSE'
+        self.value = token.kind == lx.Kind.TRUE
 
 
 class UnaryOp(AST):
+    __slots__ = ('token', 'op', 'expr', 'function')
     def __init__(self, op, expr):
         self.token = self.op = op
         self.expr = expr
+        self.function = UNARY_FUNCTIONS.get(op.kind)
 
 
 class Compound(AST):
     """Represents a 'BEGIN ... END' block"""
+    __slots__ = ('children',)
     def __init__(self):
         self.children = []
 
 
 class Assign(AST):
+    __slots__ = ('left', 'token', 'op', 'right')
     def __init__(self, left, op, right):
         self.left = left
         self.token = self.op = op
@@ -65,26 +83,124 @@ class Assign(AST):
 
 
 class Var(AST):
-    """The Var node is constructed out of IDENTIFIER token."""
+    """The Var node is constructed out of IDENTIFIER token.
+
+    resolver.resolve() fills in `slot`, the index of the variable in the
+    globals, or in the frame of locals if `local` is true.
+    """
+    __slots__ = ('token', 'value', 'slot', 'local')
     def __init__(self, token):
         self.token = token
         self.value = token.value
+        self.slot = None
+        self.local = False
+
+
+class Local(AST):
+    """'local name = expr' declares a new local variable; right is None
+    for a bare 'local name'."""
+    __slots__ = ('left', 'token', 'op', 'right')
+    def __init__(self, left, op, right):
+        self.left = left
+        self.token = self.op = op
+        self.right = right
 
 
 class NoOp(AST):
-    pass
+    __slots__ = ()
 
 
 class Program(AST):
+    __slots__ = ('block',)
     def __init__(self, block):
         self.block = block
 
 
 class Block(AST):
+    __slots__ = ('compound_statement',)
     def __init__(self, compound_statement):
         self.compound_statement = compound_statement
 
 
+# token kinds of the comparison operators
+COMPARISON_OPS = frozenset({
+    lx.Kind.EQUAL,
+    lx.Kind.NOTEQUAL,
+    lx.Kind.LEQ,
+    lx.Kind.GEQ,
+    lx.Kind.LT,
+    lx.Kind.GT,
+})
+
+# Binary operators: kind -> (precedence, right associative), following the
+# Lua reference manual from 'or' (lowest) to '^' (highest).
+BINARY_PRECEDENCE = {
+    lx.Kind.OR: (1, False),
+    lx.Kind.AND: (2, False),
+    lx.Kind.LT: (3, False),
+    lx.Kind.GT: (3, False),
+    lx.Kind.LEQ: (3, False),
+    lx.Kind.GEQ: (3, False),
+    lx.Kind.NOTEQUAL: (3, False),
+    lx.Kind.EQUAL: (3, False),
+    lx.Kind.PIPE: (4, False),
+    lx.Kind.TILDE: (5, False),
+    lx.Kind.AMPERSAND: (6, False),
+    lx.Kind.DLT: (7, False),
+    lx.Kind.DGT: (7, False),
+    lx.Kind.DDOT: (8, True),
+    lx.Kind.PLUS: (9, False),
+    lx.Kind.MINUS: (9, False),
+    lx.Kind.MUL: (10, False),
+    lx.Kind.FLOAT_DIV: (10, False),
+    lx.Kind.DSLASH: (10, False),
+    lx.Kind.PERCENT: (10, False),
+    lx.Kind.EXP: (12, True),
+}
+
+# Unary operators bind tighter than every binary operator except '^',
+# so -x^2 is -(x^2) while -x*2 is (-x)*2.
+UNARY_OPS = frozenset({lx.Kind.NOT, lx.Kind.SH, lx.Kind.MINUS, lx.Kind.PLUS,
+                       lx.Kind.TILDE})
+UNARY_PRECEDENCE = 11
+
+
+def _not(value):
+    # the negation of smt.bool()
+    return value == lx.TokenType.NIL or value == False
+
+
+# operator kind -> Python callable, looked up once as the node is built
+# and kept in its `function`
+ARITHMETIC_FUNCTIONS = {
+    lx.Kind.PLUS: operator.add,
+    lx.Kind.MINUS: operator.sub,
+    lx.Kind.MUL: operator.mul,
+    lx.Kind.FLOAT_DIV: operator.truediv,
+    lx.Kind.DSLASH: operator.floordiv,
+    lx.Kind.PERCENT: operator.mod,
+    lx.Kind.EXP: operator.pow,
+}
+
+COMPARE_FUNCTIONS = {
+    lx.Kind.GT: operator.gt,
+    lx.Kind.LT: operator.lt,
+    lx.Kind.GEQ: operator.ge,
+    lx.Kind.LEQ: operator.le,
+    lx.Kind.EQUAL: operator.eq,
+    lx.Kind.NOTEQUAL: operator.ne,
+}
+
+UNARY_FUNCTIONS = {
+    lx.Kind.PLUS: operator.pos,
+    lx.Kind.MINUS: operator.neg,
+    lx.Kind.NOT: _not,
+}
+
+# token kinds that end a statement list
+BLOCK_END = frozenset({lx.Kind.EOF, lx.Kind.END, lx.Kind.ELSEIF, lx.Kind.ELSE})
+
+
 class Parser:
     def __init__(self, lexer):
         self.lexer = lexer
@@ -92,14 +208,21 @@ class Parser:
         self.current_token = self.lexer.get_next_token()
 
     def error(self):
-        raise Exception('Invalid syntax')
-
-    def eat(self, token_type):
-        # compare the current token type with the passed token
-        # type and if they match then "eat" the current token
+        token = self.current_token
+        message = 'Invalid syntax'
+        if token.lineno is not None:
+            # the EOF token carries no position
+            message += " on '{}' line: {} column: {}".format(
+                token.value, token.lineno, token.column)
+        raise lx.ParserError(error_code=lx.ErrorCode.UNEXPECTED_TOKEN,
+                             token=token, message=message)
+
+    def eat(self, kind):
+        # compare the current token kind with the passed token
+        # kind and if they match then "eat" the current token
         # and assign the next token to the self.current_token,
         # otherwise raise an exception.
-        if self.current_token.type == token_type:
+        if self.current_token.kind == kind:
             self.current_token = self.lexer.get_next_token()
         else:
             self.error()
@@ -137,7 +260,7 @@ class Parser:
 
         results = [node]
 
-        while (self.current_token.type not in (lx.TokenType.EOF, lx.TokenType.END, lx.TokenType.ELSEIF, lx.TokenType.ELSE) ):
+        while self.current_token.kind not in BLOCK_END:
             results.append(self.statement())
 
         return results
@@ -148,15 +271,17 @@ class Parser:
                   | assignment_statement
                   | empty
         """
-        if self.current_token.type == lx.TokenType.PRINT:
+        if self.current_token.kind == lx.Kind.PRINT:
             node = self.print_statement()
-        elif self.current_token.type == lx.TokenType.IDENTIFIER:
+        elif self.current_token.kind == lx.Kind.IDENTIFIER:
             node = self.assignment_statement()
-        elif self.current_token.type == lx.TokenType.IF:
+        elif self.current_token.kind == lx.Kind.LOCAL:
+            node = self.local_statement()
+        elif self.current_token.kind == lx.Kind.IF:
             node = self.if_statement()
-        elif self.current_token.type == lx.TokenType.WHILE:
+        elif self.current_token.kind == lx.Kind.WHILE:
             node = self.while_statement()
-        elif self.current_token.type == lx.TokenType.NIL:
+        elif self.current_token.kind == lx.Kind.NIL:
             node = self.empty()
         else:
             node = self.parent_expr()
@@ -175,11 +300,11 @@ class Parser:
         print_statement : print LPAREN expr RPAREN
         """
 
-        self.eat(lx.TokenType.PRINT)
+        self.eat(lx.Kind.PRINT)
         token = self.current_token
-        self.eat(lx.TokenType.LPAREN)
+        self.eat(lx.Kind.LPAREN)
         node = self.parent_expr()
-        self.eat(lx.TokenType.RPAREN)
+        self.eat(lx.Kind.RPAREN)
         return node    
 
 ####################################
@@ -192,63 +317,77 @@ class Parser:
 
         left = self.variable()
         token = self.current_token
-        self.eat(lx.TokenType.ASSIGN)
+        self.eat(lx.Kind.ASSIGN)
         right = self.parent_expr()
         node = Assign(left, token, right)
         return node
 
+    def local_statement(self):
+        """
+        local_statement : LOCAL variable (ASSIGN expr)?
+        """
+        token = self.current_token
+        self.eat(lx.Kind.LOCAL)
+        left = self.variable()
+        right = None
+        if self.current_token.kind == lx.Kind.ASSIGN:
+            self.eat(lx.Kind.ASSIGN)
+            right = self.parent_expr()
+        return Local(left, token, right)
+
 ####################################
 ########## IF STATEMENT ############
 ####################################
 
     def if_statement(self):
         #Stand-alone if part
-        if (self.current_token.type == lx.TokenType.IF):
-            self.eat(lx.TokenType.IF)
-        if (self.current_token.type == lx.TokenType.LPAREN):
-            self.eat(lx.TokenType.LPAREN)
+        if (self.current_token.kind == lx.Kind.IF):
+            self.eat(lx.Kind.IF)
+        # a parenthesized condition is parsed as part of the expression
         condition = self.parent_expr()
-        if (self.current_token.type == lx.TokenType.RPAREN):
-            self.eat(lx.TokenType.RPAREN)
-        self.eat(lx.TokenType.THEN)
+        self.eat(lx.Kind.THEN)
         body = Compound()
         body.children=self.statement_list()
         alt = None
         #Elseif Part
         flag = 0
-        if (self.current_token.type == lx.TokenType.ELSEIF):
+        if (self.current_token.kind == lx.Kind.ELSEIF):
             alt = self.elseif_statement()
             flag=1
 
-        if (flag ==0  and self.current_token.type == lx.TokenType.ELSE):
-            self.eat(lx.TokenType.ELSE)
+        if (flag ==0  and self.current_token.kind == lx.Kind.ELSE):
+            self.eat(lx.Kind.ELSE)
             alt = Compound()
             alt.children=self.statement_list()
-        self.eat(lx.TokenType.END)
+        self.eat(lx.Kind.END)
         node = If(condition, body, alt)
         return node
 
     def elseif_statement(self):
-        self.eat(lx.TokenType.ELSEIF)
-        if (self.current_token.type == lx.TokenType.LPAREN):
-            self.eat(lx.TokenType.LPAREN)
-        elseif_condition = self.conditional_statement()
-        if (self.current_token.type == lx.TokenType.RPAREN):
-            self.eat(lx.TokenType.RPAREN)
-        self.eat(lx.TokenType.THEN)
-        elseif_body = Compound()
-        elseif_body.children=self.statement_list()
-        alt= None
-        while (self.current_token.type == lx.TokenType.ELSEIF):
-            alt = self.elseif_statement()
-        if (self.current_token.type == lx.TokenType.ELSE):
-            self.eat(lx.TokenType.ELSE)
+        """
+        elseif_statement : (ELSEIF expr THEN statement_list)+
+                           (ELSE statement_list)?
+
+        The arms become a chain of nested If nodes, built in a loop so
+        that ladders of any length parse without recursion.
+        """
+        arms = []
+        while self.current_token.kind == lx.Kind.ELSEIF:
+            self.eat(lx.Kind.ELSEIF)
+            elseif_condition = self.conditional_statement()
+            self.eat(lx.Kind.THEN)
+            elseif_body = Compound()
+            elseif_body.children = self.statement_list()
+            arms.append((elseif_condition, elseif_body))
+        alt = None
+        if (self.current_token.kind == lx.Kind.ELSE):
+            self.eat(lx.Kind.ELSE)
             alt = Compound()
             alt.children=self.statement_list()
-        elifnode = If(elseif_condition, elseif_body,alt)
+        for elseif_condition, elseif_body in reversed(arms):
+            alt = If(elseif_condition, elseif_body, alt)
+        return alt
 
-        return elifnode
-    
 
 
 ####################################
@@ -256,16 +395,12 @@ class Parser:
 ####################################
 
     def while_statement(self):
-        if (self.current_token.type == lx.TokenType.WHILE):
-            self.eat(lx.TokenType.WHILE)
-        if (self.current_token.type == lx.TokenType.LPAREN):
-            self.eat(lx.TokenType.LPAREN)
+        if (self.current_token.kind == lx.Kind.WHILE):
+            self.eat(lx.Kind.WHILE)
         condition = self.conditional_statement()
-        if (self.current_token.type == lx.TokenType.RPAREN):
-            self.eat(lx.TokenType.RPAREN)
-        self.eat(lx.TokenType.DO)
+        self.eat(lx.Kind.DO)
         body = self.statement_list()
-        self.eat(lx.TokenType.END)
+        self.eat(lx.Kind.END)
         node = While(condition, body)
         return node
 
@@ -276,23 +411,9 @@ class Parser:
 
     def conditional_statement(self):
         """
-        conditional_statement : expr COMPARISON_OP expr
+        conditional_statement : expression
         """
-        COMPARISON_OP = {
-        lx.TokenType.EQUAL : '==',
-        lx.TokenType.NOTEQUAL : '~=',
-        lx.TokenType.LEQ : '<=',
-        lx.TokenType.GEQ : '>=',
-        lx.TokenType.LT : '<',
-        lx.TokenType.GT : '>',
-        }
-        left = self.expr()
-        token = self.current_token
-        if (self.current_token.type in COMPARISON_OP):
-            self.eat(token.type)
-        right = self.expr()
-        node = Compare(left, token, right)
-        return node
+        return self.expression()
 
 
 
@@ -305,7 +426,7 @@ class Parser:
         variable : IDENTIFIER
         """
         node = Var(self.current_token)
-        self.eat(lx.TokenType.IDENTIFIER)
+        self.eat(lx.Kind.IDENTIFIER)
         return node
 
     def empty(self):
@@ -313,109 +434,107 @@ class Parser:
         return NoOp()
 
     def parent_expr(self):
-        """expr (( COMPARISON_OPERATOR ) expr)"""
-
-        COMPARISON_OP = {
-        lx.TokenType.EQUAL : '==',
-        lx.TokenType.NOTEQUAL : '~=',
-        lx.TokenType.LEQ : '<=',
-        lx.TokenType.GEQ : '>=',
-        lx.TokenType.LT : '<',
-        lx.TokenType.GT : '>',
-        }
-
-        node = self.expr()
+        """parent_expr : expression"""
+        return self.expression()
 
-        while self.current_token.type in COMPARISON_OP:
-            token = self.current_token
-            self.eat(token.type)
-
-            node = Compare(left=node, op=token, right=self.expr())
+    def expr(self):
+        """expr : expression"""
+        return self.expression()
 
-        return node
+####################################
+############ EXPRESSIONS ###########
+####################################
 
-    def expr(self):
-        """
-        expr : term (( PLUS | MINUS) term)*
+    def expression(self):
         """
-        node = self.term()
-
-        while self.current_token.type in (lx.TokenType.PLUS, lx.TokenType.MINUS):
-            token = self.current_token
-            if token.type == lx.TokenType.PLUS:
-                self.eat(lx.TokenType.PLUS)
-            elif token.type == lx.TokenType.MINUS:
-                self.eat(lx.TokenType.MINUS)
+        expression : unary* operand (BINARY_OP unary* operand)*
+        operand    : primary | LPAREN expression RPAREN
 
-            node = BinOp(left=node, op=token, right=self.term())
-        while self.current_token.type in (lx.TokenType.AND, lx.TokenType.OR):
+        Operator precedence parsing driven by BINARY_PRECEDENCE and
+        UNARY_PRECEDENCE. Pending operators and operands live on two
+        explicit stacks, so nesting depth and chain length are not limited
+        by Python's recursion limit, and each operand costs one call.
+        """
+        operands = []
+        # (precedence, token) for operators, or None for an open parenthesis
+        operators = []
+        open_parens = 0
+
+        def reduce():
+            precedence, token = operators.pop()
+            if precedence == UNARY_PRECEDENCE:
+                operands.append(UnaryOp(token, operands.pop()))
+                return
+            right = operands.pop()
+            left = operands.pop()
+            if token.kind in COMPARISON_OPS:
+                operands.append(Compare(left, token, right))
+            else:
+                operands.append(BinOp(left, token, right))
+
+        while True:
+            # prefix operators and opening parentheses
             token = self.current_token
-            if token.type == lx.TokenType.AND:
-                self.eat(lx.TokenType.AND)
-            elif token.type == lx.TokenType.OR:
-                self.eat(lx.TokenType.OR)
-
-            node = Compare(left=node, op=token, right=self.expr())
-
-        return node
-
-    def term(self):
-        """term : factor ((MUL |33 FLOAT_DIV) factor)*"""
-        node = self.factor()
+            if token.kind in UNARY_OPS:
+                self.eat(token.kind)
+                operators.append((UNARY_PRECEDENCE, token))
+                continue
+            if token.kind == lx.Kind.LPAREN:
+                self.eat(lx.Kind.LPAREN)
+                operators.append(None)
+                open_parens += 1
+                continue
+
+            operands.append(self.primary())
+
+            # closing parentheses that belong to this expression
+            while open_parens and self.current_token.kind == lx.Kind.RPAREN:
+                while operators[-1] is not None:
+                    reduce()
+                operators.pop()
+                open_parens -= 1
+                self.eat(lx.Kind.RPAREN)
 
-        while self.current_token.type in (lx.TokenType.MUL, lx.TokenType.FLOAT_DIV):
             token = self.current_token
-            if token.type == lx.TokenType.MUL:
-                self.eat(lx.TokenType.MUL)
-            elif token.type == lx.TokenType.FLOAT_DIV:
-                self.eat(lx.TokenType.FLOAT_DIV)
-
-            node = BinOp(left=node, op=token, right=self.factor())
-
-        return node
-
-    def factor(self):
-        """factor : PLUS factor
-                  | MINUS factor
-                  | _CONST
-                  | NUMBER
-                  | LPAREN expr RPAREN
-                  | variable
+            binding = BINARY_PRECEDENCE.get(token.kind)
+            if binding is None:
+                break
+            precedence, right_assoc = binding
+            while operators and operators[-1] is not None and (
+                    operators[-1][0] > precedence or
+                    operators[-1][0] == precedence and not right_assoc):
+                reduce()
+            self.eat(token.kind)
+            operators.append((precedence, token))
+
+        if open_parens:
+            # an opening parenthesis was never closed
+            self.eat(lx.Kind.RPAREN)
+        while operators:
+            reduce()
+        return operands[0]
+
+    def primary(self):
+        """primary : INTEGER
+                   | NUMBER
+                   | TRUE
+                   | FALSE
+                   | variable
         """
         token = self.current_token
-        if token.type == lx.TokenType.PLUS:
-            self.eat(lx.TokenType.PLUS)
-            node = UnaryOp(token, self.factor())
-            return node
-        elif token.type == lx.TokenType.MINUS:
-            self.eat(lx.TokenType.MINUS)
-            node = UnaryOp(token, self.factor())
-            return node
-        elif token.type == lx.TokenType.INTEGER:
-            self.eat(lx.TokenType.INTEGER)
-            return Num(token)
-        elif token.type == lx.TokenType.NUMBER:
-            self.eat(lx.TokenType.NUMBER)
+        kind = token.kind
+        if kind == lx.Kind.INTEGER or kind == lx.Kind.NUMBER:
+            self.eat(kind)
             return Num(token)
-        elif token.type == lx.TokenType.LPAREN:
-            self.eat(lx.TokenType.LPAREN)
-            node = self.expr()
-            self.eat(lx.TokenType.RPAREN)
-            return node
-        elif token.type == lx.TokenType.TRUE:
-            self.eat(lx.TokenType.TRUE)
+        if kind == lx.Kind.TRUE or kind == lx.Kind.FALSE:
+            self.eat(kind)
             return BoolVal(token)
-        elif token.type == lx.TokenType.FALSE:
-            self.eat(lx.TokenType.FALSE)
-            return BoolVal(token)        
-        else:
-            node = self.variable()
-            return node
+        return self.variable()
 
     def parse(self):
 
         node = self.program()
-        if self.current_token.type != lx.TokenType.EOF:
+        if self.current_token.kind != lx.Kind.EOF:
             self.error()
 
         return node
@@ -0,0 +1,174 @@
+# Lex and parse many scripts at once, spread over a pool of processes.
+# Run: python batch.py [-j WORKERS] [--suffix .lua] PATH...
+
+import argparse
+import concurrent.futures
+import os
+import time
+
+import lexer as lx
+import astt
+import cache
+
+
+class FileResult:
+    """Outcome of lexing and parsing one file.
+
+    `ast` holds the cache.dump_tree() records of the program when the
+    batch was asked for trees (cache.load_tree() turns them back into a
+    Program); the flat records cross process boundaries cheaply however
+    deep the tree is. On failure `error` is the message and `lineno` and
+    `column` locate it.
+    """
+
+    __slots__ = ('path', 'ok', 'ast', 'error', 'lineno', 'column', 'seconds')
+
+    def __init__(self, path, ok, ast=None, error=None, lineno=None,
+                 column=None, seconds=0.0):
+        self.path = path
+        self.ok = ok
+        self.ast = ast
+        self.error = error
+        self.lineno = lineno
+        self.column = column
+        self.seconds = seconds
+
+    def __repr__(self):
+        if self.ok:
+            return 'FileResult({!r}, ok)'.format(self.path)
+        return 'FileResult({!r}, {!r} at {}:{})'.format(
+            self.path, self.error, self.lineno, self.column)
+
+
+class BatchReport:
+    """Per-file results of a batch, in input order, with timings."""
+
+    def __init__(self, results, seconds, workers):
+        self.results = results
+        # wall-clock time of the whole batch
+        self.seconds = seconds
+        self.workers = workers
+
+    @property
+    def failures(self):
+        return [result for result in self.results if not result.ok]
+
+    @property
+    def busy_seconds(self):
+        """Time spent lexing and parsing, summed over all files."""
+        return sum(result.seconds for result in self.results)
+
+    def summary(self):
+        count = len(self.results)
+        return '{} files, {} failed, {:.3f} s on {} worker(s), {:.0f} files/sec'.format(
+            count, len(self.failures), self.seconds, self.workers,
+            count / self.seconds if self.seconds else 0.0)
+
+
+def check_file(path, keep_ast=False):
+    """Lex and parse the file at `path` into a FileResult."""
+    start = time.perf_counter()
+    lexer = None
+    parser = None
+    try:
+        with open(path, 'rb') as f:
+            text = f.read()
+        lexer = lx.FastLexer(text)
+        parser = astt.Parser(lexer)
+        program = parser.parse()
+    except lx.LexerError as e:
+        return FileResult(path, False, error=e.message, lineno=lexer.lineno,
+                          column=lexer.column,
+                          seconds=time.perf_counter() - start)
+    except OSError as e:
+        return FileResult(path, False, error=str(e),
+                          seconds=time.perf_counter() - start)
+    except Exception as e:
+        if parser is None:
+            # failed before parsing began: there is no position to report
+            return FileResult(path, False, error=str(e),
+                              seconds=time.perf_counter() - start)
+        if parser.current_token.kind == lx.Kind.EOF:
+            # the EOF token carries no position; report the end of input
+            lineno, column = lx.LineIndex(text).locate(len(text))
+        else:
+            lineno = parser.current_token.lineno
+            column = parser.current_token.column
+        return FileResult(path, False, error=str(e), lineno=lineno,
+                          column=column, seconds=time.perf_counter() - start)
+    ast = cache.dump_tree(program) if keep_ast else None
+    return FileResult(path, True, ast=ast,
+                      seconds=time.perf_counter() - start)
+
+
+def _check_chunk(paths, keep_ast):
+    return [check_file(path, keep_ast) for path in paths]
+
+
+def collect(paths, suffixes=('.lua',)):
+    """Files named by `paths`; directories are searched recursively for
+    files ending in one of `suffixes`."""
+    files = []
+    for path in paths:
+        if not os.path.isdir(path):
+            files.append(path)
+            continue
+        for root, dirs, names in os.walk(path):
+            dirs.sort()
+            files.extend(os.path.join(root, name) for name in sorted(names)
+                         if name.endswith(suffixes))
+    return files
+
+
+def check_files(paths, workers=None, chunk_size=None, keep_ast=False):
+    """Lex and parse every file in `paths` and return a BatchReport.
+
+    Files are handed to `workers` processes (all cores by default) in
+    chunks of `chunk_size` paths, so that each round trip to a worker
+    carries enough work to pay for itself. With workers=1 everything runs
+    in the calling process.
+    """
+    paths = list(paths)
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    if workers == 1 or len(paths) < 2:
+        results = _check_chunk(paths, keep_ast)
+        return BatchReport(results, time.perf_counter() - start, 1)
+
+    if chunk_size is None:
+        # a few chunks per worker evens out files of different sizes
+        chunk_size = max(1, len(paths) // (workers * 4))
+    chunks = [paths[i:i + chunk_size] for i in range(0, len(paths), chunk_size)]
+    results = []
+    with concurrent.futures.ProcessPoolExecutor(workers) as pool:
+        for chunk_results in pool.map(_check_chunk, chunks,
+                                      [keep_ast] * len(chunks)):
+            results.extend(chunk_results)
+    return BatchReport(results, time.perf_counter() - start, workers)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Lex and parse Lua scripts in parallel.')
+    arg_parser.add_argument('paths', nargs='+',
+                            help='files, or directories to search')
+    arg_parser.add_argument('-j', '--workers', type=int, default=None,
+                            help='worker processes (default: all cores)')
+    arg_parser.add_argument('--chunk-size', type=int, default=None,
+                            help='files handed to a worker at a time')
+    arg_parser.add_argument('--suffix', action='append', default=None,
+                            help='file suffix to search directories for '
+                                 '(default: .lua)')
+    args = arg_parser.parse_args()
+
+    files = collect(args.paths, tuple(args.suffix or ('.lua',)))
+    report = check_files(files, args.workers, args.chunk_size)
+    for result in report.failures:
+        print('{}:{}:{}: {}'.format(result.path, result.lineno, result.column,
+                                    result.error))
+    print(report.summary())
+    return 1 if report.failures else 0
+
+
+if __name__ == '__main__':
+    raise SystemExit(main())
@@ -0,0 +1,347 @@
+# Rough performance numbers for the interpreter stages.
+# Run: python bench.py
+
+import os
+import tempfile
+import time
+import tracemalloc
+
+import astt
+import cache
+import closures
+import incremental
+import iterative
+import optimize
+import quicken
+import lexer as lx
+import smt
+import transpile
+import vm
+
+
+def load_workload(repeat=200):
+    """code.txt repeated `repeat` times, as one large source file."""
+    with open('code.txt', 'r') as f:
+        text = f.read()
+    return (text + '\n') * repeat
+
+
+def count_tokens(lexer):
+    count = 0
+    while lexer.get_next_token().type != lx.TokenType.EOF:
+        count += 1
+    return count
+
+
+def lexer_throughput(text, lexer_class, repeat=3):
+    """Best-of-`repeat` tokens/sec for tokenizing `text` with `lexer_class`."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        count = count_tokens(lexer_class(text))
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return count / best
+
+
+def tokenize_throughput(text, repeat=3):
+    """Best-of-`repeat` tokens/sec for Lexer.tokenize_all."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        stream = lx.FastLexer(text).tokenize_all()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return len(stream) / best
+
+
+def traced_bytes(build):
+    """Bytes still allocated by the object `build()` returns."""
+    tracemalloc.start()
+    result = build()
+    size = tracemalloc.get_traced_memory()[0]
+    tracemalloc.stop()
+    del result
+    return size
+
+
+def token_list(text):
+    lexer = lx.FastLexer(text)
+    tokens = []
+    while True:
+        token = lexer.get_next_token()
+        if token.type == lx.TokenType.EOF:
+            return tokens
+        tokens.append(token)
+
+
+def peak_bytes(run):
+    """Peak bytes allocated while `run()` executes."""
+    tracemalloc.start()
+    run()
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return peak
+
+
+def read_and_lex(path):
+    with open(path, 'r') as f:
+        count_tokens(lx.FastLexer(f.read()))
+
+
+def stream_and_lex(path):
+    with open(path, 'rb') as f:
+        count_tokens(lx.StreamLexer(f))
+
+
+def file_lexing_memory(text):
+    """Peak memory of lexing `text` from disk through each input path."""
+    with tempfile.NamedTemporaryFile('w', suffix='.lua', delete=False) as f:
+        f.write(text)
+    try:
+        return {
+            'read()': peak_bytes(lambda: read_and_lex(f.name)),
+            'mmap': peak_bytes(
+                lambda: count_tokens(lx.FastLexer.from_file(f.name))),
+            'stream': peak_bytes(lambda: stream_and_lex(f.name)),
+        }
+    finally:
+        os.remove(f.name)
+
+
+def parse_time(make_lexer, repeat=3):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        astt.Parser(make_lexer()).parse()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def edit_latency(text, edits=200):
+    """Mean seconds per one-character edit in the middle of `text`."""
+    doc = incremental.IncrementalParser(text)
+    offset = text.index('a3 = 7', len(text) // 2) + len('a3 = ')
+    start = time.perf_counter()
+    for i in range(edits):
+        doc.edit(offset, 1, '78'[i % 2])
+    return (time.perf_counter() - start) / edits
+
+
+def edit_latency_alternating(text, edits=200):
+    """Mean seconds per one-character edit, alternating between the first
+    and the last statements of `text`."""
+    doc = incremental.IncrementalParser(text)
+    offsets = (text.index('a3 = 7') + len('a3 = '),
+               text.rindex('a3 = 7') + len('a3 = '))
+    start = time.perf_counter()
+    for i in range(edits):
+        doc.edit(offsets[i % 2], 1, '78'[i // 2 % 2])
+    return (time.perf_counter() - start) / edits
+
+
+def pipeline_time(text, lexer_class, repeat=5):
+    """Best-of-`repeat` seconds to lex, parse and run `text`."""
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        smt.Semantiff(astt.Parser(lexer_class(text))).find()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def expression_parse_time(text, repeat=3):
+    """Best-of-`repeat` seconds to parse `text` with the fast lexer."""
+    return parse_time(lambda: lx.FastLexer(text), repeat)
+
+
+def cache_load_time(text, repeat=3):
+    """Best-of-`repeat` seconds to parse `text` cold and to load it from a
+    ParseCache."""
+    directory = tempfile.mkdtemp()
+    parse_cache = cache.ParseCache(directory)
+    try:
+        parse_cache.parse(text)
+        best = None
+        for _ in range(repeat):
+            start = time.perf_counter()
+            parse_cache.get(text)
+            elapsed = time.perf_counter() - start
+            if best is None or elapsed < best:
+                best = elapsed
+        return parse_time(lambda: lx.FastLexer(text), repeat), best
+    finally:
+        parse_cache.clear()
+        os.rmdir(directory)
+
+
+LOOP = '''
+a2=0
+b2=0
+while (a2<{}) do
+    a2=a2+1
+    b2=b2+a2*a2*a2
+end
+'''
+
+# a numeric kernel recomputing loop-invariant and repeated products
+KERNEL = '''
+n=7
+k=3
+s=0
+i=0
+while (i<{}) do
+    s=s+(n*k+1)*i+(n*k+1)*(i+1)
+    i=i+1
+end
+'''
+
+
+class ParsedProgram:
+    """Stands in for a Parser whose parse() returns an already parsed tree,
+    so that evaluation can be timed on its own."""
+
+    def __init__(self, program):
+        self.program = program
+
+    def parse(self):
+        return self.program
+
+
+# evaluation engines by name, each used like smt.Semantiff
+ENGINES = {
+    'tree': smt.Semantiff,
+    'quick': quicken.QuickeningSemantiff,
+    'stack': iterative.IterativeSemantiff,
+    'closure': closures.ClosureSemantiff,
+    'python': transpile.TranspiledSemantiff,
+    'vm': vm.VMSemantiff,
+}
+
+
+def loop_time(engine=smt.Semantiff, iterations=20000, repeat=5):
+    """Best-of-`repeat` seconds for `engine` to run the sum-of-cubes loop
+    of code.txt for `iterations` iterations."""
+    program = astt.Parser(lx.FastLexer(LOOP.format(iterations))).parse()
+    best = None
+    for _ in range(repeat):
+        interpreter = engine(ParsedProgram(program))
+        start = time.perf_counter()
+        interpreter.find()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def run_time(engine, program, repeat=5):
+    """Best-of-`repeat` seconds for `engine` to run a parsed `program`."""
+    best = None
+    for _ in range(repeat):
+        interpreter = engine(ParsedProgram(program))
+        start = time.perf_counter()
+        interpreter.find()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best
+
+
+def main():
+    text = load_workload()
+    print('Lexer throughput on {} characters:'.format(len(text)))
+    baseline = None
+    for name, lexer_class in lx.LEXERS.items():
+        rate = lexer_throughput(text, lexer_class)
+        baseline = baseline or rate
+        print('  {:<8} {:>12,.0f} tokens/sec  ({:.1f}x)'.format(
+            name, rate, rate / baseline))
+    rate = lexer_throughput(
+        text, lambda source: lx.FastLexer(source, lazy_positions=True))
+    print('  {:<8} {:>12,.0f} tokens/sec  ({:.1f}x)'.format(
+        'lazy', rate, rate / baseline))
+    rate = tokenize_throughput(text)
+    print('  {:<8} {:>12,.0f} tokens/sec  ({:.1f}x)'.format(
+        'stream', rate, rate / baseline))
+
+    print('Memory held by the tokens:')
+    print('  Token list   {:>12,} bytes'.format(
+        traced_bytes(lambda: token_list(text))))
+    print('  TokenStream  {:>12,} bytes'.format(
+        traced_bytes(lambda: lx.FastLexer(text).tokenize_all())))
+
+    big = load_workload(repeat=2000)
+    print('Peak memory lexing a {:,} byte file:'.format(len(big)))
+    for name, size in file_lexing_memory(big).items():
+        print('  {:<8} {:>12,} bytes'.format(name, size))
+
+    print('One-character edit, incremental re-parse:')
+    for repeat in (20, 200, 2000):
+        workload = load_workload(repeat)
+        print('  {:>9,} characters  {:8.1f} us/edit'.format(
+            len(workload), edit_latency(workload) * 1e6))
+    print('  {:>9,} characters  {:8.1f} us/edit  (alternating ends)'.format(
+        len(big), edit_latency_alternating(big) * 1e6))
+
+    print('Lex + parse + run:')
+    for name, lexer_class in lx.LEXERS.items():
+        print('  {:<8} {:.4f} s'.format(name, pipeline_time(text, lexer_class)))
+
+    for iterations in (20000, 200000):
+        print('{:,}-iteration while loop:'.format(iterations))
+        for name, engine in ENGINES.items():
+            print('  {:<8} {:.4f} s'.format(
+                name, loop_time(engine, iterations, repeat=3)))
+    print('Run code.txt x200:')
+    program = astt.Parser(lx.FastLexer(text)).parse()
+    for name, engine in ENGINES.items():
+        print('  {:<8} {:.4f} s'.format(name, run_time(engine, program)))
+    folded = optimize.fold_constants(astt.Parser(lx.FastLexer(text)).parse())
+    print('  {:<8} {:.4f} s  (constants folded)'.format(
+        'tree', run_time(smt.Semantiff, folded)))
+    print('20,000-iteration numeric kernel, invariants hoisted:')
+    kernel = KERNEL.format(20000)
+    plain = optimize.OptimizingParser(astt.Parser(lx.FastLexer(kernel)),
+                                      redundancy=False).parse()
+    hoisted = optimize.OptimizingParser(
+        astt.Parser(lx.FastLexer(kernel))).parse()
+    for name, engine in ENGINES.items():
+        print('  {:<8} {:.4f} s  -> {:.4f} s'.format(
+            name, run_time(engine, plain, 3), run_time(engine, hoisted, 3)))
+    interpreter = vm.VMSemantiff(ParsedProgram(program))
+    interpreter.find()
+    print('  vm: {:,} instructions, {:,} executed'.format(
+        len(interpreter.chunk), interpreter.executed))
+
+    stream = lx.FastLexer(text).tokenize_all()
+    print('Parse time:')
+    print('  fast lexer     {:.4f} s'.format(
+        parse_time(lambda: lx.FastLexer(text))))
+    print('  reused stream  {:.4f} s'.format(parse_time(stream.cursor)))
+
+    print('Memory held by the AST of {:,} characters:'.format(len(big)))
+    print('  Program      {:>12,} bytes'.format(
+        traced_bytes(lambda: astt.Parser(lx.FastLexer(big)).parse())))
+
+    cold, cached = cache_load_time(text)
+    print('Parse cache:')
+    print('  lex + parse    {:.4f} s'.format(cold))
+    print('  cache load     {:.4f} s'.format(cached))
+
+    print('Expression parsing:')
+    chain = 'x = ' + ' + '.join(['a * 2'] * 20000)
+    print('  20k-term chain       {:.4f} s'.format(
+        expression_parse_time(chain)))
+    nested = 'x = ' + '(' * 20000 + '1' + ')' * 20000
+    print('  20k nested parens    {:.4f} s'.format(
+        expression_parse_time(nested)))
+
+
+if __name__ == '__main__':
+    main()
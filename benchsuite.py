@@ -0,0 +1,295 @@
+# Repeatable throughput benchmarks for the lexer, the parser and the
+# evaluator, saved as JSON and compared against a baseline.
+# Run: python benchsuite.py [--save OUT.json] [--compare BASELINE.json]
+
+import argparse
+import json
+import platform
+import statistics
+import sys
+import time
+
+import lexer as lx
+import astt
+import bench
+import limits
+import smt
+
+
+####################################
+############ WORKLOADS #############
+####################################
+
+def sum_of_cubes(scale):
+    """The while loop of code.txt, summing cubes."""
+    return bench.LOOP.format(int(20000 * scale))
+
+
+def elseif_ladder(scale, arms=40):
+    """A loop through an elseif ladder of `arms` arms, each holding a
+    smaller ladder of its own."""
+    lines = ['i = 0', 'hits = 0', 'misses = 0',
+             'while i < {} do'.format(int(2000 * scale)),
+             '    r = i % {}'.format(arms + 1)]
+    for arm in range(arms):
+        lines.append('    {} r == {} then'.format(
+            'if' if arm == 0 else 'elseif', arm))
+        lines.append('        if i % 3 == 0 then')
+        lines.append('            hits = hits + {}'.format(arm))
+        lines.append('        elseif i % 3 == 1 then')
+        lines.append('            misses = misses + 1')
+        lines.append('        else')
+        lines.append('            hits = hits - 1')
+        lines.append('        end')
+    lines += ['    else', '        misses = misses + 1', '    end',
+              '    i = i + 1', 'end']
+    return '\n'.join(lines) + '\n'
+
+
+def long_expressions(scale, terms=150):
+    """Assignments of arithmetic expressions `terms` operands long."""
+    lines = ['a{} = {}'.format(k, k + 2) for k in range(7)]
+    for line in range(int(20 * scale)):
+        operands = ['(a{} * {} - {})'.format(j % 7, j + line, j % 13)
+                    for j in range(terms)]
+        lines.append('e{} = {}'.format(line, ' + '.join(operands)))
+    return '\n'.join(lines) + '\n'
+
+
+def straight_line(scale):
+    """A long file of assignments, each using the one before it."""
+    lines = ['v0 = 1']
+    for k in range(1, int(5000 * scale)):
+        lines.append('v{} = v{} + {} * 3 - {}'.format(k, k - 1, k, k % 7))
+    return '\n'.join(lines) + '\n'
+
+
+def deep_nesting(scale, depth=30, parens=60):
+    """A loop around `depth` nested ifs and whiles, innermost an
+    expression `parens` parentheses deep."""
+    lines = ['i = 0', 'd = 0', 'while i < {} do'.format(int(1000 * scale))]
+    indent = '    '
+    for level in range(depth):
+        if level % 2:
+            lines.append(indent + 'j{} = 0'.format(level))
+            lines.append(indent + 'while j{} < 1 do'.format(level))
+            lines.append(indent + '    j{0} = j{0} + 1'.format(level))
+        else:
+            lines.append(indent + 'if i >= {} then'.format(-level))
+        indent += '    '
+    lines.append(indent + 'd = d + ' + '(1 + ' * parens + '1' + ')' * parens)
+    for level in reversed(range(depth)):
+        indent = indent[:-4]
+        lines.append(indent + 'end')
+    lines += ['    i = i + 1', 'end']
+    return '\n'.join(lines) + '\n'
+
+
+WORKLOADS = {
+    'sum_of_cubes': sum_of_cubes,
+    'elseif_ladder': elseif_ladder,
+    'long_expressions': long_expressions,
+    'straight_line': straight_line,
+    'deep_nesting': deep_nesting,
+}
+
+
+####################################
+############# COUNTING #############
+####################################
+
+def count_nodes(program):
+    """Number of astt nodes in the tree under `program`."""
+    count = 0
+    pending = [program]
+    while pending:
+        node = pending.pop()
+        if type(node) is list:
+            pending.extend(node)
+        elif isinstance(node, astt.AST):
+            count += 1
+            pending.extend(getattr(node, field, None)
+                           for field in type(node).__slots__)
+    return count
+
+
+def count_statements(program):
+    """Statements a run of `program` executes, counting each test of a
+    while loop as one, as limits.Budget counts steps."""
+    budget = limits.Budget()
+    interpreter = smt.Semantiff(bench.ParsedProgram(program))
+    interpreter.set_budget(budget)
+    interpreter.find()
+    return budget.steps
+
+
+####################################
+############# MEASURING ############
+####################################
+
+def measure(run, warmup, repeat, min_time=0.02):
+    """Seconds per call of `run()`, `repeat` times over, after `warmup`
+    calls that are not timed. Calls quicker than `min_time` are timed in
+    batches that take at least that long, as timeit does."""
+    for _ in range(warmup):
+        run()
+    number = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(number):
+            run()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        number *= 2
+    times = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(number):
+            run()
+        times.append((time.perf_counter() - start) / number)
+    return times
+
+
+def result(count, unit, times):
+    """A result record. The rate is per second of the fastest run, which
+    is the least disturbed by whatever else the machine was doing."""
+    best = min(times)
+    return {
+        'unit': unit,
+        'count': count,
+        'seconds': times,
+        'best': best,
+        'median': statistics.median(times),
+        'rate': count / best if best else float('inf'),
+    }
+
+
+def bench_workload(text, engines, warmup, repeat):
+    """{stage: result} for one workload's source `text`."""
+    results = {}
+    tokens = bench.count_tokens(lx.FastLexer(text))
+    for name, lexer_class in lx.LEXERS.items():
+        times = measure(lambda: bench.count_tokens(lexer_class(text)),
+                        warmup, repeat)
+        results['lexer.' + name] = result(tokens, 'tokens', times)
+
+    # the parser reads a lexed stream, so that lexing is not timed again
+    stream = lx.FastLexer(text).tokenize_all()
+    program = astt.Parser(stream.cursor()).parse()
+    times = measure(lambda: astt.Parser(stream.cursor()).parse(),
+                    warmup, repeat)
+    results['parser'] = result(count_nodes(program), 'nodes', times)
+
+    statements = count_statements(program)
+    for name in engines:
+        engine = bench.ENGINES[name]
+        times = measure(lambda: engine(bench.ParsedProgram(program)).find(),
+                        warmup, repeat)
+        results['semantiff.' + name] = result(statements, 'statements', times)
+    return results
+
+
+def run_suite(workloads=None, engines=('tree',), scale=1.0, warmup=1,
+              repeat=5, log=None):
+    """Benchmark `workloads` (names, all by default) into a report dict,
+    ready for json.dump(). `log`, if given, is called with a line of
+    text as each result comes in."""
+    report = {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'machine': platform.machine(),
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'scale': scale,
+        'warmup': warmup,
+        'repeat': repeat,
+        'results': {},
+    }
+    for name in workloads or WORKLOADS:
+        text = WORKLOADS[name](scale)
+        results = bench_workload(text, engines, warmup, repeat)
+        report['results'][name] = results
+        if log:
+            for stage, record in results.items():
+                log(format_result(name, stage, record))
+    return report
+
+
+def format_result(workload, stage, record):
+    return '{:<18} {:<18} {:>14,.0f} {}/sec  (best {:.4f} s)'.format(
+        workload, stage, record['rate'], record['unit'], record['best'])
+
+
+####################################
+############ COMPARISON ############
+####################################
+
+def compare(report, baseline, threshold=0.10):
+    """Rows (workload, stage, baseline rate, rate, ratio, regressed) for
+    every result both reports have. A result regressed when its rate
+    fell by more than `threshold` (a fraction) from the baseline's."""
+    rows = []
+    for workload, results in report['results'].items():
+        before = baseline['results'].get(workload, {})
+        for stage, record in results.items():
+            old = before.get(stage)
+            if old is None or old['unit'] != record['unit']:
+                continue
+            ratio = record['rate'] / old['rate']
+            rows.append((workload, stage, old['rate'], record['rate'], ratio,
+                         ratio < 1 - threshold))
+    return rows
+
+
+def format_comparison(rows):
+    lines = ['{:<18} {:<18} {:>14} {:>14} {:>8}'.format(
+        'workload', 'stage', 'baseline/sec', 'now/sec', 'change')]
+    for workload, stage, old, new, ratio, regressed in rows:
+        lines.append('{:<18} {:<18} {:>14,.0f} {:>14,.0f} {:>+7.1%}{}'.format(
+            workload, stage, old, new, ratio - 1,
+            '  REGRESSION' if regressed else ''))
+    return '\n'.join(lines)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Benchmark the lexers, the parser and the evaluators.')
+    arg_parser.add_argument('--workload', action='append',
+                            choices=sorted(WORKLOADS),
+                            help='run only this workload (repeatable)')
+    arg_parser.add_argument('--engine', action='append',
+                            choices=sorted(bench.ENGINES),
+                            help='evaluator to time (repeatable; default tree)')
+    arg_parser.add_argument('--scale', type=float, default=1.0,
+                            help='multiply the size of every workload')
+    arg_parser.add_argument('--warmup', type=int, default=1)
+    arg_parser.add_argument('--repeat', type=int, default=5)
+    arg_parser.add_argument('--save', metavar='OUT',
+                            help='write the results to OUT as JSON')
+    arg_parser.add_argument('--compare', metavar='BASELINE',
+                            help='flag results slower than a saved run')
+    arg_parser.add_argument('--threshold', type=float, default=0.10,
+                            help='slowdown that counts as a regression '
+                                 '(default 0.10, i.e. 10%%)')
+    args = arg_parser.parse_args()
+
+    report = run_suite(args.workload, args.engine or ('tree',), args.scale,
+                       args.warmup, args.repeat, log=print)
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(report, f, indent=2)
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        if baseline.get('scale') != report['scale']:
+            print('note: the baseline ran at scale {}, this run at {}'.format(
+                baseline.get('scale'), report['scale']))
+        rows = compare(report, baseline, args.threshold)
+        print()
+        print(format_comparison(rows))
+        if any(row[-1] for row in rows):
+            sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,264 @@
+import hashlib
+import marshal
+import os
+import zlib
+
+import lexer as lx
+import astt
+
+
+# Bumped whenever the encoding below or the AST classes change, so that
+# entries written by an older version are parsed again instead of loaded.
+FORMAT_VERSION = 1
+_MAGIC = b'SLAC'
+_HEADER = _MAGIC + FORMAT_VERSION.to_bytes(2, 'little')
+
+DEFAULT_DIRECTORY = os.path.join(os.path.expanduser('~'), '.cache',
+                                 'speakinglua')
+DEFAULT_MAX_BYTES = 64 << 20
+
+
+####################################
+########## SERIALIZATION ###########
+####################################
+
+# Record opcodes. A tree is written as a flat list of records in postorder:
+# every record pushes one item on a stack, taking its operands (if any)
+# from the top of the stack, so loading needs no recursion however deep
+# the tree is.
+_NONE, _TOKEN, _LIST, _COMPOUND = range(4)
+
+# node classes rebuilt by calling them with their operands, in
+# constructor order
+_NODE_FIELDS = {
+    astt.Program: ('block',),
+    astt.Block: ('compound_statement',),
+    astt.While: ('test', 'body'),
+    astt.If: ('test', 'body', 'alt'),
+    astt.Assign: ('left', 'op', 'right'),
+    astt.BinOp: ('left', 'op', 'right'),
+    astt.Compare: ('left', 'op', 'right'),
+    astt.UnaryOp: ('op', 'expr'),
+    astt.Num: ('token',),
+    astt.BoolVal: ('token',),
+    astt.Var: ('token',),
+    astt.NoOp: (),
+    astt.Local: ('left', 'op', 'right'),
+}
+_NODE_CLASSES = tuple(_NODE_FIELDS)
+_NODE_CODES = {cls: code for code, cls in enumerate(_NODE_CLASSES, 4)}
+
+
+def dump_tree(node):
+    """Encode the tree under `node` as a list of marshal-friendly records."""
+    records = []
+    emit = records.append
+    # items still to visit; a ('done', ...) marker closes a composite item
+    # once everything it holds has been written
+    pending = [node]
+    done = object()
+    while pending:
+        item = pending.pop()
+        if type(item) is tuple and item and item[0] is done:
+            emit(item[1])
+            continue
+        if item is None:
+            emit((_NONE,))
+        elif isinstance(item, lx.Token):
+            emit((_TOKEN, int(item.kind), item.value, item.lineno, item.column))
+        elif type(item) is list:
+            pending.append((done, (_LIST, len(item))))
+            pending.extend(reversed(item))
+        elif type(item) is astt.Compound:
+            pending.append((done, (_COMPOUND, len(item.children))))
+            pending.extend(reversed(item.children))
+        else:
+            code = _NODE_CODES.get(type(item))
+            if code is None:
+                raise TypeError('cannot serialize {}'.format(type(item)))
+            pending.append((done, (code,)))
+            pending.extend(getattr(item, field)
+                           for field in reversed(_NODE_FIELDS[type(item)]))
+    return records
+
+
+def load_tree(records):
+    """Rebuild the tree encoded by dump_tree()."""
+    stack = []
+    push = stack.append
+    for record in records:
+        code = record[0]
+        if code == _TOKEN:
+            kind, value, lineno, column = record[1:]
+            push(lx.Token(lx.TOKEN_TYPES[kind], value, lineno, column))
+        elif code == _NONE:
+            push(None)
+        elif code == _LIST or code == _COMPOUND:
+            count = record[1]
+            items = stack[len(stack) - count:]
+            del stack[len(stack) - count:]
+            if code == _LIST:
+                push(items)
+            else:
+                node = astt.Compound()
+                node.children = items
+                push(node)
+        else:
+            cls = _NODE_CLASSES[code - 4]
+            count = len(_NODE_FIELDS[cls])
+            if count:
+                operands = stack[len(stack) - count:]
+                del stack[len(stack) - count:]
+                push(cls(*operands))
+            else:
+                push(cls())
+    if len(stack) != 1:
+        raise ValueError('malformed tree records')
+    return stack[0]
+
+
+####################################
+############ PARSE CACHE ###########
+####################################
+
+def source_key(text):
+    """Cache key of a source held as str or UTF-8 bytes."""
+    if isinstance(text, str):
+        text = text.encode('utf-8')
+    return hashlib.sha256(text).hexdigest()
+
+
+class ParseCache:
+    """Program trees stored on disk under the hash of their source.
+
+    Each entry is one file holding a format version stamp and the
+    compressed, marshalled records of dump_tree(). Loading an entry marks it as used;
+    once the entries take more than `max_bytes`, the least recently used
+    ones are removed. Entries with another format version, or that cannot
+    be read, count as misses and are removed.
+    """
+
+    def __init__(self, directory=DEFAULT_DIRECTORY,
+                 max_bytes=DEFAULT_MAX_BYTES):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        os.makedirs(directory, exist_ok=True)
+        self.hits = 0
+        self.misses = 0
+
+    def _path(self, key):
+        return os.path.join(self.directory, key + '.ast')
+
+    def get(self, text):
+        """The cached Program for `text`, or None."""
+        path = self._path(source_key(text))
+        try:
+            with open(path, 'rb') as f:
+                data = f.read()
+        except OSError:
+            self.misses += 1
+            return None
+        try:
+            if not data.startswith(_HEADER):
+                raise ValueError('stale cache entry')
+            records = marshal.loads(zlib.decompress(data[len(_HEADER):]))
+            program = load_tree(records)
+        except (ValueError, EOFError, TypeError, IndexError, zlib.error):
+            self._remove(path)
+            self.misses += 1
+            return None
+        # the modification time orders entries for eviction; an entry that
+        # another process evicted meanwhile is still a hit
+        try:
+            os.utime(path)
+        except OSError:
+            pass
+        self.hits += 1
+        return program
+
+    def put(self, text, program):
+        """Store `program` as the tree of `text`."""
+        path = self._path(source_key(text))
+        # level 1 shrinks entries about sixfold for little decompression
+        # time on load
+        data = _HEADER + zlib.compress(marshal.dumps(dump_tree(program)), 1)
+        # write then rename, so readers never see half an entry
+        temp = '{}.{}.tmp'.format(path, os.getpid())
+        with open(temp, 'wb') as f:
+            f.write(data)
+        os.replace(temp, path)
+        self.evict()
+
+    def parse(self, text, lexer_class=lx.FastLexer):
+        """Return the Program for `text`, parsing it only on a cache miss."""
+        program = self.get(text)
+        if program is None:
+            program = astt.Parser(lexer_class(text)).parse()
+            self.put(text, program)
+        return program
+
+    def evict(self):
+        """Remove least recently used entries until within max_bytes."""
+        entries = []
+        total = 0
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if not entry.name.endswith('.ast'):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+        if total <= self.max_bytes:
+            return
+        entries.sort()
+        for _, size, path in entries:
+            if total <= self.max_bytes:
+                break
+            self._remove(path)
+            total -= size
+
+    def clear(self):
+        with os.scandir(self.directory) as it:
+            for entry in it:
+                if entry.name.endswith('.ast'):
+                    self._remove(entry.path)
+
+    @staticmethod
+    def _remove(path):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+class CachedParser:
+    """Parser front-end over a source text that consults a ParseCache.
+
+    Has the parse() method of astt.Parser, so it can be handed to
+    smt.Semantiff; the source is only lexed and parsed when its tree is
+    not in the cache.
+    """
+
+    def __init__(self, text, cache=None, lexer_class=lx.FastLexer):
+        self.text = text
+        self.cache = cache if cache is not None else ParseCache()
+        self.lexer_class = lexer_class
+
+    def parse(self):
+        return self.cache.parse(self.text, self.lexer_class)
+
+
+def main():
+    with open('code.txt') as f:
+        text = f.read()
+    cache = ParseCache()
+    cache.parse(text)
+    cache.parse(text)
+    print('hits: {} misses: {}'.format(cache.hits, cache.misses))
+
+
+if __name__ == '__main__':
+    main()
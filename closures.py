@@ -0,0 +1,224 @@
+import lexer as lx
+import astt
+import smt
+import resolver
+
+
+NIL = lx.TokenType.NIL
+
+
+class ClosureCompiler:
+    """Turns an astt tree into nested Python closures.
+
+    Every node becomes a function of no arguments that does what
+    Semantiff.evaluate does for that node: constants are captured, child
+    nodes are compiled once into the closures of their parent, and
+    operators are resolved to Python callables up front. Running the
+    program is then one call of the root closure, with no type dispatch
+    or attribute lookups left on the way.
+    """
+
+    def __init__(self, symtab):
+        # the closures read and write this dict directly
+        self.symtab = symtab
+        # locals, by the slots resolver.py gives them
+        self.frame = []
+        self._compilers = {
+            int: self.compile_constant,
+            float: self.compile_constant,
+            type(None): self.compile_none,
+            list: self.compile_list,
+            astt.Num: self.compile_literal,
+            astt.BoolVal: self.compile_literal,
+            astt.Var: self.compile_Var,
+            astt.Assign: self.compile_Assign,
+            astt.Local: self.compile_Local,
+            astt.UnaryOp: self.compile_UnaryOp,
+            astt.BinOp: self.compile_BinOp,
+            astt.Compare: self.compile_Compare,
+            astt.While: self.compile_While,
+            astt.If: self.compile_If,
+            astt.Compound: self.compile_Compound,
+            astt.Block: self.compile_Block,
+            astt.Program: self.compile_Program,
+            astt.NoOp: self.compile_none,
+        }
+
+    def compile(self, node):
+        compiler = self._compilers.get(type(node))
+        if compiler is None:
+            raise Exception("Unexpected token error: " + str(type(node)))
+        return compiler(node)
+
+    def compile_constant(self, node):
+        return lambda: node
+
+    def compile_none(self, node):
+        return lambda: NIL
+
+    def compile_literal(self, node):
+        value = node.value
+        return lambda: value
+
+    def compile_list(self, nodes):
+        first = self.compile(nodes[0])
+        rest = tuple(self.compile(node) for node in nodes[1:])
+        if not rest:
+            return first
+
+        def run():
+            a = first()
+            for statement in rest:
+                statement()
+            return a
+        return run
+
+    def compile_Var(self, node):
+        if node.local:
+            frame = self.frame
+            slot = node.slot
+            return lambda: frame[slot]
+        name = node.value
+        get = self.symtab.get
+        return lambda: get(name, NIL)
+
+    def compile_Assign(self, node):
+        if node.left.local:
+            return self._store_local(node.left.slot, self.compile(node.right))
+        name = node.left.value
+        right = self.compile(node.right)
+        symtab = self.symtab
+
+        def run():
+            value = right()
+            if value is NIL:
+                symtab.pop(name, None)
+            else:
+                symtab[name] = value
+            return NIL
+        return run
+
+    def compile_Local(self, node):
+        return self._store_local(node.left.slot, self.compile(node.right))
+
+    def _store_local(self, slot, right):
+        frame = self.frame
+
+        def run():
+            frame[slot] = right()
+            return NIL
+        return run
+
+    def compile_UnaryOp(self, node):
+        function = smt.UNARY_OPS.get(node.op.kind)
+        if function is None:
+            return self._failing(
+                "Unrecognised unary operator: " + str(node.token))
+        operand = self.compile(node.expr)
+        return lambda: function(operand())
+
+    def compile_BinOp(self, node):
+        kind = node.op.kind
+        left = self.compile(node.left)
+        right = self.compile(node.right)
+        truthy = smt.bool
+        if kind == lx.Kind.OR:
+            def run():
+                cond = left()
+                return cond if truthy(cond) else right()
+            return run
+        if kind == lx.Kind.AND:
+            def run():
+                cond = left()
+                return right() if truthy(cond) else cond
+            return run
+        function = smt.ARITHMETIC_OPS.get(kind)
+        if function is None:
+            return self._failing(
+                "Unrecognised binary operator: " + str(node.op.type))
+        return self._strict(function, left, right)
+
+    def compile_Compare(self, node):
+        function = smt.COMPARE_OPS.get(node.op.kind)
+        if function is None:
+            return self._failing(
+                "Unrecognised compare operator: " + str(node.op))
+        return self._strict(function, self.compile(node.left),
+                            self.compile(node.right))
+
+    @staticmethod
+    def _strict(function, left, right):
+        """Closure applying `function` to two operands, nil if either is."""
+        def run():
+            a = left()
+            b = right()
+            if a is NIL or b is NIL:
+                return NIL
+            return function(a, b)
+        return run
+
+    @staticmethod
+    def _failing(message):
+        # Semantiff only complains about a bad operator once it runs it
+        def run():
+            raise Exception(message)
+        return run
+
+    def compile_While(self, node):
+        test = self.compile(node.test)
+        body = self.compile(node.body)
+        truthy = smt.bool
+
+        def run():
+            a = 0
+            while truthy(test()):
+                a = body()
+            return a
+        return run
+
+    def compile_If(self, node):
+        test = self.compile(node.test)
+        body = self.compile(node.body)
+        alt = self.compile(node.alt)
+        truthy = smt.bool
+        return lambda: body() if truthy(test()) else alt()
+
+    def compile_Compound(self, node):
+        return self.compile_list(node.children)
+
+    def compile_Block(self, node):
+        return self.compile(node.compound_statement)
+
+    def compile_Program(self, node):
+        self.frame[:] = [NIL] * resolver.resolve(node).local_count
+        return self.compile(node.block)
+
+
+class ClosureSemantiff(smt.Semantiff):
+    """Semantiff that compiles the program into closures before running it.
+
+    find() leaves the same symtab as Semantiff.find(). The compiled
+    program is kept in self.code and can be run again with run().
+    """
+
+    supports_budget = False
+
+    def find(self):
+        self.astt = self.parser.parse()
+        self.code = ClosureCompiler(self.symtab).compile(self.astt)
+        return self.code()
+
+    def run(self):
+        return self.code()
+
+
+def main():
+    with open('code.txt') as f:
+        text = f.read()
+    interpreter = ClosureSemantiff(astt.Parser(lx.FastLexer(text)))
+    interpreter.find()
+    print(interpreter.symtab)
+
+
+if __name__ == '__main__':
+    main()
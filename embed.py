@@ -0,0 +1,285 @@
+# Run many independent scripts from a Python program, on a pool of
+# worker processes.
+# Run: python embed.py [-j WORKERS] [--threads] [--repeat N] PATH...
+
+import argparse
+import collections
+import concurrent.futures
+import math
+import os
+import threading
+import time
+
+import lexer as lx
+import astt
+import smt
+import limits
+import resolver
+
+
+NIL = lx.TokenType.NIL
+
+# latency samples kept for stats()
+SAMPLES = 10000
+
+
+def percentile(samples, fraction):
+    """Nearest-rank percentile of `samples`, e.g. fraction 0.99 for p99;
+    None when there are none."""
+    if not samples:
+        return None
+    ordered = sorted(samples)
+    rank = math.ceil(fraction * len(ordered))
+    return ordered[min(max(rank, 1), len(ordered)) - 1]
+
+
+def summary(samples):
+    """count, mean, p50, p99 and max of latency `samples`, in seconds."""
+    return {
+        'count': len(samples),
+        'mean': sum(samples) / len(samples) if samples else None,
+        'p50': percentile(samples, 0.50),
+        'p99': percentile(samples, 0.99),
+        'max': max(samples) if samples else None,
+    }
+
+
+class Worker:
+    """Runs scripts, each in an interpreter state of its own, keeping the
+    programs it has parsed.
+
+    A program is parsed and resolved once per worker and kept, by its
+    source text, up to `cache_size` of them; a run only builds a fresh
+    symtab and frame around it. `budget` holds limits.Budget arguments
+    (max_steps, max_seconds, max_memory) applied to every run.
+    """
+
+    def __init__(self, cache_size=256, budget=None):
+        self.cache_size = cache_size
+        self.budget = dict(budget or {})
+        # source text -> (program, global names, local count)
+        self._programs = collections.OrderedDict()
+        self._lock = threading.Lock()
+
+    def program(self, script):
+        with self._lock:
+            entry = self._programs.get(script)
+            if entry is not None:
+                self._programs.move_to_end(script)
+                return entry
+        program = astt.Parser(lx.FastLexer(script)).parse()
+        resolution = resolver.resolve(program)
+        entry = (program, resolution.global_names, resolution.local_count)
+        with self._lock:
+            self._programs[script] = entry
+            if len(self._programs) > self.cache_size:
+                self._programs.popitem(last=False)
+        return entry
+
+    def run(self, script, bindings=None):
+        """(final globals, seconds) of running `script` with the globals
+        in dict `bindings` set first."""
+        start = time.perf_counter()
+        program, global_names, local_count = self.program(script)
+        # the program's globals take the slots it was resolved with
+        symtab = resolver.GlobalsView()
+        for name in global_names:
+            symtab.slot(name)
+        for name, value in (bindings or {}).items():
+            symtab[name] = value
+        interpreter = smt.Semantiff(None)
+        interpreter.symtab = symtab
+        interpreter.globals = symtab.cells
+        interpreter.frame = [NIL] * local_count
+        if self.budget:
+            interpreter.set_budget(limits.Budget(**self.budget))
+        interpreter.evaluate(program)
+        return dict(symtab.items()), time.perf_counter() - start
+
+
+# the Worker of a pool process
+_worker = None
+
+
+def _start_worker(cache_size, budget):
+    global _worker
+    _worker = Worker(cache_size, budget)
+
+
+def _run_in_worker(script, bindings):
+    return _worker.run(script, bindings)
+
+
+class ScriptPool:
+    """Runs scripts concurrently, each with its own Semantiff and symtab.
+
+    submit(script, bindings) returns a concurrent.futures.Future whose
+    result is the dict of the script's final globals, or whose exception
+    is the error it raised (lexer.LexerError, lexer.ParserError,
+    lexer.LimitExceeded, ...). `bindings` are the initial globals:
+    numbers and booleans by name.
+
+    Processes or threads: evaluation is pure Python and holds the GIL
+    for its whole run, so scripts on threads of one process take turns
+    and a pool of threads runs no faster than one thread. The default is
+    therefore a pool of `workers` processes (os.cpu_count() by default),
+    which run scripts in parallel; the cost is sending the script, its
+    bindings and its results across a pipe, tens of microseconds a task.
+    threads=True runs on threads of this process instead, which is only
+    worth it when the scripts are tiny and that cost would dominate, or
+    when processes cannot be started.
+
+    Workers are started once and kept, and each keeps the programs it
+    has parsed (see Worker), so a script that is run again is only
+    evaluated. `budget` (keyword arguments of limits.Budget) caps every
+    run, so a runaway script cannot hold a worker forever.
+
+    stats() reports the tasks submitted, completed and failed, the queue
+    depth, and summaries of each task's latency (submit to result) and
+    run time (in the worker; on threads that includes waiting for the
+    GIL).
+    """
+
+    def __init__(self, workers=None, threads=False, cache_size=256,
+                 budget=None):
+        self.workers = workers or os.cpu_count() or 1
+        self.threads = threads
+        if threads:
+            self._executor = concurrent.futures.ThreadPoolExecutor(
+                self.workers)
+            self._call = Worker(cache_size, budget).run
+        else:
+            self._executor = concurrent.futures.ProcessPoolExecutor(
+                self.workers, initializer=_start_worker,
+                initargs=(cache_size, budget))
+            self._call = _run_in_worker
+        self._lock = threading.Lock()
+        self.submitted = 0
+        self.completed = 0
+        self.failed = 0
+        self.max_queue_depth = 0
+        # submit to result, and time in the interpreter
+        self._latency = collections.deque(maxlen=SAMPLES)
+        self._run_time = collections.deque(maxlen=SAMPLES)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.shutdown()
+
+    def shutdown(self, wait=True):
+        self._executor.shutdown(wait=wait)
+
+    def submit(self, script, bindings=None):
+        """Future of the final globals of `script`, run with the initial
+        globals `bindings`."""
+        for name, value in (bindings or {}).items():
+            if type(value) not in (int, float, bool):
+                raise TypeError('binding {!r} is not a number or boolean: '
+                                '{!r}'.format(name, value))
+        future = concurrent.futures.Future()
+        start = time.perf_counter()
+        with self._lock:
+            self.submitted += 1
+            self.max_queue_depth = max(self.max_queue_depth,
+                                       self.queue_depth)
+        task = self._executor.submit(self._call, script, bindings)
+        task.add_done_callback(
+            lambda task: self._finish(task, future, start))
+        return future
+
+    def map(self, scripts, bindings=None):
+        """Final globals of each of `scripts`, in order, all run with
+        `bindings`; the first error is raised."""
+        futures = [self.submit(script, bindings) for script in scripts]
+        return [future.result() for future in futures]
+
+    def _finish(self, task, future, start):
+        if task.cancelled():
+            future.cancel()
+            return
+        latency = time.perf_counter() - start
+        error = task.exception()
+        with self._lock:
+            self.completed += 1
+            self._latency.append(latency)
+            if error is None:
+                symtab, seconds = task.result()
+                self._run_time.append(seconds)
+            else:
+                self.failed += 1
+        if error is None:
+            future.set_result(symtab)
+        else:
+            future.set_exception(error)
+
+    @property
+    def pending(self):
+        """Tasks submitted and not finished."""
+        return self.submitted - self.completed
+
+    @property
+    def queue_depth(self):
+        """Tasks waiting for a worker: those pending beyond one per
+        worker."""
+        return max(0, self.pending - self.workers)
+
+    def stats(self):
+        with self._lock:
+            return {
+                'workers': self.workers,
+                'threads': self.threads,
+                'submitted': self.submitted,
+                'completed': self.completed,
+                'failed': self.failed,
+                'pending': self.pending,
+                'queue_depth': self.queue_depth,
+                'max_queue_depth': self.max_queue_depth,
+                'latency': summary(list(self._latency)),
+                'run_time': summary(list(self._run_time)),
+            }
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Run scripts on a pool of workers and report latency.')
+    arg_parser.add_argument('paths', nargs='+', metavar='PATH')
+    arg_parser.add_argument('-j', '--workers', type=int, default=None)
+    arg_parser.add_argument('--threads', action='store_true',
+                            help='use threads instead of processes')
+    arg_parser.add_argument('--repeat', type=int, default=1,
+                            help='run every script this many times')
+    arg_parser.add_argument('--max-steps', type=int, default=None)
+    args = arg_parser.parse_args()
+    scripts = []
+    for path in args.paths:
+        with open(path) as f:
+            scripts.append((path, f.read()))
+    budget = {'max_steps': args.max_steps} if args.max_steps else None
+    start = time.perf_counter()
+    with ScriptPool(args.workers, args.threads, budget=budget) as pool:
+        futures = [(path, pool.submit(script))
+                   for _ in range(args.repeat) for path, script in scripts]
+        for path, future in futures[-len(scripts):]:
+            try:
+                print('{}: {}'.format(path, future.result()))
+            except Exception as e:
+                print('{}: {}'.format(path, getattr(e, 'message', e)))
+        concurrent.futures.wait([future for _, future in futures])
+        elapsed = time.perf_counter() - start
+        stats = pool.stats()
+    print('{} tasks, {} failed, {:.3f} s on {} {}, max queue depth {}'.format(
+        stats['completed'], stats['failed'], elapsed, stats['workers'],
+        'threads' if stats['threads'] else 'processes',
+        stats['max_queue_depth']))
+    for name in ('latency', 'run_time'):
+        numbers = stats[name]
+        if numbers['count']:
+            print('  {:<9} mean {:.2f} ms  p50 {:.2f} ms  p99 {:.2f} ms'.format(
+                name, numbers['mean'] * 1e3, numbers['p50'] * 1e3,
+                numbers['p99'] * 1e3))
+
+
+if __name__ == '__main__':
+    main()
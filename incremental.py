@@ -0,0 +1,236 @@
+import bisect
+from itertools import accumulate
+
+import lexer as lx
+import astt
+
+
+class _TrackingLexer:
+    """FastLexer that remembers where the tokens it hands out start and end."""
+
+    def __init__(self, text, pos):
+        # Tokens get their line and column as they are lexed. Lazy
+        # positions would hold a LineIndex of this version of the text in
+        # every token, so the statements reused across edits would keep
+        # one copy of the text alive per edit.
+        self.lexer = lx.FastLexer(text)
+        self.lexer.seek(pos)
+        # span of the last token returned, and end of the one before it
+        self.start = self.end = self.prev_end = pos
+
+    def get_next_token(self):
+        token = self.lexer.get_next_token()
+        self.prev_end = self.end
+        self.start = self.lexer.token_start
+        self.end = self.lexer.pos
+        return token
+
+
+class _Spans:
+    """Offsets of a sequence of statements, stored relative to each other.
+
+    Each statement is kept as its lead, the gap from the end of the one
+    before it (or from offset 0), and its length, in blocks of at most
+    BLOCK statements that know their total width. An edit changes the
+    spans of the statements it parses again and the lead of the statement
+    after them; nothing else moves. Locating an offset sums the block
+    widths and then walks a single block.
+    """
+    BLOCK = 128
+
+    def __init__(self):
+        self._leads = []
+        self._lengths = []
+        self._widths = []
+
+    def __len__(self):
+        return sum(map(len, self._leads))
+
+    def _block_of(self, index):
+        """(block, index within it, offset the block starts at)."""
+        counts = list(accumulate(map(len, self._leads)))
+        block = bisect.bisect_right(counts, index)
+        if block == len(counts):
+            raise IndexError(index)
+        before = counts[block - 1] if block else 0
+        return block, index - before, sum(self._widths[:block])
+
+    def span(self, index):
+        """(start, end) offsets of statement `index`."""
+        block, index, pos = self._block_of(index)
+        leads = self._leads[block]
+        lengths = self._lengths[block]
+        pos += sum(leads[:index + 1]) + sum(lengths[:index])
+        return pos, pos + lengths[index]
+
+    def count_through(self, offset):
+        """Number of statements that start at or before `offset`."""
+        bases = list(accumulate(self._widths, initial=0))
+        block = bisect.bisect_right(bases, offset, 0, len(self._widths)) - 1
+        if block < 0:
+            return 0
+        count = sum(map(len, self._leads[:block]))
+        pos = bases[block]
+        for lead, length in zip(self._leads[block], self._lengths[block]):
+            pos += lead
+            if pos > offset:
+                break
+            count += 1
+            pos += length
+        return count
+
+    def find(self, offset):
+        """Index of the statement starting at `offset`, or None."""
+        count = self.count_through(offset)
+        if count and self.span(count - 1)[0] == offset:
+            return count - 1
+        return None
+
+    def replace(self, first, stop, starts, ends, next_start=None):
+        """Replace the statements first to stop - 1 by statements spanning
+        `starts` and `ends`; the statement at `stop`, if any, now starts at
+        `next_start`. Offsets are those of the text after the edit."""
+        total = len(self)
+        if total:
+            low, first_in, base = self._block_of(min(first, total - 1))
+            if first == total:
+                first_in += 1
+            high = self._block_of(min(stop, total - 1))[0] + 1
+        else:
+            low = high = first_in = base = 0
+        leads = [lead for block in self._leads[low:high] for lead in block]
+        lengths = [length for block in self._lengths[low:high]
+                   for length in block]
+        prev = base + sum(leads[:first_in]) + sum(lengths[:first_in])
+        new_leads = []
+        new_lengths = []
+        for start, end in zip(starts, ends):
+            new_leads.append(start - prev)
+            new_lengths.append(end - start)
+            prev = end
+        stop_in = first_in + stop - first
+        if stop < total:
+            leads[stop_in] = next_start - prev
+        leads[first_in:stop_in] = new_leads
+        lengths[first_in:stop_in] = new_lengths
+        # split into blocks of even size
+        parts = max(1, -(-len(leads) // self.BLOCK))
+        bounds = [len(leads) * k // parts for k in range(parts + 1)]
+        chunks = list(zip(bounds, bounds[1:])) if leads else []
+        self._leads[low:high] = [leads[i:j] for i, j in chunks]
+        self._lengths[low:high] = [lengths[i:j] for i, j in chunks]
+        self._widths[low:high] = [sum(leads[i:j]) + sum(lengths[i:j])
+                                  for i, j in chunks]
+
+
+class IncrementalParser:
+    """Keeps the AST of an edited source up to date.
+
+    The top-level statements of the program are kept together with the
+    offsets they span. After an edit only the statements around the edit
+    are lexed and parsed again; parsing stops as soon as it reaches the
+    start of an old statement past the edit, and that statement and every
+    one after it are reused as they are. The offsets are stored relative
+    to each other (see _Spans), so the statements after an edit need no
+    update wherever the edits fall, and the work per edit depends on the
+    size of the statements touched rather than on the size of the file.
+
+    Tokens in reused statements keep the line and column numbers they had
+    when they were parsed; statement_span() gives current offsets.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        # top-level statements and the offsets of their first token and
+        # just past their last token
+        self.statements = []
+        self._spans = _Spans()
+        self.program = astt.Program(astt.Block(astt.Compound()))
+        self.program.block.compound_statement.children = self.statements
+        # statements parsed and reused by the last update
+        self.reparsed = 0
+        self.reused = 0
+        self._valid = False
+        self._update(0, 0)
+
+    def parse(self):
+        """Return the Program node for the current text."""
+        if not self._valid:
+            self._update(0, 0)
+        return self.program
+
+    def statement_span(self, index):
+        """(start, end) offsets of top-level statement `index`."""
+        return self._spans.span(index)
+
+    def edit(self, offset, deleted, inserted):
+        """Replace `deleted` characters at `offset` with `inserted`.
+
+        Returns the updated Program node. If the new text does not parse,
+        the exception propagates and the next call parses from scratch.
+        """
+        self.text = self.text[:offset] + inserted + self.text[offset + deleted:]
+        if not self._valid:
+            self._update(0, 0)
+            return self.program
+
+        # The statement before the edit can grow into it, e.g. 'a = 1'
+        # followed by an inserted '+ 2', and the one before that can
+        # swallow the first token of the edited statement.
+        first = self._spans.count_through(offset) - 2
+        if first < 0:
+            self._update(0, 0)
+        else:
+            self._update(first, self._spans.span(first)[0], offset + deleted,
+                         len(inserted) - deleted)
+        return self.program
+
+    def _update(self, first, pos, damage_end=None, delta=0):
+        """Parse from statement `first`, which starts at `pos`, until the
+        parse lines up with an old statement past the damaged region."""
+        self._valid = False
+        tracker = _TrackingLexer(self.text, pos)
+        parser = astt.Parser(tracker)
+        nodes = []
+        starts = []
+        ends = []
+        start = None
+        while parser.current_token.kind != lx.Kind.EOF:
+            if parser.current_token.kind in astt.BLOCK_END:
+                parser.error()
+            start = tracker.start
+            if damage_end is not None and start >= damage_end + delta:
+                # same text from here on; resynchronize if an old
+                # statement started at the same place
+                resume = self._spans.find(start - delta)
+                if resume is not None:
+                    break
+            nodes.append(parser.statement())
+            starts.append(start)
+            ends.append(tracker.prev_end)
+        else:
+            resume = len(self.statements)
+        if first == 0 and not nodes and resume == len(self.statements):
+            # no statement at all, which astt.Parser rejects too
+            parser.error()
+
+        self.reparsed = len(nodes)
+        self.reused = first + len(self.statements) - resume
+        self.statements[first:resume] = nodes
+        self._spans.replace(first, resume, starts, ends, start)
+        self._valid = True
+
+
+def main():
+    with open('code.txt') as f:
+        text = f.read()
+    doc = IncrementalParser(text)
+    offset = text.index('a3 = 7')
+    doc.edit(offset + len('a3 = '), 1, '8')
+    print('re-parsed {} statement(s), reused {}'.format(doc.reparsed, doc.reused))
+    start, end = doc.statement_span(2)
+    print(doc.text[start:end])
+
+
+if __name__ == '__main__':
+    main()
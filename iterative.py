@@ -0,0 +1,319 @@
+# Evaluate programs with an explicit work stack instead of recursion.
+# Run: python iterative.py [FILE]
+
+import sys
+
+import lexer as lx
+import astt
+import smt
+import profiler
+
+
+NIL = lx.TokenType.NIL
+
+# continuations, pushed on the work stack as (code, node)
+_BINARY = 0      # pop right and left, push the operation on them
+_RIGHT_LEAF = 1  # pop left, read the right operand, push the operation
+_OR = 2          # left is on the value stack
+_AND = 3
+_UNARY = 4
+_ASSIGN = 5      # value on the value stack; the statement's value is nil
+_STORE = 6       # an assignment whose value is not needed
+_WHILE = 7       # test value on top of the last body value
+_IF = 8          # test value on the value stack
+_DISCARD = 9     # drop the value of a statement after the first
+
+_DISCARD_ITEM = (_DISCARD, None)
+
+
+class IterativeSemantiff(smt.Semantiff):
+    """Semantiff that runs the tree with its own stacks.
+
+    Nodes to evaluate and the continuations of the nodes under way are
+    kept on a work stack, their values on a value stack, and a single
+    loop takes items off the work stack. Python's stack stays the same
+    depth whatever the depth of the tree, so expression chains, elseif
+    ladders and nesting of any length run without RecursionError.
+
+    Variables and literals are read where they are operands instead of
+    going through the stacks; expressions have no side effects, so the
+    order of such reads does not matter. Statements after the first of
+    a list, whose values Semantiff drops, do not produce one.
+
+    Results are those of Semantiff.find(): the same symtab, the same
+    return value and the same errors, raised at the same point.
+
+    As the whole state of a run is in the two stacks, a run can stop
+    and go on later: start() sets it up and resume(steps) runs a slice
+    of it (see aio.py). A budget set with set_budget() is checked
+    between such slices, so it limits steps and seconds as it does for
+    Semantiff, give or take the statement under way when a limit is
+    reached; it cannot limit memory.
+    """
+
+    def find(self):
+        self.astt = self.parser.parse()
+        self.resolve(self.astt)
+        return self.run()
+
+    def run(self):
+        return self.execute(self.astt)
+
+    def set_budget(self, budget):
+        """Run under `budget` (a limits.Budget) from now on, or without
+        limits if it is None. Raises TypeError for a budget that limits
+        memory."""
+        if budget is not None:
+            budget.attach(self)
+        if self.budget is not None and self.budget is not budget:
+            self.budget.remove(self)
+        self.budget = budget
+
+    def execute(self, root):
+        """Value of `root`, evaluated as Semantiff.evaluate would."""
+        self.start(root)
+        while not self.run_slice():
+            pass
+        return self.value
+
+    def start(self, root):
+        """Set up to evaluate `root`; resume() does the work."""
+        self._work = [root]
+        self._values = []
+        self.value = None
+        self.unused_steps = 0
+        if self.budget is not None:
+            self.budget.start()
+
+    def run_slice(self, steps=None):
+        """resume(steps), within the budget if there is one: the slice
+        ends where the budget's limits are due to be checked, and going
+        over them raises lexer.LimitExceeded."""
+        budget = self.budget
+        if budget is None:
+            return self.resume(steps)
+        allowance = budget.allowance()
+        if steps is not None:
+            allowance = min(allowance, steps)
+        try:
+            done = self.resume(allowance)
+            taken = allowance - self.unused_steps
+            if done:
+                budget.steps += taken
+            else:
+                budget.advance(taken, self._position())
+        except BaseException:
+            budget.stop()
+            raise
+        if done:
+            budget.stop()
+        return done
+
+    def _position(self):
+        """The next node to run that has a source line, or None."""
+        for item in reversed(self._work):
+            node = item[1] if type(item) is tuple else item
+            while type(node) is list or type(node) is astt.Compound:
+                node = node[0] if type(node) is list else node.children[0]
+            if profiler.node_line(node) is not None:
+                return node
+        return None
+
+    def resume(self, steps=None):
+        """Evaluate until done, then set self.value and return True; or,
+        given `steps`, stop after that many steps and return False, to be
+        resumed later where it stopped. Steps are those limits.Budget
+        counts, statements and tests of while loops; the steps left over
+        when the run is done are in self.unused_steps."""
+        # counted down at the entry and back-edges of while loops, at the
+        # start of a statement list and at the end of the statements after
+        # its first; never 0 when there is no limit
+        steps = -1 if steps is None else steps
+        globals_ = self.globals
+        frame = self.frame
+        truthy = smt.bool
+        Var = astt.Var
+        Num = astt.Num
+        BoolVal = astt.BoolVal
+        BinOp = astt.BinOp
+        Compare = astt.Compare
+        Assign = astt.Assign
+        OR = lx.Kind.OR
+        AND = lx.Kind.AND
+
+        work = self._work
+        values = self._values
+        pop = work.pop
+        push = work.append
+        result = values.append
+        take = values.pop
+        while work:
+            node = pop()
+            kind = type(node)
+            if kind is tuple:
+                code, node = node
+                if code == _RIGHT_LEAF or code == _BINARY:
+                    if code == _BINARY:
+                        right = take()
+                    else:
+                        right = node.right
+                        if type(right) is Var:
+                            right = (frame[right.slot] if right.local
+                                     else globals_[right.slot])
+                        else:
+                            right = right.value
+                    left = take()
+                    if left is NIL or right is NIL:
+                        result(NIL)
+                    else:
+                        result(node.function(left, right))
+                elif code == _STORE or code == _ASSIGN:
+                    left = node.left
+                    if left.local:
+                        frame[left.slot] = take()
+                    else:
+                        globals_[left.slot] = take()
+                    if code == _ASSIGN:
+                        result(NIL)
+                    else:
+                        steps -= 1
+                        if steps == 0:
+                            return False
+                elif code == _DISCARD:
+                    take()
+                    steps -= 1
+                    if steps == 0:
+                        return False
+                elif code == _WHILE:
+                    if truthy(take()):
+                        take()
+                        push((_WHILE, node))
+                        push(node.test)
+                        push(node.body)
+                        steps -= 1
+                        if steps == 0:
+                            return False
+                elif code == _IF:
+                    push(node.body if truthy(take()) else node.alt)
+                elif code == _OR:
+                    if not truthy(values[-1]):
+                        take()
+                        push(node.right)
+                elif code == _AND:
+                    if truthy(values[-1]):
+                        take()
+                        push(node.right)
+                else:
+                    result(node.function(take()))
+            elif kind is BinOp or kind is Compare:
+                function = node.function
+                if function is None:
+                    op = node.op.kind
+                    if kind is BinOp:
+                        if op == OR or op == AND:
+                            push((_OR if op == OR else _AND, node))
+                            push(node.left)
+                            continue
+                        raise Exception("Unrecognised binary operator: "
+                                        + str(node.op.type))
+                    raise Exception("Unrecognised compare operator: "
+                                    + str(node.op))
+                left = node.left
+                right = node.right
+                left_kind = type(left)
+                right_kind = type(right)
+                if left_kind is Var:
+                    left = (frame[left.slot] if left.local
+                            else globals_[left.slot])
+                elif left_kind is Num or left_kind is BoolVal:
+                    left = left.value
+                else:
+                    # the right operand waits for the left one
+                    if (right_kind is Var or right_kind is Num
+                            or right_kind is BoolVal):
+                        push((_RIGHT_LEAF, node))
+                    else:
+                        push((_BINARY, node))
+                        push(right)
+                    push(left)
+                    continue
+                if right_kind is Var:
+                    right = (frame[right.slot] if right.local
+                             else globals_[right.slot])
+                elif right_kind is Num or right_kind is BoolVal:
+                    right = right.value
+                else:
+                    result(left)
+                    push((_BINARY, node))
+                    push(right)
+                    continue
+                if left is NIL or right is NIL:
+                    result(NIL)
+                else:
+                    result(function(left, right))
+            elif kind is Var:
+                result(frame[node.slot] if node.local else globals_[node.slot])
+            elif kind is Num or kind is BoolVal:
+                result(node.value)
+            elif kind is list or kind is astt.Compound:
+                # the value of a statement list is that of its first
+                # statement; the others are evaluated and dropped
+                children = node if kind is list else node.children
+                for child in children[:0:-1]:
+                    if type(child) is Assign:
+                        push((_STORE, child))
+                        push(child.right)
+                    else:
+                        push(_DISCARD_ITEM)
+                        push(child)
+                push(children[0])
+                steps -= 1
+                if steps == 0:
+                    return False
+            elif kind is Assign or kind is astt.Local:
+                push((_ASSIGN, node))
+                push(node.right)
+            elif kind is astt.While:
+                # the value of a loop that never runs its body
+                result(0)
+                push((_WHILE, node))
+                push(node.test)
+                steps -= 1
+                if steps == 0:
+                    return False
+            elif kind is astt.If:
+                push((_IF, node))
+                push(node.test)
+            elif kind is astt.UnaryOp:
+                if node.function is None:
+                    raise Exception(
+                        "Unrecognised unary operator: " + str(node.token))
+                push((_UNARY, node))
+                push(node.expr)
+            elif node is None or kind is astt.NoOp:
+                result(NIL)
+            elif kind is astt.Block:
+                push(node.compound_statement)
+            elif kind is astt.Program:
+                push(node.block)
+            elif kind is int or kind is float:
+                result(node)
+            else:
+                # Find weird tokens
+                raise Exception("Unexpected token error: " + str(kind))
+        self.value = take()
+        self.unused_steps = steps
+        return True
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else 'code.txt'
+    with open(path) as f:
+        text = f.read()
+    interpreter = IterativeSemantiff(astt.Parser(lx.FastLexer(text)))
+    interpreter.find()
+    print(interpreter.symtab)
+
+
+if __name__ == '__main__':
+    main()
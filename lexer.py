@@ -1,4 +1,8 @@
-from enum import Enum
+from array import array
+from bisect import bisect_right
+from enum import Enum, IntEnum
+import mmap
+import os
 import re
 
 
@@ -6,6 +10,7 @@ class ErrorCode(Enum):
     UNEXPECTED_TOKEN = 'Unexpected token'
     ID_NOT_FOUND = 'Identifier not found'
     DUPLICATE_ID = 'Duplicate id found'
+    LIMIT_EXCEEDED = 'Limit exceeded'
 
 
 class Error(Exception):
@@ -14,10 +19,22 @@ class Error(Exception):
         self.token = token
         # add exception class name before the message
         self.message = f'{self.__class__.__name__}: {message}'
+        super().__init__(self.message)
+
+    def __reduce__(self):
+        # rebuilt from its attributes, e.g. when it comes back from a
+        # worker process
+        return _rebuild_error, (self.__class__, self.__dict__)
+
+
+def _rebuild_error(cls, state):
+    error = cls.__new__(cls)
+    error.__dict__.update(state)
+    Exception.__init__(error, error.message)
+    return error
 
 
 class LexerError(Error):
-    # print(Error)
     pass
 
 
@@ -28,6 +45,25 @@ class ParserError(Error):
 class SemanticError(Error):
     pass
 
+
+class LimitExceeded(SemanticError):
+    """A run went over its limits.Budget. `limit` is 'steps', 'seconds'
+    or 'memory', `used` what the run had taken of it when it was stopped
+    and `allowed` the budget; `lineno` is the line it was stopped at."""
+
+    def __init__(self, limit, used, allowed, lineno=None):
+        self.limit = limit
+        self.used = used
+        self.allowed = allowed
+        self.lineno = lineno
+        where = '' if lineno is None else ' on line {}'.format(lineno)
+        if type(used) is float:
+            used = round(used, 3)
+        super().__init__(
+            error_code=ErrorCode.LIMIT_EXCEEDED,
+            message='{} limit of {} exceeded{} (used {})'.format(
+                limit, allowed, where, used))
+
 # luaX_tokens = (
 #     "and", "break", "do", "else", "elseif",
 #     "end", "false", "for", "function", "goto", "if",
@@ -107,9 +143,22 @@ class TokenType(Enum):
     STRING = '<string>'
 
 
+# Small integer codes for the token types, in TokenType order. Tokens
+# carry both: `type` is the printable TokenType, `kind` the Kind that the
+# parser and the evaluator compare, hash and index with.
+Kind = IntEnum('Kind', [token_type.name for token_type in TokenType], start=0)
+for _token_type in TokenType:
+    _token_type.kind = Kind[_token_type.name]
+del _token_type
+
+
 class Token:
+    # no per-token __dict__; parse trees keep their tokens alive
+    __slots__ = ('type', 'kind', 'value', 'lineno', 'column')
+
     def __init__(self, type, value, lineno=None, column=None):
         self.type = type
+        self.kind = type.kind if type is not None else None
         self.value = value
         self.lineno = lineno
         self.column = column
@@ -131,6 +180,31 @@ class Token:
         return self.__str__()
 
 
+class LazyToken(Token):
+    """Token that only records the offset at which it starts.
+
+    lineno and column are worked out from a LineIndex of the source when
+    they are first read, so scanning does no line bookkeeping at all.
+    """
+
+    __slots__ = ('offset', 'lines')
+
+    def __init__(self, type, value, offset, lines):
+        self.type = type
+        self.kind = type.kind
+        self.value = value
+        self.offset = offset
+        self.lines = lines
+
+    @property
+    def lineno(self):
+        return self.lines.locate(self.offset)[0]
+
+    @property
+    def column(self):
+        return self.lines.locate(self.offset)[1]
+
+
 def _build_reserved_keywords():
     """Build a dictionary of reserved keywords.
     The function relies on the fact that in the TokenType
@@ -169,9 +243,7 @@ class Lexer:
             lineno=self.lineno,
             column=self.column,
         )
-        print(s)
-        exit()
-        # raise LexerError(s)
+        raise LexerError(error_code=ErrorCode.UNEXPECTED_TOKEN, message=s)
 
     def advance(self):
         """Advance the `pos` pointer and set the `current_char` variable."""
@@ -252,6 +324,7 @@ class Lexer:
         try:
             token.value = string
             token.type = TokenType.STRING
+            token.kind = Kind.STRING
         except ValueError:
             self.error()
 
@@ -285,11 +358,13 @@ class Lexer:
             token.value = int(
                 result, 10) if 'x' not in result else int(result, 16)
             token.type = TokenType.INTEGER
+            token.kind = Kind.INTEGER
         except ValueError:
             # try:
             token.value = float(
                 result) if 'x' not in result else float.fromhex(result)
             token.type = TokenType.NUMBER
+            token.kind = Kind.NUMBER
             # except ValueError:
             # try:
             #     token.value = float.fromhex(
@@ -319,6 +394,7 @@ class Lexer:
             # reserved keyword
             token.type = token_type
             token.value = value.upper()
+        token.kind = token.type.kind
 
         return token
 
@@ -400,3 +476,531 @@ class Lexer:
         # EOF (end-of-file) token indicates that there is no more
         # input left for lexical analysis
         return Token(type=TokenType.EOF, value=None)
+
+    def tokenize_all(self):
+        """Lex the whole input in one pass into a TokenStream."""
+        return TokenStream(self.text)
+
+
+####################################
+######### FAST SCANNER #############
+####################################
+
+# Operator lexemes, longest first so that the regex alternation prefers
+# '...' over '..' over '.', '==' over '=' and so on.
+_OPERATORS = {
+    token_type.value: token_type
+    for token_type in TokenType
+    if len(token_type.value) <= 3 and not token_type.value[0].isalnum()
+}
+
+# identifier text -> (token type, token value) for reserved words
+_KEYWORD_TOKENS = {
+    word: (token_type, word.upper())
+    for word, token_type in RESERVED_KEYWORDS.items()
+}
+
+_ESCAPES = {
+    '"': '"', 'n': '\n', '\\': '\\', 'r': '\r',
+    "'": "'", 't': '\t', 'b': '\b', 'f': '\f',
+}
+_ESCAPE_RE = re.compile(r'\\(.)', re.S)
+
+
+def _unescape(match):
+    # unknown escapes are dropped, like Lexer.read_string does
+    return _ESCAPES.get(match.group(1), '')
+
+
+# Kind -> TokenType, and TokenType -> Kind as stored in TokenStream.kinds.
+TOKEN_TYPES = tuple(TokenType)
+TOKEN_CODES = {token_type: token_type.kind for token_type in TOKEN_TYPES}
+
+# Group numbers of the token alternatives in the master regex (m.lastindex);
+# group 1 holds the whitespace and comments skipped before the token.
+_NAME, _HEX, _DECIMAL, _STRING, _OP, _EOF = range(2, 8)
+
+# Whitespace and comments between tokens, skipped in one go.
+_SKIP = r'(?:\s+|--\[\[(?s:.*?--\]\]|.*)|--[^\n]*\n?)*'
+
+# The skip is matched inside a lookahead, which never gives back what it
+# matched: otherwise, when no token follows, the regex would retry with a
+# shorter skip and lex the '-' of a comment as an operator. The decimal
+# number takes all its digits and at most one dot, so that '12a' fails
+# rather than matching '1'.
+_MASTER = (
+    '(?=(' + _SKIP + r'))\1(?:'
+    r'({name})'                                         # identifier / keyword
+    r'|(0[xX][0-9a-fA-F]*(?:\.[0-9a-fA-F]*)?)'          # hexadecimal number
+    r'|([0-9]+(?:\.[0-9]*|(?!\.))(?![0-9a-zA-Z]))'      # decimal number
+    r'|("[^"\\]*(?:\\(?s:.)[^"\\]*)*"'                  # string
+    r'|\'[^\'\\]*(?:\\(?s:.)[^\'\\]*)*\')'
+    r'|({operators})'
+    r'|(\Z))'                                           # end of input
+)
+
+
+class _Syntax:
+    """Compiled patterns and lookup tables for one kind of source buffer.
+
+    Sources held as str are matched with str patterns. Anything else
+    (bytes, bytearray, memoryview, mmap) is matched in place with bytes
+    patterns, and only the lexemes that become token values are decoded
+    from UTF-8.
+    """
+
+    def __init__(self, binary):
+        self.binary = binary
+        if binary:
+            encode = str.encode
+            # any UTF-8 sequence may appear in an identifier
+            name = r'[A-Za-z_\x80-\xff][\w\x80-\xff]*'
+        else:
+            def encode(text):
+                return text
+            name = r'[^\W\d]\w*'
+        operators = sorted(_OPERATORS, key=len, reverse=True)
+        self.master = re.compile(encode(_MASTER.format(
+            name=name,
+            operators='|'.join(re.escape(op) for op in operators),
+        )))
+        self.skip = re.compile(encode(_SKIP))
+        self.digits = re.compile(encode(r'[0-9]*(?:\.[0-9]*)?'))
+        self.newline = encode('\n')
+        self.newline_re = re.compile(re.escape(self.newline))
+        self.dot = encode('.')
+        self.backslash = encode('\\')
+        self.quotes = (encode('"'), encode("'"))
+        self.operators = {
+            encode(lexeme): token_type
+            for lexeme, token_type in _OPERATORS.items()
+        }
+        self.keywords = {
+            encode(word): keyword for word, keyword in _KEYWORD_TOKENS.items()
+        }
+        self.operator_codes = {
+            lexeme: token_type.kind
+            for lexeme, token_type in self.operators.items()
+        }
+        self.keyword_codes = {
+            lexeme: (token_type.kind, value)
+            for lexeme, (token_type, value) in self.keywords.items()
+        }
+
+    def decode(self, lexeme):
+        if self.binary:
+            return bytes(lexeme).decode('utf-8')
+        return lexeme
+
+    def string_value(self, lexeme):
+        """Value of a string literal lexeme, quotes included."""
+        value = self.decode(lexeme[1:-1])
+        if '\\' in value:
+            value = _ESCAPE_RE.sub(_unescape, value)
+        return value
+
+    def hex_value(self, lexeme):
+        try:
+            return TokenType.INTEGER, int(lexeme, 16)
+        except ValueError:
+            return TokenType.NUMBER, float.fromhex(self.decode(lexeme))
+
+    def count_lines(self, text, start, end):
+        """Newlines in text[start:end] and the offset just past the last one."""
+        count = 0
+        last = None
+        for match in self.newline_re.finditer(text, start, end):
+            count += 1
+            last = match.end()
+        return count, last
+
+
+_TEXT_SYNTAX = _Syntax(binary=False)
+_BINARY_SYNTAX = _Syntax(binary=True)
+
+
+def _syntax_for(text):
+    return _TEXT_SYNTAX if isinstance(text, str) else _BINARY_SYNTAX
+
+
+class FastLexer:
+    """Lexer driven by one compiled master regex.
+
+    Every call to get_next_token is a single regex match that skips
+    whitespace and comments and recognizes the next lexeme, instead of one
+    Python call per character. The token stream is the same as the one
+    produced by Lexer (types, values, line and column), so FastLexer can be
+    handed to astt.Parser in place of Lexer.
+
+    The input may be a str or any bytes-like object holding UTF-8 source,
+    including memoryview and mmap objects, which are scanned in place
+    without a decoded copy. Columns count bytes for such inputs.
+
+    With lazy_positions=True no line bookkeeping is done while scanning:
+    tokens are LazyTokens that only record their start offset, and their
+    lineno and column are looked up in a LineIndex when first asked for.
+    """
+
+    def __init__(self, text, lazy_positions=False):
+        self.text = text
+        self._syntax = _syntax_for(text)
+        # mmap and memoryview have no count()/rfind() for line bookkeeping
+        self._searchable = isinstance(text, (str, bytes, bytearray))
+        # self.pos is an index into self.text, just past the last token
+        self.pos = 0
+        # line of the last token and the offset where that line starts
+        self.lineno = 1
+        self.column = 1
+        self.current_char = self._char_at(0)
+        self._line_start = 0
+        # newlines before this offset are already counted in self.lineno
+        self._mark = 0
+        # offset at which the last token returned starts
+        self.token_start = 0
+        self.lines = LineIndex(text) if lazy_positions else None
+
+    @classmethod
+    def from_file(cls, path, lazy_positions=False):
+        """Lex the file at `path` through a read-only memory map."""
+        with open(path, 'rb') as f:
+            if os.fstat(f.fileno()).st_size == 0:
+                return cls(b'', lazy_positions)
+            # the map stays valid after the file object is closed
+            return cls(mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ),
+                       lazy_positions)
+
+    def seek(self, pos):
+        """Go on lexing from offset `pos`, with the line and column of
+        the tokens from there on counted as in a lexing from the start."""
+        self.lineno = 1
+        self._line_start = 0
+        self._mark = 0
+        self._locate(pos)
+        self.pos = pos
+        self.current_char = self._char_at(pos)
+
+    def _char_at(self, pos):
+        if pos >= len(self.text):
+            return None
+        if self._syntax.binary:
+            return bytes(self.text[pos:pos + 1]).decode('utf-8', 'replace')
+        return self.text[pos]
+
+    def error(self):
+        s = "Lexer error on '{lexeme}' line: {lineno} column: {column}".format(
+            lexeme=self.current_char,
+            lineno=self.lineno,
+            column=self.column,
+        )
+        raise LexerError(error_code=ErrorCode.UNEXPECTED_TOKEN, message=s)
+
+    def _fail(self):
+        """Report the character the scanner could not make sense of."""
+        syntax = self._syntax
+        pos = syntax.skip.match(self.text, self.pos).end()
+        char = bytes(self.text[pos:pos + 1]) if syntax.binary \
+            else self.text[pos:pos + 1]
+        if char.isdigit():
+            # a decimal number running into a letter, e.g. '10e5'
+            pos = syntax.digits.match(self.text, pos).end()
+        elif char in syntax.quotes:
+            # unterminated string, reported at the end of input
+            pos = len(self.text)
+        self._locate(pos)
+        self.current_char = self._char_at(pos)
+        if self.current_char is None:
+            # Lexer.advance stops counting columns at the end of input
+            self.column -= 1
+        self.error()
+
+    def _locate(self, offset):
+        """Move the line bookkeeping forward to `offset`."""
+        text = self.text
+        if self._searchable:
+            newline = self._syntax.newline
+            newlines = text.count(newline, self._mark, offset)
+            if newlines:
+                self.lineno += newlines
+                self._line_start = text.rfind(newline, self._mark, offset) + 1
+        else:
+            newlines, line_start = self._syntax.count_lines(
+                text, self._mark, offset)
+            if newlines:
+                self.lineno += newlines
+                self._line_start = line_start
+        self._mark = offset
+        self.column = offset - self._line_start + 1
+
+    def get_next_token(self):
+        """Return the next token, or an EOF token once the input is used up."""
+        match = self._syntax.master.match(self.text, self.pos)
+        if match is None:
+            self._fail()
+        return self._token(match)
+
+    def _token(self, match):
+        """Build the Token for a successful master regex match."""
+        group = match.lastindex
+        start = match.start(group)
+        self.pos = match.end()
+        self.token_start = start
+        lexeme = match.group(group)
+        syntax = self._syntax
+
+        if group == _NAME:
+            keyword = syntax.keywords.get(lexeme)
+            if keyword is None:
+                token_type = TokenType.IDENTIFIER
+                value = syntax.decode(lexeme)
+            else:
+                token_type, value = keyword
+        elif group == _OP:
+            token_type = syntax.operators[lexeme]
+            value = token_type.value
+        elif group == _DECIMAL:
+            if syntax.dot in lexeme:
+                token_type = TokenType.NUMBER
+                value = float(lexeme)
+            else:
+                token_type = TokenType.INTEGER
+                value = int(lexeme, 10)
+        elif group == _STRING:
+            token_type = TokenType.STRING
+            value = syntax.string_value(lexeme)
+        elif group == _HEX:
+            token_type, value = syntax.hex_value(lexeme)
+        else:
+            # EOF (end-of-file) token indicates that there is no more
+            # input left for lexical analysis
+            return Token(type=TokenType.EOF, value=None)
+
+        if self.lines is not None:
+            return LazyToken(token_type, value, start, self.lines)
+        self._locate(start)
+        return Token(token_type, value, self.lineno, self.column)
+
+    def tokenize_all(self):
+        """Lex the whole input in one pass into a TokenStream."""
+        return TokenStream(self.text)
+
+
+class StreamLexer(FastLexer):
+    """FastLexer over a file object that is read in fixed-size chunks.
+
+    Only the unconsumed tail of the last chunk and the next chunk are kept
+    in memory, so memory use does not grow with the size of the file (a
+    single token longer than a chunk is buffered whole). The stream may
+    yield str or bytes.
+    """
+
+    def __init__(self, stream, chunk_size=1 << 16):
+        self.stream = stream
+        self.chunk_size = chunk_size
+        chunk = stream.read(chunk_size)
+        self._eof = not chunk
+        # offset of self.text[0] within the whole stream
+        self._offset = 0
+        super().__init__(chunk)
+
+    @property
+    def offset(self):
+        """Offset within the whole stream just past the last token."""
+        return self._offset + self.pos
+
+    def _refill(self):
+        """Drop the consumed part of the buffer and append the next chunk."""
+        cut = self.pos
+        self._locate(cut)
+        self._line_start -= cut
+        self._mark = 0
+        self._offset += cut
+        self.pos = 0
+        chunk = self.stream.read(self.chunk_size)
+        if chunk:
+            self.text = self.text[cut:] + chunk
+        else:
+            self.text = self.text[cut:]
+            self._eof = True
+
+    def get_next_token(self):
+        master = self._syntax.master
+        match = master.match(self.text, self.pos)
+        # a match that runs into the end of the buffer may continue in the
+        # next chunk, and a failure may be an incomplete token
+        while not self._eof and (match is None or match.end() == len(self.text)):
+            self._refill()
+            match = master.match(self.text, self.pos)
+        if match is None:
+            self._fail()
+        return self._token(match)
+
+    def tokenize_all(self):
+        raise TypeError('a stream can only be lexed one token at a time')
+
+
+####################################
+########## TOKEN STREAMS ###########
+####################################
+
+_IDENTIFIER_CODE = Kind.IDENTIFIER
+_INTEGER_CODE = Kind.INTEGER
+_NUMBER_CODE = Kind.NUMBER
+_STRING_CODE = Kind.STRING
+
+
+class LineIndex:
+    """Offsets at which the lines of a text start.
+
+    Turns an offset into a (lineno, column) pair with a binary search,
+    numbered the same way Lexer numbers its tokens. `text` may be a str or
+    any bytes-like object.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self._starts = None
+
+    @property
+    def starts(self):
+        # built on first use, since most sources never need a position
+        if self._starts is None:
+            newline_re = _syntax_for(self.text).newline_re
+            self._starts = [0]
+            self._starts.extend(m.end() for m in newline_re.finditer(self.text))
+        return self._starts
+
+    def locate(self, offset):
+        starts = self.starts
+        lineno = bisect_right(starts, offset)
+        return lineno, offset - starts[lineno - 1] + 1
+
+
+class TokenStream:
+    """A whole source lexed in one pass into parallel arrays.
+
+    Token i has type TOKEN_TYPES[kinds[i]], spans text[starts[i]:ends[i]]
+    and has the value values[value_ids[i]]. Equal values share one entry
+    of the value table. Tokens are materialized as LazyTokens, so line and
+    column numbers are only worked out when someone reads them. The stream is immutable, so any number of
+    parses can read it through their own TokenCursor.
+    """
+
+    def __init__(self, text):
+        self.text = text
+        self.kinds = array('B')
+        self.starts = array('I')
+        self.ends = array('I')
+        self.value_ids = array('I')
+        # interned token values, indexed by value_ids
+        self.values = []
+        self._value_index = {}
+        self.lines = LineIndex(text)
+        self._scan()
+
+    def _intern(self, key, value):
+        index = self._value_index.get(key)
+        if index is None:
+            index = self._value_index[key] = len(self.values)
+            self.values.append(value)
+        return index
+
+    def _scan(self):
+        text = self.text
+        kinds = self.kinds.append
+        starts = self.starts.append
+        ends = self.ends.append
+        value_ids = self.value_ids.append
+        intern = self._intern
+        syntax = _syntax_for(text)
+        keyword_codes = syntax.keyword_codes
+        operator_codes = syntax.operator_codes
+        decode = syntax.decode
+        dot = syntax.dot
+        pos = 0
+        for match in syntax.master.finditer(text):
+            if match.start() != pos:
+                break
+            pos = match.end()
+            group = match.lastindex
+            if group == _EOF:
+                return
+            lexeme = match.group(group)
+            if group == _NAME:
+                keyword = keyword_codes.get(lexeme)
+                if keyword is None:
+                    value = decode(lexeme)
+                    kinds(_IDENTIFIER_CODE)
+                    value_ids(intern(value, value))
+                else:
+                    kinds(keyword[0])
+                    value_ids(intern(keyword[1], keyword[1]))
+            elif group == _OP:
+                code = operator_codes[lexeme]
+                value = TOKEN_TYPES[code].value
+                kinds(code)
+                value_ids(intern(value, value))
+            elif group == _DECIMAL:
+                if dot in lexeme:
+                    kinds(_NUMBER_CODE)
+                    value = float(lexeme)
+                else:
+                    kinds(_INTEGER_CODE)
+                    value = int(lexeme, 10)
+                value_ids(intern((type(value), value), value))
+            elif group == _STRING:
+                value = syntax.string_value(lexeme)
+                kinds(_STRING_CODE)
+                # keyed apart from identifiers and operators of the same text
+                value_ids(intern((str, value), value))
+            else:
+                token_type, value = syntax.hex_value(lexeme)
+                kinds(token_type.kind)
+                value_ids(intern((type(value), value), value))
+            starts(match.start(group))
+            ends(pos)
+        # report the failure the same way FastLexer would
+        lexer = FastLexer(text)
+        lexer.pos = pos
+        lexer._fail()
+
+    def __len__(self):
+        return len(self.kinds)
+
+    def token(self, index):
+        """Materialize token `index` as a LazyToken."""
+        return LazyToken(TOKEN_TYPES[self.kinds[index]],
+                         self.values[self.value_ids[index]],
+                         self.starts[index], self.lines)
+
+    def cursor(self):
+        return TokenCursor(self)
+
+
+class TokenCursor:
+    """Reads a TokenStream with the get_next_token interface of Lexer.
+
+    astt.Parser(stream.cursor()) parses the stream exactly as it would
+    parse Lexer(stream.text).
+    """
+
+    def __init__(self, stream):
+        self.stream = stream
+        # index of the token the next get_next_token call returns
+        self.index = 0
+
+    def reset(self):
+        self.index = 0
+
+    def get_next_token(self):
+        index = self.index
+        if index >= len(self.stream.kinds):
+            return Token(type=TokenType.EOF, value=None)
+        self.index = index + 1
+        return self.stream.token(index)
+
+
+# lexer implementations by name, for callers that let the user choose
+LEXERS = {
+    'classic': Lexer,
+    'fast': FastLexer,
+}
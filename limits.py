@@ -0,0 +1,285 @@
+# Run programs under a budget of steps, wall-clock time and memory.
+# Run: python limits.py [--steps N] [--seconds S] [--memory BYTES] [FILE]
+
+import argparse
+import sys
+import time
+
+import lexer as lx
+import astt
+import smt
+import profiler
+
+
+NIL = lx.TokenType.NIL
+
+# steps between two looks at the clock
+CLOCK_INTERVAL = 128
+
+# node classes whose visitors a Budget replaces
+_GOVERNED = (astt.Program, list, astt.Compound, astt.While, astt.Assign,
+             astt.Local, astt.BinOp)
+
+
+def value_size(value):
+    """Bytes that `value`, held in a variable, counts for; nil is free."""
+    if value is NIL:
+        return 0
+    return sys.getsizeof(value)
+
+
+class Budget:
+    """Limits on one run of a Semantiff, enforced as it goes.
+
+    Install with Semantiff.set_budget(budget). A limit of None is no
+    limit:
+      max_steps    statements executed plus tests of while loops, so
+                   every iteration of a loop is at least one step
+      max_seconds  wall-clock seconds from the start of the run
+      max_memory   bytes of the values held in variables, globals and
+                   locals (see value_size())
+    Steps are counted at statement boundaries and loop back-edges, and
+    the clock is read every CLOCK_INTERVAL steps. Memory is kept up to
+    date at every assignment, and `^` on integers is refused before it
+    computes a result that would not fit. Going over a limit raises
+    lexer.LimitExceeded, leaving the variables as they were at that
+    point.
+
+    After a run, `steps`, `memory` and `elapsed` tell what it took.
+    A budget governs one interpreter at a time.
+    """
+
+    def __init__(self, max_steps=None, max_seconds=None, max_memory=None,
+                 timer=time.monotonic):
+        self.max_steps = max_steps
+        self.max_seconds = max_seconds
+        self.max_memory = max_memory
+        self.timer = timer
+        self.steps = 0
+        self.memory = 0
+        self.started = None
+        self.stopped = None
+        self._deadline = None
+        self._next_check = 0
+        self._saved = None
+        self._interpreter = None
+
+    @property
+    def elapsed(self):
+        """Seconds the last run took, or has taken so far."""
+        if self.started is None:
+            return 0.0
+        end = self.stopped if self.stopped is not None else self.timer()
+        return end - self.started
+
+    def _claim(self, interpreter):
+        # the saved visitors and counters belong to one interpreter
+        if self._interpreter not in (None, interpreter):
+            raise ValueError('budget already governs {}'.format(
+                type(self._interpreter).__name__))
+
+    def install(self, interpreter):
+        """Govern the runs of `interpreter` by this budget."""
+        self._claim(interpreter)
+        if self._interpreter is interpreter:
+            return
+        visitors = interpreter._visitors
+        self._saved = {kind: visitors[kind] for kind in _GOVERNED}
+        self._interpreter = interpreter
+        visitors[astt.Program] = self._program
+        visitors[list] = self._statements
+        visitors[astt.Compound] = self._compound
+        visitors[astt.While] = self._while
+        visitors[astt.Assign] = self._assign
+        visitors[astt.Local] = self._local
+        if self.max_memory is not None:
+            visitors[astt.BinOp] = self._binop
+
+    def attach(self, interpreter):
+        """Govern the runs of `interpreter`, an engine that counts its own
+        steps and runs in slices (iterative.IterativeSemantiff), by this
+        budget. Such an engine checks the limits between slices through
+        allowance() and advance(); it cannot limit memory."""
+        self._claim(interpreter)
+        if self.max_memory is not None:
+            raise TypeError('{} cannot limit memory'.format(
+                type(interpreter).__name__))
+        self._saved = {}
+        self._interpreter = interpreter
+
+    def remove(self, interpreter):
+        """Give `interpreter` its own visitors back."""
+        interpreter._visitors.update(self._saved)
+        self._saved = None
+        self._interpreter = None
+
+    def start(self):
+        """Reset the counters for a new run."""
+        interpreter = self._interpreter
+        # evaluate() may have been replaced, e.g. by a profiler
+        self._evaluate = interpreter.evaluate
+        self._globals = interpreter.globals
+        self._frame = interpreter.frame
+        self.steps = 0
+        self.memory = (sum(map(value_size, self._globals))
+                       + sum(map(value_size, self._frame)))
+        self.started = self.timer()
+        self.stopped = None
+        self._deadline = (None if self.max_seconds is None
+                          else self.started + self.max_seconds)
+        self._schedule()
+        if self.max_memory is not None and self.memory > self.max_memory:
+            raise self._exceeded('memory', self.memory, self.max_memory, None)
+
+    def stop(self):
+        """Note the end of a run."""
+        if self.stopped is None:
+            self.stopped = self.timer()
+
+    def allowance(self):
+        """Steps an engine counting its own steps may take before it must
+        call advance()."""
+        return self._next_check - self.steps
+
+    def advance(self, steps, node):
+        """Count `steps` taken by an engine counting its own, and check
+        the limits; `node` is where the run stands."""
+        self.steps += steps
+        if self.steps >= self._next_check:
+            self._check(node)
+
+    ####################################
+    ############# CHECKING #############
+    ####################################
+
+    def _schedule(self):
+        # the step count at which to check the limits next
+        next_check = sys.maxsize
+        if self._deadline is not None:
+            next_check = self.steps + CLOCK_INTERVAL
+        if self.max_steps is not None:
+            next_check = min(next_check, self.max_steps + 1)
+        self._next_check = next_check
+
+    def _check(self, node):
+        if self.max_steps is not None and self.steps > self.max_steps:
+            raise self._exceeded('steps', self.steps, self.max_steps, node)
+        if self._deadline is not None:
+            now = self.timer()
+            if now > self._deadline:
+                raise self._exceeded('seconds', now - self.started,
+                                     self.max_seconds, node)
+        self._schedule()
+
+    def _exceeded(self, limit, used, allowed, node):
+        self.stopped = self.timer()
+        line = None if node is None else profiler.node_line(node)
+        return lx.LimitExceeded(limit, used, allowed, line)
+
+    def _store(self, cells, slot, value, node):
+        memory = self.memory + value_size(value) - value_size(cells[slot])
+        if self.max_memory is not None and memory > self.max_memory:
+            raise self._exceeded('memory', memory, self.max_memory, node)
+        self.memory = memory
+        cells[slot] = value
+
+    ####################################
+    ############# VISITORS #############
+    ####################################
+
+    def _program(self, node):
+        self.start()
+        try:
+            return self._saved[astt.Program](node)
+        finally:
+            self.stop()
+
+    def _statements(self, node):
+        evaluate = self._evaluate
+        children = iter(node)
+        # a step per statement, counted inline: this is the hot path
+        child = next(children)
+        self.steps += 1
+        if self.steps >= self._next_check:
+            self._check(child)
+        a = evaluate(child)
+        for child in children:
+            self.steps += 1
+            if self.steps >= self._next_check:
+                self._check(child)
+            evaluate(child)
+        return a
+
+    def _compound(self, node):
+        return self._statements(node.children)
+
+    def _while(self, node):
+        a = 0
+        test = node.test
+        body = node.body
+        evaluate = self._evaluate
+        while True:
+            # the loop's entry and every back-edge
+            self.steps += 1
+            if self.steps >= self._next_check:
+                self._check(node)
+            if not smt.bool(evaluate(test)):
+                return a
+            a = evaluate(body)
+
+    def _assign(self, node):
+        value = self._evaluate(node.right)
+        left = node.left
+        self._store(self._frame if left.local else self._globals, left.slot,
+                    value, node)
+        return NIL
+
+    def _local(self, node):
+        value = NIL
+        if node.right is not None:
+            value = self._evaluate(node.right)
+        self._store(self._frame, node.left.slot, value, node)
+        return NIL
+
+    def _binop(self, node):
+        if node.op.kind != lx.Kind.EXP:
+            return self._saved[astt.BinOp](node)
+        left = self._evaluate(node.left)
+        right = self._evaluate(node.right)
+        if left is NIL or right is NIL:
+            return NIL
+        if type(left) is int and type(right) is int and right > 0 \
+                and abs(left) > 1:
+            # the result has about right * bits(left) bits
+            size = right * left.bit_length() // 8
+            if self.memory + size > self.max_memory:
+                raise self._exceeded('memory', self.memory + size,
+                                     self.max_memory, node)
+        return left ** right
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Run a program with limits on steps, time and memory.')
+    arg_parser.add_argument('path', nargs='?', default='code.txt')
+    arg_parser.add_argument('--steps', type=int, default=None)
+    arg_parser.add_argument('--seconds', type=float, default=None)
+    arg_parser.add_argument('--memory', type=int, default=None,
+                            help='bytes of variable values')
+    args = arg_parser.parse_args()
+    with open(args.path) as f:
+        text = f.read()
+    budget = Budget(args.steps, args.seconds, args.memory)
+    interpreter = smt.Semantiff(astt.Parser(lx.FastLexer(text)))
+    interpreter.set_budget(budget)
+    try:
+        interpreter.find()
+    except lx.Error as e:
+        print(e.message)
+    print(interpreter.symtab)
+    print('steps {}, memory {} bytes, {:.3f} s'.format(
+        budget.steps, budget.memory, budget.elapsed))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,706 @@
+# Optimization passes over parsed programs, run between Parser.parse() and
+# Semantiff.find().
+# Run: python optimize.py [--no-redundancy] [FILE]   (prints what changed)
+
+import argparse
+
+import lexer as lx
+import astt
+import smt
+
+
+# Integer powers with a larger exponent are left for run time, so that
+# folding never computes a huge number for code that might not run.
+MAX_FOLDED_EXPONENT = 64
+
+_OPERATOR_NODES = (astt.BinOp, astt.Compare, astt.UnaryOp)
+
+
+def _is_literal(node):
+    return type(node) is astt.Num or type(node) is astt.BoolVal
+
+
+def _literal(value, token):
+    """Num or BoolVal node for `value`, placed where `token` is, or None
+    if `value` has no literal."""
+    lineno = token.lineno
+    column = token.column
+    if type(value) is bool:
+        token_type = lx.TokenType.TRUE if value else lx.TokenType.FALSE
+        return astt.BoolVal(lx.Token(token_type, token_type.value.upper(),
+                                     lineno, column))
+    if type(value) is int:
+        return astt.Num(lx.Token(lx.TokenType.INTEGER, value, lineno, column))
+    if type(value) is float:
+        return astt.Num(lx.Token(lx.TokenType.NUMBER, value, lineno, column))
+    return None
+
+
+class ConstantFolder:
+    """Folds constant expressions and removes branches that cannot run.
+
+    BinOp, Compare and UnaryOp nodes whose operands are all literals are
+    replaced by the Num or BoolVal of their value; 'and'/'or' with a
+    literal left operand are replaced by the operand they yield. An If
+    whose test folds to a literal is replaced by the arm that runs, and a
+    While whose test folds to false is removed. Operations that would
+    fail (e.g. division by zero) are left for run time to report.
+
+    The tree is rewritten in place. Each change is described in
+    self.changes, a list of (lineno, message) pairs.
+    """
+
+    def __init__(self):
+        self.changes = []
+
+    def fold(self, program):
+        block = program.block
+        block.compound_statement = self._statement(block.compound_statement)
+        return program
+
+    def _note(self, lineno, message):
+        self.changes.append((lineno, message))
+
+    ####################################
+    ############ STATEMENTS ############
+    ####################################
+
+    def _statements(self, nodes):
+        """Fold a statement list, dropping statements that were removed."""
+        result = []
+        for node in nodes:
+            node = self._statement(node)
+            if node is not None:
+                result.append(node)
+        if not result:
+            result.append(astt.NoOp())
+        return result
+
+    def _statement(self, node):
+        """Folded replacement for statement `node`, None to remove it."""
+        kind = type(node)
+        if kind is astt.Compound:
+            node.children = self._statements(node.children)
+        elif kind is astt.Assign:
+            node.right = self._expression(node.right)
+        elif kind is astt.Local:
+            if node.right is not None:
+                node.right = self._expression(node.right)
+        elif kind is astt.While:
+            node.test = self._expression(node.test)
+            if _is_literal(node.test) and not smt.bool(node.test.value):
+                self._note(node.test.token.lineno,
+                           'removed while loop whose test is always false')
+                return None
+            node.body = self._statements(node.body)
+        elif kind is astt.If:
+            return self._if(node)
+        elif kind in _OPERATOR_NODES or kind is astt.Var or _is_literal(node):
+            node = self._expression(node)
+        return node
+
+    def _if(self, node):
+        node.test = self._expression(node.test)
+        if not _is_literal(node.test):
+            node.body = self._statement(node.body)
+            if node.alt is not None:
+                node.alt = self._statement(node.alt)
+            return node
+        lineno = node.test.token.lineno
+        if smt.bool(node.test.value):
+            self._note(lineno, 'if test is always true, kept its body')
+            return self._statement(node.body)
+        if node.alt is None:
+            self._note(lineno, 'removed if statement whose test is always false')
+            return None
+        self._note(lineno, 'if test is always false, kept the alternative')
+        return self._statement(node.alt)
+
+    ####################################
+    ########### EXPRESSIONS ############
+    ####################################
+
+    def _expression(self, root):
+        """Folded replacement for expression `root`.
+
+        Works bottom-up with an explicit stack, so expressions of any
+        depth fold without recursion. Alongside each folded node it keeps
+        the number of operations folded into it, so that the report names
+        only the largest constant expressions.
+        """
+        results = []
+        # (node, children done?)
+        pending = [(root, False)]
+        while pending:
+            node, done = pending.pop()
+            kind = type(node)
+            if kind not in _OPERATOR_NODES:
+                results.append((node, 0))
+                continue
+            if not done:
+                pending.append((node, True))
+                if kind is astt.UnaryOp:
+                    pending.append((node.expr, False))
+                else:
+                    pending.append((node.right, False))
+                    pending.append((node.left, False))
+                continue
+
+            if kind is astt.UnaryOp:
+                operands = [results.pop()]
+            else:
+                right = results.pop()
+                operands = [results.pop(), right]
+            folded = self._fold(node, [operand for operand, _ in operands])
+            if folded is not None and _is_literal(folded):
+                results.append(
+                    (folded, 1 + sum(count for _, count in operands)))
+                continue
+            # this node stays, or gives way to a non-constant operand;
+            # report the constants folded beneath it
+            for operand, count in operands:
+                if operand is not folded:
+                    self._report(operand, count)
+            if folded is not None:
+                results.append((folded, 0))
+                continue
+            if kind is astt.UnaryOp:
+                node.expr = operands[0][0]
+            else:
+                node.left = operands[0][0]
+                node.right = operands[1][0]
+            results.append((node, 0))
+        node, count = results.pop()
+        self._report(node, count)
+        return node
+
+    def _report(self, node, count):
+        if count:
+            self._note(node.token.lineno, 'folded {} operation{} to {!r}'.format(
+                count, '' if count == 1 else 's', node.value))
+
+    def _fold(self, node, operands):
+        """Literal replacing operator `node` over the folded `operands`,
+        or None if it cannot be folded."""
+        kind = node.op.kind
+        if type(node) is astt.BinOp and kind in (lx.Kind.AND, lx.Kind.OR):
+            left, right = operands
+            if not _is_literal(left):
+                return None
+            truthy = smt.bool(left.value)
+            if kind == lx.Kind.OR:
+                chosen = left if truthy else right
+            else:
+                chosen = right if truthy else left
+            if not _is_literal(chosen):
+                self._note(node.op.lineno, "'{}' with a constant left operand "
+                           'reduced to its right operand'.format(
+                               node.op.value.lower()))
+            return chosen
+        if not all(_is_literal(operand) for operand in operands):
+            return None
+        values = [operand.value for operand in operands]
+        if type(node) is astt.UnaryOp:
+            function = smt.UNARY_OPS.get(kind)
+        elif type(node) is astt.Compare:
+            function = smt.COMPARE_OPS.get(kind)
+        else:
+            function = smt.ARITHMETIC_OPS.get(kind)
+            if (kind == lx.Kind.EXP and type(values[1]) is int
+                    and abs(values[1]) > MAX_FOLDED_EXPONENT):
+                return None
+        if function is None:
+            return None
+        try:
+            value = function(*values)
+        except (ArithmeticError, TypeError, ValueError):
+            return None
+        return _literal(value, node.op)
+
+
+def fold_constants(program, changes=None):
+    """Fold the constants of `program` in place and return it. If
+    `changes` is a list, the (lineno, message) of every change made is
+    appended to it."""
+    folder = ConstantFolder()
+    folder.fold(program)
+    if changes is not None:
+        changes.extend(folder.changes)
+    return program
+
+
+####################################
+####### REDUNDANT EXPRESSIONS ######
+####################################
+
+# Operators that raise for no operand values Semantiff can hold (nil
+# operands give nil), so that evaluating them earlier, or when they
+# would not have run, changes nothing.
+_SAFE_BINARY = frozenset((lx.Kind.AND, lx.Kind.OR)) | astt.COMPARISON_OPS
+# safe unless an operand may be a float: an integer beyond the float
+# range meeting a float raises OverflowError
+_SAFE_ON_INTEGERS = frozenset((lx.Kind.PLUS, lx.Kind.MINUS, lx.Kind.MUL))
+# the same, when the right operand is a non-zero number literal. '/' is
+# never safe: it makes a float of two integers, which overflows too.
+_SAFE_DIVISION = frozenset((lx.Kind.DSLASH, lx.Kind.PERCENT))
+# operators whose value may be a float whatever their operands
+_FLOAT_RESULTS = frozenset((lx.Kind.FLOAT_DIV, lx.Kind.EXP))
+
+
+def _children(node):
+    kind = type(node)
+    if kind is astt.UnaryOp:
+        return (node.expr,)
+    if kind is astt.BinOp or kind is astt.Compare:
+        return (node.left, node.right)
+    return ()
+
+
+def _token(node):
+    """Token placing `node` in the source."""
+    if type(node) in _OPERATOR_NODES:
+        return node.op
+    return node.token
+
+
+def _safe(node, floats):
+    """Whether operator `node` itself can never raise; `floats` holds the
+    id() of the operands that may be floats (see _float_nodes())."""
+    if type(node) is astt.UnaryOp:
+        return node.op.kind == lx.Kind.NOT
+    op = node.op.kind
+    if op in _SAFE_BINARY:
+        return True
+    right = node.right
+    if op in _SAFE_ON_INTEGERS or (op in _SAFE_DIVISION
+                                   and type(right) is astt.Num
+                                   and right.value != 0):
+        return id(node.left) not in floats and id(right) not in floats
+    return False
+
+
+def _float_nodes(root, float_names):
+    """id() of the nodes of expression `root` whose value may be a float,
+    when the variables named in `float_names` are the only ones that may
+    hold one."""
+    floats = set()
+    pending = [(root, False)]
+    while pending:
+        node, done = pending.pop()
+        kind = type(node)
+        if kind is astt.Var:
+            if node.value in float_names:
+                floats.add(id(node))
+        elif kind is astt.Num:
+            if type(node.value) is float:
+                floats.add(id(node))
+        elif kind not in _OPERATOR_NODES:
+            continue
+        elif not done:
+            pending.append((node, True))
+            pending.extend((child, False) for child in _children(node))
+        elif kind is astt.Compare or node.op.kind == lx.Kind.NOT:
+            continue
+        elif node.op.kind in _FLOAT_RESULTS or any(
+                id(child) in floats for child in _children(node)):
+            floats.add(id(node))
+    return floats
+
+
+def _float_names(program):
+    """Names of the variables of `program` that may hold a float. A
+    variable holds nil or the value of one of its definitions: globals
+    are taken to start out nil, as they do in a fresh Semantiff."""
+    definitions = [node for node in _walk(program)
+                   if (type(node) is astt.Assign or type(node) is astt.Local)
+                   and node.right is not None]
+    # name -> definitions whose value depends on it
+    readers = {}
+    for node in definitions:
+        for var in _walk(node.right):
+            if type(var) is astt.Var:
+                readers.setdefault(var.value, []).append(node)
+    names = set()
+    pending = list(definitions)
+    while pending:
+        node = pending.pop()
+        name = node.left.value
+        if name not in names and id(node.right) in _float_nodes(node.right,
+                                                                 names):
+            names.add(name)
+            pending.extend(readers.get(name, ()))
+    return names
+
+
+def _source(root):
+    """Lua text of expression `root`, for the report."""
+    parts = []
+    pending = [root]
+    while pending:
+        node = pending.pop()
+        if type(node) is str:
+            parts.append(node)
+        elif type(node) is astt.Var:
+            parts.append(node.value)
+        elif type(node) is astt.BoolVal:
+            parts.append('true' if node.value else 'false')
+        elif type(node) is astt.Num:
+            parts.append(repr(node.value))
+        elif type(node) is astt.UnaryOp:
+            op = node.op.value.lower()
+            pending.append(node.expr)
+            pending.append(op + ' ' if op.isalpha() else op)
+        else:
+            op = ' {} '.format(node.op.value.lower())
+            # pushed right to left
+            for part in (node.right, op, node.left):
+                if _children(part):
+                    pending.extend((')', part, '('))
+                else:
+                    pending.append(part)
+    return ''.join(parts)
+
+
+def _walk(root):
+    """Every node under `root`, statements and expressions alike."""
+    pending = [root]
+    while pending:
+        node = pending.pop()
+        yield node
+        kind = type(node)
+        if kind is list:
+            pending.extend(node)
+        elif kind is astt.Compound:
+            pending.extend(node.children)
+        elif kind is astt.Program:
+            pending.append(node.block)
+        elif kind is astt.Block:
+            pending.append(node.compound_statement)
+        elif kind is astt.While or kind is astt.If:
+            pending.append(node.test)
+            pending.append(node.body)
+            if kind is astt.If and node.alt is not None:
+                pending.append(node.alt)
+        elif kind is astt.Assign or kind is astt.Local:
+            pending.append(node.left)
+            if node.right is not None:
+                pending.append(node.right)
+        else:
+            pending.extend(_children(node))
+
+
+def _definitions(statements):
+    """Names assigned or declared anywhere in `statements`."""
+    return {node.left.value for node in _walk(statements)
+            if type(node) is astt.Assign or type(node) is astt.Local}
+
+
+def _size(root):
+    return sum(1 for _ in _walk(root))
+
+
+class _Slot:
+    """An expression's place in the tree: field `field` of `holder`."""
+    __slots__ = ('holder', 'field')
+
+    def __init__(self, holder, field):
+        self.holder = holder
+        self.field = field
+
+    @property
+    def node(self):
+        return getattr(self.holder, self.field)
+
+    def replace(self, node):
+        setattr(self.holder, self.field, node)
+
+
+def _subslots(node):
+    if type(node) is astt.UnaryOp:
+        return (_Slot(node, 'expr'),)
+    return (_Slot(node, 'left'), _Slot(node, 'right'))
+
+
+class RedundancyEliminator:
+    """Computes repeated and loop-invariant expressions once.
+
+    Works by def-use analysis on variable names: the names a statement
+    assigns or declares 'local' are its definitions, and an expression
+    keeps its value for as long as none of the names it uses is
+    defined.
+
+    - Loop-invariant code motion: an expression in a While loop (its
+      test included) that uses no name the loop defines is computed
+      once, into a local declared just before the loop.
+    - Common-subexpression elimination: an expression that occurs more
+      than once in a statement list, with none of its names defined in
+      between, is computed once, into a local declared before the
+      statement of its first use.
+
+    Only expressions made of operators that cannot raise are moved
+    (see _SAFE_BINARY), so that computing them earlier, or when the
+    loop does not run, changes nothing; arithmetic counts only when no
+    operand may be a float (see _float_names()). The temporaries are locals
+    named like no variable of the program, so they never show up in
+    the symtab. The tree is rewritten in place; self.changes lists the
+    (lineno, message) of every change.
+    """
+
+    def __init__(self):
+        self.changes = []
+        self._used_names = set()
+        self._float_names = set()
+        self._temps = 0
+        # expression structure -> value number
+        self._numbers = {}
+
+    def eliminate(self, program):
+        self._used_names = {node.value for node in _walk(program)
+                            if type(node) is astt.Var}
+        self._float_names = _float_names(program)
+        compound = program.block.compound_statement
+        compound.children = self._statements(compound.children)
+        return program
+
+    def _note(self, lineno, message):
+        self.changes.append((lineno, message))
+
+    def _declare(self, expression):
+        """Name token of a new temporary, and the statement
+        'local <temporary> = expression'."""
+        while True:
+            self._temps += 1
+            name = '_t{}'.format(self._temps)
+            if name not in self._used_names:
+                break
+        if id(expression) in _float_nodes(expression, self._float_names):
+            self._float_names.add(name)
+        token = _token(expression)
+        name = lx.Token(lx.TokenType.IDENTIFIER, name,
+                        token.lineno, token.column)
+        local = lx.Token(lx.TokenType.LOCAL, 'local',
+                         token.lineno, token.column)
+        return name, astt.Local(astt.Var(name), local, expression)
+
+    def _number(self, root, defined, versions):
+        """Value numbers of the nodes of expression `root`, by id().
+
+        Nodes with the same number have the same value. Nodes that use a
+        name in `defined`, or an operator that can raise, get None. A
+        name's number also depends on versions[name], the number of
+        times it has been defined so far.
+        """
+        numbers = {}
+        floats = _float_nodes(root, self._float_names)
+        intern = self._numbers.setdefault
+        pending = [(root, False)]
+        while pending:
+            node, done = pending.pop()
+            kind = type(node)
+            if kind is astt.Var:
+                if node.value in defined:
+                    number = None
+                else:
+                    key = ('var', node.value, versions.get(node.value, 0))
+                    number = intern(key, len(self._numbers))
+            elif kind is astt.Num or kind is astt.BoolVal:
+                # 1, 1.0 and True are equal as dict keys but not as values
+                key = (type(node.value), node.value)
+                number = intern(key, len(self._numbers))
+            elif kind not in _OPERATOR_NODES:
+                number = None
+            elif not done:
+                pending.append((node, True))
+                pending.extend((child, False) for child in _children(node))
+                continue
+            else:
+                operands = tuple(numbers[id(child)]
+                                 for child in _children(node))
+                if None in operands or not _safe(node, floats):
+                    number = None
+                else:
+                    key = (kind, node.op.kind) + operands
+                    number = intern(key, len(self._numbers))
+            numbers[id(node)] = number
+        return numbers
+
+    ####################################
+    ############ STATEMENTS ############
+    ####################################
+
+    def _statements(self, nodes, reuse=True):
+        """Optimized replacement for statement list `nodes`."""
+        result = []
+        for node in nodes:
+            kind = type(node)
+            if kind is astt.While:
+                # hoisting first leaves less to reuse in the body
+                node.body = self._statements(node.body, reuse=False)
+                result.extend(self._hoist(node))
+                node.body = self._reuse(node.body)
+            elif kind is astt.If:
+                arm = node
+                while True:
+                    arm.body.children = self._statements(arm.body.children)
+                    if type(arm.alt) is not astt.If:
+                        break
+                    arm = arm.alt
+                if type(arm.alt) is astt.Compound:
+                    arm.alt.children = self._statements(arm.alt.children)
+            result.append(node)
+        return self._reuse(result) if reuse else result
+
+    def _hoist(self, loop):
+        """Declarations of the invariant expressions of `loop`, each
+        replaced in the loop by its temporary."""
+        defined = _definitions(loop.body)
+        lineno = _token(loop.test).lineno
+        declarations = []
+        temps = {}
+        # listed before any is replaced, so that moved expressions are
+        # not searched again
+        for slot in list(self._loop_expressions(loop)):
+            numbers = self._number(slot.node, defined, {})
+            pending = [slot]
+            while pending:
+                slot = pending.pop()
+                node = slot.node
+                if type(node) not in _OPERATOR_NODES:
+                    continue
+                number = numbers[id(node)]
+                if number is None:
+                    pending.extend(_subslots(node))
+                    continue
+                temp = temps.get(number)
+                if temp is None:
+                    temp, declaration = self._declare(node)
+                    temps[number] = temp
+                    declarations.append(declaration)
+                    self._note(node.op.lineno,
+                               "hoisted '{}' out of the while loop at line {}"
+                               .format(_source(node), lineno))
+                slot.replace(astt.Var(temp))
+        return declarations
+
+    @staticmethod
+    def _loop_expressions(loop):
+        """Slots of the expressions While `loop` evaluates."""
+        yield _Slot(loop, 'test')
+        for node in _walk(loop.body):
+            kind = type(node)
+            if (kind is astt.Assign or kind is astt.Local) and node.right is not None:
+                yield _Slot(node, 'right')
+            elif kind is astt.While or kind is astt.If:
+                yield _Slot(node, 'test')
+
+    def _reuse(self, statements):
+        """`statements` with repeated expressions computed once."""
+        versions = {}
+        # value number -> [index of the first statement using it, slots]
+        groups = {}
+        for index, statement in enumerate(statements):
+            kind = type(statement)
+            if kind is astt.Assign or kind is astt.Local:
+                if statement.right is not None:
+                    self._occurrences(_Slot(statement, 'right'), index,
+                                      versions, groups)
+            elif kind is astt.If:
+                self._occurrences(_Slot(statement, 'test'), index,
+                                  versions, groups)
+            for name in _definitions([statement]):
+                versions[name] = versions.get(name, 0) + 1
+        repeated = [group for group in groups.values() if len(group[1]) > 1]
+        if not repeated:
+            return statements
+        # an expression before the expressions containing it
+        repeated.sort(key=lambda group: (group[0], _size(group[1][0].node)))
+        inserted = {}
+        for first, slots in repeated:
+            node = slots[0].node
+            temp, declaration = self._declare(node)
+            inserted.setdefault(first, []).append(declaration)
+            self._note(node.op.lineno, "computed '{}' once for {} uses"
+                       .format(_source(node), len(slots)))
+            for slot in slots:
+                slot.replace(astt.Var(temp))
+        result = []
+        for index, statement in enumerate(statements):
+            result.extend(inserted.get(index, ()))
+            result.append(statement)
+        return result
+
+    def _occurrences(self, root, index, versions, groups):
+        """Add the operator expressions under `root` to `groups`."""
+        numbers = self._number(root.node, (), versions)
+        pending = [root]
+        while pending:
+            slot = pending.pop()
+            node = slot.node
+            if type(node) not in _OPERATOR_NODES:
+                continue
+            number = numbers[id(node)]
+            if number is not None:
+                group = groups.get(number)
+                if group is not None:
+                    # whatever it contains is reused along with it
+                    group[1].append(slot)
+                    continue
+                groups[number] = [index, [slot]]
+            # right pushed first, so that groups start in source order
+            pending.extend(reversed(_subslots(node)))
+
+
+def eliminate_redundancy(program, changes=None):
+    """Hoist the loop invariants of `program` and compute its repeated
+    expressions once, in place, and return it. If `changes` is a list,
+    the (lineno, message) of every change made is appended to it."""
+    eliminator = RedundancyEliminator()
+    eliminator.eliminate(program)
+    if changes is not None:
+        changes.extend(eliminator.changes)
+    return program
+
+
+class OptimizingParser:
+    """Parser front-end that optimizes what `parser` parses.
+
+    Has the parse() method of astt.Parser, so it can be handed to
+    smt.Semantiff or any other engine. Constants are folded, then loop
+    invariants and repeated expressions are computed once unless
+    `redundancy` is false. The changes made by the last parse are in
+    self.changes.
+    """
+
+    def __init__(self, parser, redundancy=True):
+        self.parser = parser
+        self.redundancy = redundancy
+        self.changes = []
+
+    def parse(self):
+        self.changes = []
+        program = fold_constants(self.parser.parse(), self.changes)
+        if self.redundancy:
+            eliminate_redundancy(program, self.changes)
+        return program
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Optimize a program, list the changes and run it.')
+    arg_parser.add_argument('path', nargs='?', default='code.txt')
+    arg_parser.add_argument('--no-redundancy', action='store_true',
+                            help='only fold constants')
+    args = arg_parser.parse_args()
+    with open(args.path) as f:
+        text = f.read()
+    parser = OptimizingParser(astt.Parser(lx.FastLexer(text)),
+                              redundancy=not args.no_redundancy)
+    interpreter = smt.Semantiff(parser)
+    interpreter.find()
+    for lineno, message in parser.changes:
+        print('line {}: {}'.format(lineno, message))
+    print(interpreter.symtab)
+
+
+if __name__ == '__main__':
+    main()
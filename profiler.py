@@ -0,0 +1,210 @@
+# Where does a script spend its time? Per-line and per-node profiles of
+# Semantiff runs.
+# Run: python profiler.py [--collapsed OUT] [FILE]
+
+import argparse
+import time
+
+import lexer as lx
+import astt
+import smt
+
+
+def node_line(node):
+    """Source line of `node`, or None for nodes without one (statement
+    lists, blocks, the program). Loops and ifs are on the line of their
+    test."""
+    while type(node) is astt.While or type(node) is astt.If:
+        node = node.test
+    token = getattr(node, 'op', None) or getattr(node, 'token', None)
+    return getattr(token, 'lineno', None)
+
+
+class _Frame:
+    __slots__ = ('line', 'name', 'start', 'children', 'path', 'new_line')
+
+    def __init__(self, line, name, start, path, new_line):
+        self.line = line
+        self.name = name
+        self.start = start
+        # time spent in the nodes below this one
+        self.children = 0.0
+        self.path = path
+        self.new_line = new_line
+
+
+class Profiler:
+    """Collects what Semantiff evaluates, and how long it takes.
+
+    Install with Semantiff.set_profiler(profiler). Every node that has a
+    source line is timed. For each line and each node type it keeps:
+      count   times the line was entered from another line, or nodes of
+              the type were evaluated
+      self    time spent in the nodes themselves
+      cum     time spent in them and everything they evaluated, counted
+              once when a line or node type is nested in itself
+    For each While loop (by line) the times it was entered and the
+    iterations its body ran. Self times are also kept per stack of
+    lines, for collapsed() and flame graphs.
+
+    `timer` returns seconds; `source` is the program text, used to show
+    the lines in report().
+    """
+
+    def __init__(self, source=None, timer=time.perf_counter):
+        self.timer = timer
+        self.lines = source.splitlines() if source is not None else None
+        # line -> [count, self, cum]
+        self.by_line = {}
+        # node type name -> [count, self, cum]
+        self.by_type = {}
+        # line of a While -> [entries, iterations]
+        self.loops = {}
+        # 'L3 While;L5 Assign' -> self seconds
+        self.stacks = {}
+        self._frames = []
+        # frames under way by line and by type, for cum
+        self._active_lines = {}
+        self._active_types = {}
+
+    def wrap(self, evaluate):
+        """Version of the bound method `evaluate` that reports every
+        node it evaluates to this profiler."""
+        frames = self._frames
+        timer = self.timer
+        loops = self.loops
+
+        def profiled(node):
+            kind = type(node)
+            if kind is list:
+                # the body of a While runs once per iteration
+                if frames and frames[-1].name == 'While':
+                    loops[frames[-1].line][1] += 1
+                return evaluate(node)
+            line = node_line(node)
+            if line is None:
+                return evaluate(node)
+            self._enter(line, kind.__name__, timer())
+            try:
+                return evaluate(node)
+            finally:
+                self._leave(timer())
+        return profiled
+
+    def _enter(self, line, name, now):
+        frames = self._frames
+        parent = frames[-1] if frames else None
+        new_line = parent is None or parent.line != line
+        if new_line:
+            label = 'L{} {}'.format(line, name)
+            path = parent.path + ';' + label if parent else label
+            stats = self.by_line.get(line)
+            if stats is None:
+                stats = self.by_line[line] = [0, 0.0, 0.0]
+            stats[0] += 1
+            self._active_lines[line] = self._active_lines.get(line, 0) + 1
+        else:
+            path = parent.path
+        stats = self.by_type.get(name)
+        if stats is None:
+            stats = self.by_type[name] = [0, 0.0, 0.0]
+        stats[0] += 1
+        self._active_types[name] = self._active_types.get(name, 0) + 1
+        if name == 'While':
+            loop = self.loops.get(line)
+            if loop is None:
+                loop = self.loops[line] = [0, 0]
+            loop[0] += 1
+        frames.append(_Frame(line, name, now, path, new_line))
+
+    def _leave(self, now):
+        frame = self._frames.pop()
+        elapsed = now - frame.start
+        own = elapsed - frame.children
+        if self._frames:
+            self._frames[-1].children += elapsed
+
+        stats = self.by_type[frame.name]
+        stats[1] += own
+        active = self._active_types
+        active[frame.name] -= 1
+        if not active[frame.name]:
+            stats[2] += elapsed
+
+        stats = self.by_line[frame.line]
+        stats[1] += own
+        if frame.new_line:
+            active = self._active_lines
+            active[frame.line] -= 1
+            if not active[frame.line]:
+                stats[2] += elapsed
+        self.stacks[frame.path] = self.stacks.get(frame.path, 0.0) + own
+
+    ####################################
+    ############## OUTPUT ##############
+    ####################################
+
+    def report(self, limit=20, sort='self'):
+        """Text report of the hottest lines and node types, sorted by
+        'self', 'cum' or 'count'."""
+        column = {'count': 0, 'self': 1, 'cum': 2}[sort]
+        out = []
+        out.append('{:>6} {:>10} {:>10} {:>10}  {}'.format(
+            'line', 'count', 'self ms', 'cum ms', 'source'))
+        rows = sorted(self.by_line.items(), key=lambda item: -item[1][column])
+        for line, (count, own, cum) in rows[:limit]:
+            out.append('{:>6} {:>10} {:>10.3f} {:>10.3f}  {}'.format(
+                line, count, own * 1e3, cum * 1e3, self._source(line)))
+        out.append('')
+        out.append('{:<10} {:>10} {:>10} {:>10}'.format(
+            'node', 'count', 'self ms', 'cum ms'))
+        rows = sorted(self.by_type.items(), key=lambda item: -item[1][column])
+        for name, (count, own, cum) in rows:
+            out.append('{:<10} {:>10} {:>10.3f} {:>10.3f}'.format(
+                name, count, own * 1e3, cum * 1e3))
+        if self.loops:
+            out.append('')
+            out.append('{:>6} {:>10} {:>12}  {}'.format(
+                'while', 'entries', 'iterations', 'source'))
+            for line, (entries, iterations) in sorted(self.loops.items()):
+                out.append('{:>6} {:>10} {:>12}  {}'.format(
+                    line, entries, iterations, self._source(line)))
+        return '\n'.join(out)
+
+    def _source(self, line):
+        if self.lines is None or not 0 < line <= len(self.lines):
+            return ''
+        return self.lines[line - 1].strip()
+
+    def collapsed(self):
+        """Self times in collapsed-stack format, one 'frame;frame value'
+        line per stack of source lines with the value in microseconds,
+        as flamegraph.pl and speedscope read it."""
+        return '\n'.join('{} {}'.format(path, round(own * 1e6))
+                         for path, own in sorted(self.stacks.items())
+                         if round(own * 1e6) > 0)
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Run a program and report where the time went.')
+    arg_parser.add_argument('path', nargs='?', default='code.txt')
+    arg_parser.add_argument('--collapsed', metavar='OUT',
+                            help='also write collapsed stacks to OUT')
+    arg_parser.add_argument('--sort', choices=('self', 'cum', 'count'),
+                            default='self')
+    args = arg_parser.parse_args()
+    with open(args.path) as f:
+        text = f.read()
+    profiler = Profiler(text)
+    interpreter = smt.Semantiff(astt.Parser(lx.FastLexer(text)))
+    interpreter.set_profiler(profiler)
+    interpreter.find()
+    print(profiler.report(sort=args.sort))
+    if args.collapsed:
+        with open(args.collapsed, 'w') as f:
+            f.write(profiler.collapsed() + '\n')
+
+
+if __name__ == '__main__':
+    main()
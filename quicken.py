@@ -0,0 +1,277 @@
+# Adaptive tree walking: operator nodes specialize themselves on the
+# operand types they see.
+# Run: python quicken.py [FILE]   (prints the specialization counters)
+
+import sys
+
+import lexer as lx
+import astt
+import smt
+
+
+NIL = lx.TokenType.NIL
+
+# evaluations an operator node is watched for before it is specialized
+WARMUP = 8
+# failed guards after which a specialized node goes back to the generic
+# path for good
+MISS_LIMIT = 16
+
+# Python spelling of the operators that are specialized, by token kind
+_SYMBOLS = {
+    lx.Kind.PLUS: '+',
+    lx.Kind.MINUS: '-',
+    lx.Kind.MUL: '*',
+    lx.Kind.FLOAT_DIV: '/',
+    lx.Kind.DSLASH: '//',
+    lx.Kind.PERCENT: '%',
+    lx.Kind.EXP: '**',
+    lx.Kind.GT: '>',
+    lx.Kind.LT: '<',
+    lx.Kind.GEQ: '>=',
+    lx.Kind.LEQ: '<=',
+    lx.Kind.EQUAL: '==',
+    lx.Kind.NOTEQUAL: '!=',
+}
+
+_OPERATIONS = dict(smt.ARITHMETIC_OPS)
+_OPERATIONS.update(smt.COMPARE_OPS)
+
+
+class GenericBinOp(astt.BinOp):
+    """A BinOp that saw mixed operand types: evaluated as Semantiff does,
+    no longer watched."""
+    __slots__ = ()
+
+
+class GenericCompare(astt.Compare):
+    __slots__ = ()
+
+
+_GENERIC = {astt.BinOp: GenericBinOp, astt.Compare: GenericCompare}
+
+# (base class, op kind, operand type, left shape, right shape) -> class
+_SPECIALIZED = {}
+
+
+def _shape(node, value_type):
+    """How a specialized visitor fetches operand `node`."""
+    kind = type(node)
+    if kind is astt.Var:
+        return 'local' if node.local else 'global'
+    if kind is astt.Num and type(node.value) is value_type:
+        return 'const'
+    return 'node'
+
+
+def specialized_class(base, kind, value_type, left, right):
+    """The subclass of `base` (BinOp or Compare) for operator `kind` on
+    two operands of `value_type`, fetched as shapes `left` and `right`.
+
+    It adds no slots, so a node can be switched to it and back by
+    assigning __class__.
+    """
+    key = (base, kind, value_type, left, right)
+    cls = _SPECIALIZED.get(key)
+    if cls is None:
+        name = '{}{}_{}_{}_{}'.format(
+            value_type.__name__.capitalize(), lx.TOKEN_TYPES[kind].name.title(),
+            base.__name__, left, right)
+        cls = _SPECIALIZED[key] = type(name, (base,), {
+            '__slots__': (),
+            'op_kind': kind,
+            'value_type': value_type,
+            'shapes': (left, right),
+        })
+    return cls
+
+
+_FETCH = {
+    'global': 'globals_[node.{}.slot]',
+    'local': 'frame[node.{}.slot]',
+    'const': 'node.{}.value',
+    'node': 'evaluate(node.{})',
+}
+
+
+def _visitor_source(cls, count):
+    """Python source of the visit function of specialized class `cls`."""
+    symbol = _SYMBOLS[cls.op_kind]
+    type_name = cls.value_type.__name__
+    guards = ['type({}) is {}'.format(side, type_name)
+              for side, shape in zip(('left', 'right'), cls.shapes)
+              if shape != 'const']
+    lines = [
+        'def visit(node):',
+        '    left = ' + _FETCH[cls.shapes[0]].format('left'),
+        '    right = ' + _FETCH[cls.shapes[1]].format('right'),
+        '    if {}:'.format(' and '.join(guards) or 'True'),
+    ]
+    if count:
+        lines.append('        engine.hits += 1')
+    lines.append('        return left {} right'.format(symbol))
+    lines.append('    return miss(node, left, right)')
+    return '\n'.join(lines) + '\n'
+
+
+class QuickeningSemantiff(smt.Semantiff):
+    """Semantiff whose arithmetic and compare nodes specialize themselves.
+
+    Each BinOp and Compare is watched for its first WARMUP evaluations.
+    If both operands were always int, or always float, the node switches
+    its class to a specialized subclass whose visitor fetches variable
+    and literal operands directly and computes the operation inline,
+    behind a type check of the operands. A failed check is a miss: the
+    operation is computed the generic way, and after MISS_LIMIT misses
+    the node goes back to the generic path. Nodes that see other types
+    go to the generic path straight away.
+
+    Specialization lasts for one run: the nodes get their classes back
+    when find() or run() returns, so the tree can still be handed to
+    other engines and passes. Counters:
+      hits        evaluations through a specialized visitor
+      misses      failed type checks
+      quickened   nodes specialized, by class name
+      generic     nodes sent to the generic path
+    With count=False the specialized visitors do not count hits.
+    """
+
+    def __init__(self, parser, count=True):
+        super().__init__(parser)
+        self.count = count
+        self.hits = 0
+        self.misses = 0
+        self.quickened = {}
+        self.generic = 0
+        # id(node) -> [evaluations, (left type, right type) or None]
+        self._watch = {}
+        self._miss_counts = {}
+        # nodes whose class was changed, to be restored
+        self._changed = []
+        self._visitors[astt.BinOp] = self.visit_BinOp
+        self._visitors[astt.Compare] = self.visit_Compare
+        self._visitors[GenericBinOp] = super().visit_BinOp
+        self._visitors[GenericCompare] = super().visit_Compare
+        self._base_visitors = dict(self._visitors)
+
+    def find(self):
+        self.astt = self.parser.parse()
+        self.resolve(self.astt)
+        return self.run()
+
+    def set_budget(self, budget):
+        # run() starts from the base visitors, so the budget's go there
+        self._visitors = dict(self._base_visitors)
+        super().set_budget(budget)
+        self._base_visitors = dict(self._visitors)
+
+    def run(self):
+        # visitors of specialized classes bind the frame of this run
+        self._visitors = dict(self._base_visitors)
+        self._watch.clear()
+        self._miss_counts.clear()
+        try:
+            return self.evaluate(self.astt)
+        finally:
+            self.restore()
+
+    def restore(self):
+        """Give every specialized node its parser class back."""
+        for node in self._changed:
+            node.__class__ = type(node).__bases__[0]
+        self._changed.clear()
+
+    def _switch(self, node, cls):
+        node.__class__ = cls
+        self._changed.append(node)
+        if cls not in self._visitors:
+            self._visitors[cls] = self._compile_visitor(cls)
+
+    def _compile_visitor(self, cls):
+        namespace = {
+            'engine': self,
+            'globals_': self.globals,
+            'frame': self.frame,
+            'evaluate': self.evaluate,
+            'miss': self._miss,
+        }
+        exec(compile(_visitor_source(cls, self.count),
+                     '<quickened {}>'.format(cls.__name__), 'exec'), namespace)
+        return namespace['visit']
+
+    ####################################
+    ############# WATCHING #############
+    ####################################
+
+    def visit_BinOp(self, node):
+        if node.op.kind not in _SYMBOLS:
+            # and/or, or an operator Semantiff rejects
+            self._switch(node, GenericBinOp)
+            self.generic += 1
+            return super().visit_BinOp(node)
+        return self._watched(node)
+
+    def visit_Compare(self, node):
+        if node.op.kind not in _SYMBOLS:
+            self._switch(node, GenericCompare)
+            self.generic += 1
+            return super().visit_Compare(node)
+        return self._watched(node)
+
+    def _watched(self, node):
+        left = self.evaluate(node.left)
+        right = self.evaluate(node.right)
+        types = (type(left), type(right))
+        watch = self._watch.get(id(node))
+        if watch is None:
+            watch = self._watch[id(node)] = [0, types]
+        elif watch[1] != types:
+            watch[1] = None
+        watch[0] += 1
+        if watch[0] >= WARMUP:
+            self._specialize(node, watch[1])
+        if left is NIL or right is NIL:
+            return NIL
+        return _OPERATIONS[node.op.kind](left, right)
+
+    def _specialize(self, node, types):
+        del self._watch[id(node)]
+        base = type(node)
+        if types not in ((int, int), (float, float)):
+            self._switch(node, _GENERIC[base])
+            self.generic += 1
+            return
+        value_type = types[0]
+        cls = specialized_class(base, node.op.kind, value_type,
+                                _shape(node.left, value_type),
+                                _shape(node.right, value_type))
+        self._switch(node, cls)
+        self.quickened[cls.__name__] = self.quickened.get(cls.__name__, 0) + 1
+
+    def _miss(self, node, left, right):
+        self.misses += 1
+        count = self._miss_counts.get(id(node), 0) + 1
+        self._miss_counts[id(node)] = count
+        if count >= MISS_LIMIT:
+            node.__class__ = _GENERIC[type(node).__bases__[0]]
+            self.generic += 1
+        if left is NIL or right is NIL:
+            return NIL
+        return _OPERATIONS[node.op.kind](left, right)
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else 'code.txt'
+    with open(path) as f:
+        text = f.read()
+    interpreter = QuickeningSemantiff(astt.Parser(lx.FastLexer(text)))
+    interpreter.find()
+    print(interpreter.symtab)
+    print('hits {}, misses {}, generic nodes {}'.format(
+        interpreter.hits, interpreter.misses, interpreter.generic))
+    for name, count in sorted(interpreter.quickened.items()):
+        print('  {:<40} {}'.format(name, count))
+
+
+if __name__ == '__main__':
+    main()
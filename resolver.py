@@ -0,0 +1,240 @@
+# Resolve variable names to slots before a program runs.
+# Run: python resolver.py [FILE]   (prints the slot of every variable)
+
+import collections.abc
+import sys
+
+import lexer as lx
+import astt
+
+
+class Resolution:
+    """What resolve() found in a program.
+
+    global_names lists the globals in slot order, local_names the locals
+    (one slot per 'local' declaration, so a frame of len(local_names)
+    holds them all).
+    """
+    __slots__ = ('global_names', 'local_names')
+
+    def __init__(self, global_names, local_names):
+        self.global_names = global_names
+        self.local_names = local_names
+
+    @property
+    def local_count(self):
+        return len(self.local_names)
+
+
+class Resolver:
+    """Gives every Var of a program its slot.
+
+    Lua scoping: a 'local' declaration is visible from the statement
+    after it to the end of its block, and may shadow a variable of an
+    enclosing block or an earlier local of the same block. The blocks are
+    the chunk, while bodies and each arm of an if. A name that no local
+    declaration covers is a global.
+
+    Global slots come from `global_slot`, a function of the name (by
+    default they are numbered in order of first appearance), so that a
+    caller can keep them in a table of its own across programs.
+    """
+
+    def __init__(self, global_slot=None):
+        self._globals = {}
+        self._global_slot = global_slot or self._next_global
+        self._locals = []
+        # innermost block last, each a dict name -> local slot
+        self._scopes = []
+
+    def _next_global(self, name):
+        return len(self._globals)
+
+    def resolve(self, program):
+        self._block(program.block.compound_statement)
+        return Resolution(sorted(self._globals, key=self._globals.get),
+                          self._locals)
+
+    def _block(self, node):
+        self._scopes.append({})
+        try:
+            self._statement(node)
+        finally:
+            self._scopes.pop()
+
+    def _declare(self, var):
+        var.slot = len(self._locals)
+        var.local = True
+        self._locals.append(var.value)
+        self._scopes[-1][var.value] = var.slot
+
+    def _bind(self, var):
+        name = var.value
+        for scope in reversed(self._scopes):
+            slot = scope.get(name)
+            if slot is not None:
+                var.slot = slot
+                var.local = True
+                return
+        slot = self._globals.get(name)
+        if slot is None:
+            slot = self._globals[name] = self._global_slot(name)
+        var.slot = slot
+        var.local = False
+
+    def _statement(self, node):
+        kind = type(node)
+        if kind is astt.Compound or kind is list:
+            for child in (node.children if kind is astt.Compound else node):
+                if type(child) is astt.Compound:
+                    # a block standing as a statement, e.g. the arm of an
+                    # if that optimize.ConstantFolder kept in its place
+                    self._block(child)
+                else:
+                    self._statement(child)
+        elif kind is astt.Local:
+            # 'local x = x' reads the x declared before it
+            if node.right is not None:
+                self._expression(node.right)
+            self._declare(node.left)
+        elif kind is astt.Assign:
+            self._expression(node.right)
+            self._bind(node.left)
+        elif kind is astt.While:
+            self._expression(node.test)
+            self._block(node.body)
+        elif kind is astt.If:
+            # an elseif chain is a chain of nested If nodes, whose tests
+            # belong to the enclosing block
+            while True:
+                self._expression(node.test)
+                self._block(node.body)
+                if type(node.alt) is not astt.If:
+                    break
+                node = node.alt
+            if node.alt is not None:
+                self._block(node.alt)
+        else:
+            self._expression(node)
+
+    def _expression(self, root):
+        # an explicit stack, for expressions of any depth
+        pending = [root]
+        while pending:
+            node = pending.pop()
+            kind = type(node)
+            if kind is astt.Var:
+                self._bind(node)
+            elif kind is astt.BinOp or kind is astt.Compare:
+                pending.append(node.right)
+                pending.append(node.left)
+            elif kind is astt.UnaryOp:
+                pending.append(node.expr)
+
+
+def resolve(program, global_slot=None):
+    """Resolve the variables of `program` in place; returns its
+    Resolution."""
+    return Resolver(global_slot).resolve(program)
+
+
+class GlobalsView(collections.abc.MutableMapping):
+    """The globals of a program, held in a list indexed by slot.
+
+    A mapping that reads like the symtab dict it replaces: only variables
+    that are not nil are in it, and it prints and compares as a dict.
+    Setting a name that has no slot yet gives it the next one. Like any
+    mapping that is not a dict, it goes to json.dumps() as dict(view).
+    """
+    __slots__ = ('names', 'cells', 'slots')
+
+    def __init__(self, initial=()):
+        self.names = []
+        # the values, nil for variables not set
+        self.cells = []
+        # name -> index in self.cells
+        self.slots = {}
+        for name, value in dict(initial).items():
+            self[name] = value
+
+    def slot(self, name):
+        """Slot of `name`, added (as nil) if it has none yet."""
+        slot = self.slots.get(name)
+        if slot is None:
+            slot = self.slots[name] = len(self.cells)
+            self.names.append(name)
+            self.cells.append(lx.TokenType.NIL)
+        return slot
+
+    def __getitem__(self, name):
+        slot = self.slots.get(name)
+        if slot is None or self.cells[slot] is lx.TokenType.NIL:
+            raise KeyError(name)
+        return self.cells[slot]
+
+    def __setitem__(self, name, value):
+        self.cells[self.slot(name)] = value
+
+    def __delitem__(self, name):
+        self[name]
+        self.cells[self.slots[name]] = lx.TokenType.NIL
+
+    def __iter__(self):
+        NIL = lx.TokenType.NIL
+        return (name for name, value in zip(self.names, self.cells)
+                if value is not NIL)
+
+    def __len__(self):
+        NIL = lx.TokenType.NIL
+        return sum(value is not NIL for value in self.cells)
+
+    # faster than the MutableMapping methods, which go through the
+    # exceptions of __getitem__
+
+    def get(self, name, default=None):
+        slot = self.slots.get(name)
+        if slot is None or self.cells[slot] is lx.TokenType.NIL:
+            return default
+        return self.cells[slot]
+
+    def pop(self, name, *default):
+        try:
+            value = self[name]
+        except KeyError:
+            if default:
+                return default[0]
+            raise
+        self.cells[self.slots[name]] = lx.TokenType.NIL
+        return value
+
+    def __contains__(self, name):
+        return self.get(name, lx.TokenType.NIL) is not lx.TokenType.NIL
+
+    def copy(self):
+        """A view of its own over copies of the slots and values."""
+        view = GlobalsView()
+        view.names = self.names[:]
+        view.cells = self.cells[:]
+        view.slots = self.slots.copy()
+        return view
+
+    __copy__ = copy
+
+    def __repr__(self):
+        return repr(dict(self.items()))
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else 'code.txt'
+    with open(path) as f:
+        text = f.read()
+    program = astt.Parser(lx.FastLexer(text)).parse()
+    resolution = resolve(program)
+    for slot, name in enumerate(resolution.global_names):
+        print('global {:3} {}'.format(slot, name))
+    for slot, name in enumerate(resolution.local_names):
+        print('local  {:3} {}'.format(slot, name))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,19 +1,187 @@
+# Interactive session: statements typed line by line run against one set
+# of globals, and the variables each input changed are printed.
+# Run: python run_me.py
+
+import collections
+import sys
+
 import lexer as lx
 import astt as syn
 import smt as tiff
+import resolver
+
+NIL = lx.TokenType.NIL
+
+# token kinds that open a block closed by 'end'
+_OPENERS = (lx.Kind.WHILE, lx.Kind.IF)
+
+
+def format_value(value):
+    if value is NIL:
+        return 'nil'
+    if value is True or value is False:
+        return 'true' if value else 'false'
+    return repr(value)
+
+
+class Session:
+    """One interpreter kept across inputs.
+
+    Every chunk runs on the same globals (self.symtab, a
+    resolver.GlobalsView); locals last for one chunk, as in Lua. Parsed
+    and resolved chunks are kept by source text, up to `cache_size` of
+    them, so a line typed again is only evaluated. Global slots never
+    move once given, which keeps the resolved chunks valid.
+
+    feed() takes input a line at a time and holds on to it while a
+    while/if block or a parenthesis is still open.
+    """
+
+    def __init__(self, cache_size=256):
+        self.symtab = resolver.GlobalsView()
+        self.interpreter = tiff.Semantiff(None)
+        self.interpreter.symtab = self.symtab
+        self.cache_size = cache_size
+        # source text -> compile() result, least recently used first
+        self._chunks = collections.OrderedDict()
+        self._lines = []
+
+    @property
+    def pending(self):
+        """Whether feed() is holding an unfinished chunk."""
+        return bool(self._lines)
+
+    def reset(self):
+        """Drop the unfinished chunk, if any."""
+        self._lines = []
+
+    def feed(self, line):
+        """Add a line of input. Returns the lines to print: the variables
+        the chunk changed, or its error; nothing while it is unfinished."""
+        self._lines.append(line)
+        text = '\n'.join(self._lines)
+        try:
+            # a chunk that was run before is known to be complete
+            if text not in self._chunks and not complete(text):
+                return []
+        except lx.LexerError as e:
+            self.reset()
+            return [e.message]
+        self.reset()
+        if not text.strip():
+            return []
+        try:
+            changes = self.execute(text)
+        except lx.Error as e:
+            return [e.message]
+        except Exception as e:
+            return ['Error: {}'.format(e)]
+        return ['{} = {}'.format(name, format_value(value))
+                for name, value in changes]
+
+    def compile(self, text):
+        """(program, local count, assigned global slots) for chunk
+        `text`, parsed and resolved once."""
+        chunk = self._chunks.get(text)
+        if chunk is not None:
+            self._chunks.move_to_end(text)
+            return chunk
+        program = syn.Parser(lx.FastLexer(text)).parse()
+        self.interpreter.resolve(program)
+        chunk = self._chunks[text] = (program,
+                                      self.interpreter.resolution.local_count,
+                                      assigned_slots(program))
+        if len(self._chunks) > self.cache_size:
+            self._chunks.popitem(last=False)
+        return chunk
+
+    def execute(self, text):
+        """Run chunk `text`; returns (name, value) for every global it
+        changed, in slot order, with nil for the ones it cleared."""
+        program, local_count, slots = self.compile(text)
+        interpreter = self.interpreter
+        interpreter.frame = [NIL] * local_count
+        cells = self.symtab.cells
+        # only the globals the chunk assigns can change
+        before = [cells[slot] for slot in slots]
+        try:
+            interpreter.evaluate(program)
+        finally:
+            changes = []
+            names = self.symtab.names
+            for slot, old in zip(slots, before):
+                value = cells[slot]
+                if type(old) is not type(value) or old != value:
+                    changes.append((names[slot], value))
+        return changes
+
+
+def assigned_slots(program):
+    """Sorted slots of the globals that `program` assigns anywhere."""
+    slots = set()
+    pending = [program]
+    while pending:
+        node = pending.pop()
+        kind = type(node)
+        if kind is syn.Assign:
+            if not node.left.local:
+                slots.add(node.left.slot)
+        elif kind is list:
+            pending.extend(node)
+        elif kind is syn.Compound:
+            pending.extend(node.children)
+        elif kind is syn.While:
+            pending.append(node.body)
+        elif kind is syn.If:
+            pending.append(node.body)
+            pending.append(node.alt)
+        elif kind is syn.Block:
+            pending.append(node.compound_statement)
+        elif kind is syn.Program:
+            pending.append(node.block)
+    return sorted(slots)
+
+
+def complete(text):
+    """Whether `text` closes every block and parenthesis it opens, so that
+    it can be parsed as a chunk."""
+    lexer = lx.FastLexer(text)
+    blocks = 0
+    parens = 0
+    while True:
+        kind = lexer.get_next_token().kind
+        if kind == lx.Kind.EOF:
+            return blocks <= 0 and parens <= 0
+        if kind in _OPENERS:
+            blocks += 1
+        elif kind == lx.Kind.END:
+            blocks -= 1
+        elif kind == lx.Kind.LPAREN:
+            parens += 1
+        elif kind == lx.Kind.RPAREN:
+            parens -= 1
+
 
 def main():
-    text=input()
-    lex = lx.Lexer(text)
-    par = syn.Parser(lex)
-    smtff = tiff.Semantiff(par)
+    session = Session()
+    interactive = sys.stdin.isatty()
     while True:
-        text=input()
-        lex = lx.Lexer(text)
-        par = syn.Parser(lex)
-        smtff = tiff.Semantiff(par)
-        smtff.find()
-        print(smtff.symtab)
+        prompt = ('... ' if session.pending else '> ') if interactive else ''
+        try:
+            line = input(prompt)
+        except EOFError:
+            break
+        except KeyboardInterrupt:
+            print()
+            session.reset()
+            continue
+        try:
+            output = session.feed(line)
+        except KeyboardInterrupt:
+            output = ['interrupted']
+        for text in output:
+            print(text)
+
 
 if __name__ == '__main__':
     main()
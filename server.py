@@ -0,0 +1,217 @@
+# A local script server on asyncio, and a client to load-test it.
+# Run: python server.py serve [--port PORT | --unix PATH]
+#      python server.py run [--port PORT | --unix PATH] FILE
+#      python server.py load [--port PORT | --unix PATH] [-c N] [-n N] FILE
+
+import argparse
+import asyncio
+import json
+import os
+import time
+
+import lexer as lx
+import aio
+import embed
+
+
+PORT = 8765
+
+# longest request line, i.e. script, accepted
+LIMIT = 16 * 1024 * 1024
+
+# The protocol is one JSON object per line each way. A request is
+#   {"script": "...", "bindings": {"n": 10}, "seconds": 2.0}
+# with bindings and seconds optional; the reply is
+#   {"ok": true, "symtab": {...}}
+# or
+#   {"ok": false, "error": "ParserError", "message": "..."}
+
+
+class ScriptServer:
+    """Runs the scripts sent to it as aio.AsyncSemantiff tasks on one
+    event loop, so that they interleave a slice at a time.
+
+    Every connection may send any number of requests, one after the
+    other. `seconds` is the deadline of a script that does not ask for
+    a shorter one. A script still running when its client disconnects is
+    cancelled.
+    """
+
+    def __init__(self, slice_steps=aio.SLICE, seconds=10.0):
+        self.slice_steps = slice_steps
+        self.seconds = seconds
+        self.served = 0
+        self.running = 0
+
+    async def serve(self, port=PORT, unix=None, host='127.0.0.1'):
+        """Serve on `unix` (a socket path) if given, else on TCP `port`
+        of `host`, until cancelled."""
+        if unix is not None:
+            server = await asyncio.start_unix_server(self.handle, unix,
+                                                     limit=LIMIT)
+        else:
+            server = await asyncio.start_server(self.handle, host, port,
+                                                limit=LIMIT)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if unix is not None and os.path.exists(unix):
+                os.remove(unix)
+
+    async def handle(self, reader, writer):
+        task = next_line = None
+        try:
+            line = await reader.readline()
+            while line:
+                task = asyncio.ensure_future(self.reply(line))
+                # reading on while the script runs tells a disconnect
+                next_line = asyncio.ensure_future(reader.readline())
+                await asyncio.wait((task, next_line),
+                                   return_when=asyncio.FIRST_COMPLETED)
+                if not task.done() and next_line.done() \
+                        and not next_line.result():
+                    break
+                reply = await task
+                writer.write(json.dumps(reply).encode() + b'\n')
+                await writer.drain()
+                line = await next_line
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        finally:
+            # a script whose client is gone is stopped
+            for pending in (task, next_line):
+                if pending is not None and not pending.done():
+                    pending.cancel()
+            writer.close()
+
+    async def reply(self, line):
+        try:
+            request = json.loads(line)
+            script = request['script']
+            bindings = request.get('bindings') or {}
+            seconds = request.get('seconds', self.seconds)
+            if self.seconds is not None:
+                seconds = min(seconds or self.seconds, self.seconds)
+        except (ValueError, KeyError, TypeError) as e:
+            return {'ok': False, 'error': 'BadRequest', 'message': str(e)}
+        self.running += 1
+        try:
+            symtab = await aio.run_script(script, bindings, self.slice_steps,
+                                          seconds)
+        except lx.Error as e:
+            return {'ok': False, 'error': type(e).__name__,
+                    'message': e.message}
+        except Exception as e:
+            return {'ok': False, 'error': type(e).__name__,
+                    'message': str(e)}
+        finally:
+            self.running -= 1
+            self.served += 1
+        return {'ok': True, 'symtab': symtab}
+
+
+async def connect(port=PORT, unix=None, host='127.0.0.1'):
+    if unix is not None:
+        return await asyncio.open_unix_connection(unix, limit=LIMIT)
+    return await asyncio.open_connection(host, port, limit=LIMIT)
+
+
+async def request(reader, writer, script, bindings=None, seconds=None):
+    """Send one script over an open connection; returns the reply."""
+    message = {'script': script}
+    if bindings:
+        message['bindings'] = bindings
+    if seconds is not None:
+        message['seconds'] = seconds
+    writer.write(json.dumps(message).encode() + b'\n')
+    await writer.drain()
+    line = await reader.readline()
+    if not line:
+        raise ConnectionError('server closed the connection')
+    return json.loads(line)
+
+
+async def load_test(script, concurrency=50, requests=1000, port=PORT,
+                    unix=None):
+    """Send `requests` copies of `script` over `concurrency` connections,
+    each waiting for one reply before sending the next. Returns the
+    latencies in seconds, the number of failed replies and the seconds
+    taken in all."""
+    latencies = []
+    failed = 0
+    counts = [requests // concurrency + (i < requests % concurrency)
+              for i in range(concurrency)]
+
+    async def client(count):
+        nonlocal failed
+        reader, writer = await connect(port, unix)
+        try:
+            for _ in range(count):
+                start = time.perf_counter()
+                reply = await request(reader, writer, script)
+                latencies.append(time.perf_counter() - start)
+                if not reply['ok']:
+                    failed += 1
+        finally:
+            writer.close()
+
+    start = time.perf_counter()
+    await asyncio.gather(*(client(count) for count in counts if count))
+    return latencies, failed, time.perf_counter() - start
+
+
+def main():
+    arg_parser = argparse.ArgumentParser(
+        description='Serve scripts over a socket, or send them to a server.')
+    commands = arg_parser.add_subparsers(dest='command', required=True)
+    serve = commands.add_parser('serve', help='run the server')
+    serve.add_argument('--slice', type=int, default=aio.SLICE,
+                       help='steps a script runs between yields')
+    serve.add_argument('--seconds', type=float, default=10.0,
+                       help='longest a script may run')
+    run = commands.add_parser('run', help='run one script on a server')
+    run.add_argument('path')
+    load = commands.add_parser('load', help='load-test a server')
+    load.add_argument('path')
+    load.add_argument('-c', '--concurrency', type=int, default=50)
+    load.add_argument('-n', '--requests', type=int, default=1000)
+    for command in (serve, run, load):
+        command.add_argument('--port', type=int, default=PORT)
+        command.add_argument('--unix', metavar='PATH',
+                             help='use a Unix socket instead of TCP')
+    args = arg_parser.parse_args()
+
+    if args.command == 'serve':
+        server = ScriptServer(args.slice, args.seconds)
+        try:
+            asyncio.run(server.serve(args.port, args.unix))
+        except KeyboardInterrupt:
+            pass
+        return
+
+    with open(args.path) as f:
+        script = f.read()
+    if args.command == 'run':
+        async def run_once():
+            reader, writer = await connect(args.port, args.unix)
+            try:
+                return await request(reader, writer, script)
+            finally:
+                writer.close()
+        reply = asyncio.run(run_once())
+        print(reply['symtab'] if reply['ok'] else reply['message'])
+        return
+
+    latencies, failed, elapsed = asyncio.run(load_test(
+        script, args.concurrency, args.requests, args.port, args.unix))
+    print('{} requests, {} failed, {} connections, {:.3f} s, {:.0f} req/s'
+          .format(len(latencies), failed, args.concurrency, elapsed,
+                  len(latencies) / elapsed))
+    print('  p50 {:.2f} ms  p99 {:.2f} ms  max {:.2f} ms'.format(
+        embed.percentile(latencies, 0.50) * 1e3,
+        embed.percentile(latencies, 0.99) * 1e3, max(latencies) * 1e3))
+
+
+if __name__ == '__main__':
+    main()
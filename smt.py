@@ -1,167 +1,207 @@
 import lexer as lx
 import astt
+import resolver
 
 
 def bool(expr):
     return expr != lx.TokenType.NIL and expr != False
 
 
+# operator kind -> Python callable; the nodes hold their own in
+# `function` (see astt.py)
+ARITHMETIC_OPS = astt.ARITHMETIC_FUNCTIONS
+COMPARE_OPS = astt.COMPARE_FUNCTIONS
+UNARY_OPS = astt.UNARY_FUNCTIONS
+
+
 class Semantiff:
+    """Tree-walking evaluator.
+
+    Variables are resolved to slots before the program runs (see
+    resolver.py): globals live in the list behind self.symtab, a
+    resolver.GlobalsView that reads like a dict, and locals in
+    self.frame.
+    """
+
+    # whether set_budget() can govern the runs of this engine
+    supports_budget = True
+
     def __init__(self, parser):
         self.parser = parser
         self.symtab = {}
-
-    def create_variable(self, varname, value):
-        self.symtab[varname] = value
-
-    def flush(self, varname):
-        del self.symtab[varname]
+        self.globals = []
+        self.frame = []
+        self.budget = None
+        # node class -> bound visit method
+        self._visitors = {
+            int: self.visit_constant,
+            float: self.visit_constant,
+            type(None): self.visit_none,
+            list: self.visit_list,
+            astt.Num: self.visit_literal,
+            astt.BoolVal: self.visit_literal,
+            astt.Var: self.visit_Var,
+            astt.Assign: self.visit_Assign,
+            astt.Local: self.visit_Local,
+            astt.UnaryOp: self.visit_UnaryOp,
+            astt.BinOp: self.visit_BinOp,
+            astt.Compare: self.visit_Compare,
+            astt.While: self.visit_While,
+            astt.If: self.visit_If,
+            astt.Compound: self.visit_Compound,
+            astt.Block: self.visit_Block,
+            astt.Program: self.visit_Program,
+            astt.NoOp: self.visit_none,
+        }
+
+    def set_profiler(self, profiler):
+        """Report every node evaluation to `profiler` (a
+        profiler.Profiler), or stop reporting if it is None.
+
+        The profiled evaluate() shadows the method on this instance
+        only, so a Semantiff without a profiler runs exactly as before.
+        """
+        self.__dict__.pop('evaluate', None)
+        if profiler is not None:
+            self.evaluate = profiler.wrap(self.evaluate)
+
+    def set_budget(self, budget):
+        """Run under `budget` (a limits.Budget) from now on, or without
+        limits if it is None.
+
+        The budget replaces the visitors of statements, loops and
+        assignments on this instance only; going over it raises
+        lexer.LimitExceeded. Engines that run compiled code have no
+        visitors to replace and raise TypeError.
+        """
+        if budget is not None and not self.supports_budget:
+            raise TypeError('{} cannot run under a budget'.format(
+                type(self).__name__))
+        if self.budget is not None:
+            self.budget.remove(self)
+            self.budget = None
+        if budget is not None:
+            budget.install(self)
+            self.budget = budget
 
     def find(self):
         self.astt = self.parser.parse()
+        self.resolve(self.astt)
         return self.evaluate(self.astt)
 
-    def evaluate(self, node):
-        # print(node)
-
-        if type(node)==int or type(node)==float:
-            return node
-
-        if node is None:  # 3
-            return lx.TokenType.NIL
-
-        if type(node) == list:
-            a=self.evaluate(node[0])
-            for child in node[1:]:
-                self.evaluate(child)
-            return a
-
-        if type(node) == astt.Num:
-            return node.value
+    def resolve(self, program):
+        """Give the variables of `program` their slots, keeping the
+        globals already in self.symtab."""
+        if type(self.symtab) is not resolver.GlobalsView:
+            self.symtab = resolver.GlobalsView(self.symtab)
+        self.resolution = resolver.resolve(program, self.symtab.slot)
+        self.globals = self.symtab.cells
+        self.frame = [lx.TokenType.NIL] * self.resolution.local_count
 
-        if type(node) == astt.BoolVal:
-            return node.value
-
-        elif type(node) == astt.Var:  # RHS variable
-            if node.value in self.symtab:  # The 'value' is the variable name here
-                return self.symtab[node.value]
-            else:
-                return lx.TokenType.NIL
-
-        elif type(node) == astt.Assign:
-            self.create_variable(node.left.value, self.evaluate(node.right))
-
-            if self.symtab[node.left.value] == lx.TokenType.NIL:  # Clear unnecessary space
-                self.flush(node.left.value)
-            return lx.TokenType.NIL
-
-        elif type(node) == astt.UnaryOp:
-            if node.token == lx.TokenType.PLUS:
-                return self.evaluate(node.expr)
-            elif node.token == lx.TokenType.MINUS:
-                return -self.evaulate(node.expr)
-            if node.token == lx.TokenType.NOT:
-                return not bool(self.evaluate(node.expr))
-            else:
-                raise Exception("Unrecognised unary operator: " + str(node.token))
-
-
-        # Binary operation
-        elif type(node) == astt.BinOp:
-            if type(node.token)!=lx.TokenType:
-                node.token = node.token.type
+    def evaluate(self, node):
+        visitor = self._visitors.get(type(node))
+        if visitor is None:
+            # Find weird tokens
+            raise Exception("Unexpected token error: " + str(type(node)))
+        return visitor(node)
+
+    def visit_constant(self, node):
+        return node
+
+    def visit_none(self, node):
+        return lx.TokenType.NIL
+
+    def visit_list(self, node):
+        # iterating spares copying node[1:] on every visit of a loop body
+        children = iter(node)
+        a = self.evaluate(next(children))
+        for child in children:
+            self.evaluate(child)
+        return a
+
+    def visit_literal(self, node):
+        return node.value
+
+    def visit_Var(self, node):  # RHS variable
+        if node.local:
+            return self.frame[node.slot]
+        return self.globals[node.slot]
+
+    def visit_Assign(self, node):
+        # a nil global drops out of symtab, as if deleted
+        value = self.evaluate(node.right)
+        left = node.left
+        if left.local:
+            self.frame[left.slot] = value
+        else:
+            self.globals[left.slot] = value
+        return lx.TokenType.NIL
+
+    def visit_Local(self, node):
+        value = lx.TokenType.NIL
+        if node.right is not None:
+            value = self.evaluate(node.right)
+        self.frame[node.left.slot] = value
+        return lx.TokenType.NIL
+
+    def visit_UnaryOp(self, node):
+        function = node.function
+        if function is None:
+            raise Exception("Unrecognised unary operator: " + str(node.token))
+        return function(self.evaluate(node.expr))
+
+    # Binary operation
+    def visit_BinOp(self, node):
+        function = node.function
+        if function is None:
             # SCC Booleans
-            if node.token == lx.TokenType.OR:
+            kind = node.op.kind
+            if kind == lx.Kind.OR:
                 cond = self.evaluate(node.left)
-                if bool(cond):
-                    return cond
-                else:
-                    return self.evaluate(node.right)
-            if node.token == lx.TokenType.AND:
+                return cond if bool(cond) else self.evaluate(node.right)
+            if kind == lx.Kind.AND:
                 cond = self.evaluate(node.left)
-                if bool(cond):
-                    return cond
-                else:
-                    return self.evaluate(node.right)
-
-            # Arithmetic expressions
-            left = self.evaluate(node.left)
-            right = self.evaluate(node.right)
-            if left == lx.TokenType.NIL or right == lx.TokenType.NIL:
-                return lx.TokenType.NIL
-
-            if node.token == lx.TokenType.EXP:
-                return self.evaluate(left) ** self.evaluate(right)
-
-            if node.token == lx.TokenType.MUL:
-                return self.evaluate(right) * self.evaluate(left)
-            if node.token == lx.TokenType.FLOAT_DIV:
-                return self.evaluate(left) / self.evaluate(right)
-
-            if node.token == lx.TokenType.PLUS:
-                return self.evaluate(right) + self.evaluate(left)
-            if node.token == lx.TokenType.MINUS:
-                return self.evaluate(left) - self.evaluate(right)
-
-            else:
-                raise Exception("Unrecognised binary operator: " + str(node.token))
-
-
-        # While loop
-        elif type(node) == astt.While:
-            a = 0
-            while self.evaluate(node.test):
-                a = self.evaluate(node.body)
-            return a
-
-        if type(node) == astt.Compare:
-            if (type(node.left) == astt.Var):
-                left = self.symtab[node.left.token.value]
-
-            if (type(node.right) == astt.Var):
-                right = self.symtab[node.right.token.value]
-
-            if (type(node.left) == astt.Num):
-                left = node.left.value
-            if (type(node.right) == astt.Num):
-                right = node.right.value
-
-            if (node.left == lx.TokenType.NIL or node.right == lx.TokenType.NIL):
-                return lx.TokenType.NIL
-            else:
-                if node.op.type == lx.TokenType.GT:
-                    return left > right
-                elif node.op.type == lx.TokenType.LT:
-                    return left < right
-                elif node.op.type == lx.TokenType.GEQ:
-                    return left >= right
-                elif node.op.type == lx.TokenType.LEQ:
-                    return left <= right
-                elif node.op.type == lx.TokenType.EQUAL:
-                    return left == right
-                elif node.op.type == lx.TokenType.NOTEQUAL:
-                    return left != right
-                else:
-                    raise Exception("Unrecognised compare operator: " + str(node.op))
-
-        # If-elif-else ladder
-        elif type(node) == astt.If:
-            if self.evaluate(node.test):
-                return self.evaluate(node.body)
-            else:
-                return self.evaluate(node.alt)
-
-        if type(node) == astt.Compound:
-            a = self.evaluate(node.children[0])
-            for stmt in node.children[1:]:
-                self.evaluate(stmt)
-            return a
-
-        if type(node) == astt.Block:
-            return self.evaluate(node.compound_statement)
-
-        if type(node) == astt.Program:
-            return self.evaluate(node.block)
-        # Find weird tokens    
-        else:
-            raise Exception("Unexpected token error: " + str(type(node)))
+                return self.evaluate(node.right) if bool(cond) else cond
+            raise Exception("Unrecognised binary operator: " + str(node.op.type))
+
+        # Arithmetic expressions
+        left = self.evaluate(node.left)
+        right = self.evaluate(node.right)
+        if left is lx.TokenType.NIL or right is lx.TokenType.NIL:
+            return lx.TokenType.NIL
+        return function(left, right)
+
+    def visit_Compare(self, node):
+        function = node.function
+        if function is None:
+            raise Exception("Unrecognised compare operator: " + str(node.op))
+        left = self.evaluate(node.left)
+        right = self.evaluate(node.right)
+        if left is lx.TokenType.NIL or right is lx.TokenType.NIL:
+            return lx.TokenType.NIL
+        return function(left, right)
+
+    # While loop
+    def visit_While(self, node):
+        a = 0
+        test = node.test
+        body = node.body
+        evaluate = self.evaluate
+        while bool(evaluate(test)):
+            a = evaluate(body)
+        return a
+
+    # If-elif-else ladder
+    def visit_If(self, node):
+        if bool(self.evaluate(node.test)):
+            return self.evaluate(node.body)
+        return self.evaluate(node.alt)
+
+    def visit_Compound(self, node):
+        return self.visit_list(node.children)
+
+    def visit_Block(self, node):
+        return self.evaluate(node.compound_statement)
+
+    def visit_Program(self, node):
+        return self.evaluate(node.block)
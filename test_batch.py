@@ -0,0 +1,26 @@
+import lexer as lx
+import batch
+
+
+def write(tmp_path, name, text):
+    path = tmp_path / name
+    path.write_text(text)
+    return str(path)
+
+
+def test_check_file(tmp_path):
+    result = batch.check_file(write(tmp_path, 'good.lua', 'a = 1\n'))
+    assert result.ok and result.error is None
+    result = batch.check_file(write(tmp_path, 'bad.lua', 'a = 1\nb = = 2\n'))
+    assert not result.ok
+    assert (result.lineno, result.column) == (2, 5)
+
+
+def test_failure_before_parsing(tmp_path, monkeypatch):
+    def fail(text):
+        raise ValueError('no lexer')
+    monkeypatch.setattr(lx, 'FastLexer', fail)
+    result = batch.check_file(write(tmp_path, 'a.lua', 'a = 1\n'))
+    assert not result.ok
+    assert result.error == 'no lexer'
+    assert (result.lineno, result.column) == (None, None)
@@ -0,0 +1,42 @@
+import lexer as lx
+import bench
+import benchsuite
+
+from test_engines import parse, run
+from test_lexer import tokens
+
+
+def workloads(scale=0.02):
+    for name, workload in benchsuite.WORKLOADS.items():
+        yield name, workload(scale)
+
+
+def test_lexers_agree_on_workloads():
+    for name, text in workloads(0.05):
+        expected = tokens(lx.Lexer(text))
+        for lexer_name, lexer_class in lx.LEXERS.items():
+            assert tokens(lexer_class(text)) == expected, (name, lexer_name)
+
+
+def test_engines_agree_on_workloads():
+    for name, text in workloads():
+        expected = run(bench.ENGINES['tree'], parse(text))
+        for engine_name, engine in bench.ENGINES.items():
+            assert run(engine, parse(text)) == expected, (name, engine_name)
+
+
+def test_count_statements():
+    program = parse('i = 0\nwhile i < 10 do i = i + 1 end\n')
+    # two statements, eleven tests of the loop and ten of its body
+    assert benchsuite.count_statements(program) == 23
+
+
+def test_compare():
+    def report(rates):
+        return {'results': {'w': {stage: {'unit': 'tokens', 'rate': rate}
+                                  for stage, rate in rates.items()}}}
+    rows = benchsuite.compare(report({'lexer': 85.0, 'parser': 95.0,
+                                      'new': 1.0}),
+                              report({'lexer': 100.0, 'parser': 100.0}))
+    assert [(stage, regressed) for _, stage, _, _, _, regressed in rows] == \
+        [('lexer', True), ('parser', False)]
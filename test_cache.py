@@ -0,0 +1,51 @@
+import os
+
+import lexer as lx
+import astt
+import cache
+
+
+CODE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'code.txt')
+
+
+def parse(text):
+    return astt.Parser(lx.FastLexer(text)).parse()
+
+
+def test_tree_round_trip():
+    with open(CODE) as f:
+        text = f.read()
+    text += '\nlocal t = not (a5 >= 2) or b5 ~= -3\n'
+    records = cache.dump_tree(parse(text))
+    assert cache.dump_tree(cache.load_tree(records)) == records
+
+
+def test_parse_cache_hit(tmp_path):
+    with open(CODE) as f:
+        text = f.read()
+    parse_cache = cache.ParseCache(str(tmp_path))
+    first = parse_cache.parse(text)
+    second = parse_cache.parse(text)
+    assert (parse_cache.hits, parse_cache.misses) == (1, 1)
+    assert cache.dump_tree(second) == cache.dump_tree(first)
+
+
+def test_stale_entry_is_a_miss(tmp_path):
+    parse_cache = cache.ParseCache(str(tmp_path))
+    parse_cache.parse('a = 1')
+    path = parse_cache._path(cache.source_key('a = 1'))
+    with open(path, 'wb') as f:
+        f.write(b'not a cache entry')
+    assert parse_cache.get('a = 1') is None
+    assert not os.path.exists(path)
+
+
+def test_hit_on_an_entry_removed_meanwhile(tmp_path, monkeypatch):
+    parse_cache = cache.ParseCache(str(tmp_path))
+    parse_cache.parse('a = 1')
+
+    def utime(path):
+        raise FileNotFoundError(path)
+    monkeypatch.setattr(os, 'utime', utime)
+    assert parse_cache.get('a = 1') is not None
+    assert parse_cache.hits == 1
@@ -0,0 +1,89 @@
+import os
+
+import lexer as lx
+import astt
+import bench
+import cache
+
+
+CODE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'code.txt')
+
+# programs every engine must run to the same globals
+PROGRAMS = {
+    'locals': ('x = 1\n'
+               'local y = x + 2\n'
+               'while x < 5 do\n'
+               '    local y = y * 2\n'
+               '    x = x + 1\n'
+               '    z = y\n'
+               'end\n'
+               'w = y\n'),
+    'logic': ('a = 3\n'
+              'b = a > 2 and a < 5\n'
+              'c = not b or a == 3\n'
+              'd = -a ^ 2 % 7\n'
+              'e = 7 // 2 + 7 / 2\n'
+              'f = undefined or 4\n'),
+    'elseif': ('n = 0\n'
+               'k = 0\n'
+               'while n < 12 do\n'
+               '    if n % 4 == 0 then k = k + 1\n'
+               '    elseif n % 4 == 1 then k = k + 10\n'
+               '    elseif n % 4 == 2 then local k = 5\n'
+               '    else k = k - 1 end\n'
+               '    n = n + 1\n'
+               'end\n'),
+}
+
+
+def programs():
+    """(name, source) of code.txt and the shared programs."""
+    with open(CODE) as f:
+        yield 'code.txt', f.read()
+    yield from PROGRAMS.items()
+
+
+def run(engine, program):
+    interpreter = engine(bench.ParsedProgram(program))
+    interpreter.find()
+    return dict(interpreter.symtab.items())
+
+
+def parse(text):
+    return astt.Parser(lx.FastLexer(text)).parse()
+
+
+def check_engine(name):
+    """bench.ENGINES[name] computes the globals the tree walker does, on
+    parsed and on cached trees, and again when it runs a second time."""
+    engine = bench.ENGINES[name]
+    for text_name, text in programs():
+        expected = run(bench.ENGINES['tree'], parse(text))
+        # a fresh tree every time: some engines rewrite it in place
+        assert run(engine, parse(text)) == expected, text_name
+        program = cache.load_tree(cache.dump_tree(parse(text)))
+        assert run(engine, program) == expected, text_name
+        interpreter = engine(bench.ParsedProgram(parse(text)))
+        interpreter.find()
+        interpreter.find()
+        assert dict(interpreter.symtab.items()) == expected, text_name
+
+
+def test_closure_engine():
+    check_engine('closure')
+
+
+def test_transpiled_engine():
+    check_engine('python')
+
+
+def test_vm_engine():
+    check_engine('vm')
+
+
+def test_quickened_engine():
+    check_engine('quick')
+
+
+def test_iterative_engine():
+    check_engine('stack')
@@ -0,0 +1,116 @@
+import os
+import random
+import re
+
+import lexer as lx
+import astt
+import cache
+import incremental
+
+
+CODE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'code.txt')
+
+
+def shape(program):
+    """The records of cache.dump_tree() without token positions, which
+    are stale in reused statements."""
+    return [record[:3] if record[0] == 1 else record
+            for record in cache.dump_tree(program)]
+
+
+def full_parse(text):
+    return astt.Parser(lx.FastLexer(text)).parse()
+
+
+def test_edits_match_full_parse():
+    with open(CODE) as f:
+        text = '\n'.join([f.read()] * 5)
+    doc = incremental.IncrementalParser(text)
+    rng = random.Random(7)
+    digits = [m.start() for m in re.finditer(r'\d', text)]
+    for _ in range(200):
+        offset = rng.choice(digits)
+        doc.edit(offset, 1, str(rng.randrange(1, 10)))
+        assert shape(doc.parse()) == shape(full_parse(doc.text))
+    assert doc.reused > 0
+
+
+def test_statement_inserted_and_removed():
+    text = 'a = 1\nb = 2\nc = 3\n'
+    doc = incremental.IncrementalParser(text)
+    doc.edit(len('a = 1\n'), 0, 'x = a + 1\n')
+    assert shape(doc.parse()) == shape(full_parse(doc.text))
+    doc.edit(0, len('a = 1\n'), '')
+    assert shape(doc.parse()) == shape(full_parse(doc.text))
+    start, end = doc.statement_span(2)
+    assert doc.text[start:end] == 'c = 3'
+
+
+def test_spans_after_edits_at_both_ends():
+    # long enough for several blocks of statement spans
+    text = ''.join('v{} = {}\n'.format(k, k) for k in range(1000))
+    doc = incremental.IncrementalParser(text)
+    rng = random.Random(3)
+    for i in range(60):
+        end = rng.choice((0, doc.text.rindex('\n', 0, -1) + 1))
+        if i % 3 == 0:
+            doc.edit(end, 0, 'w{} = 1\n'.format(i))
+        elif i % 3 == 1:
+            doc.edit(end, len(doc.text[end:].split('\n')[0]) + 1, '')
+        else:
+            doc.edit(end, 0, '  ')
+        expected = [(m.start(), m.end())
+                    for m in re.finditer(r'[vw]\d+ = \d+', doc.text)]
+        assert [doc.statement_span(index)
+                for index in range(len(doc.statements))] == expected
+
+
+def test_bad_edit_then_recovery():
+    text = 'a = 1\nb = 2\n'
+    doc = incremental.IncrementalParser(text)
+    try:
+        doc.edit(len('a = 1\nb = '), 1, '')
+    except lx.ParserError:
+        pass
+    else:
+        raise AssertionError('expected a ParserError')
+    doc.edit(len('a = 1\nb = '), 0, '3')
+    assert shape(doc.parse()) == shape(full_parse(doc.text))
+
+
+def test_reparsed_tokens_have_current_positions():
+    text = 'a = 1\nb = 2\n  c = 3\n'
+    doc = incremental.IncrementalParser(text)
+    doc.edit(0, 0, 'x = 0\n\n')
+    doc.edit(doc.text.index('3'), 1, '4')
+    assert doc.reparsed > 0
+    expected = full_parse(doc.text).block.compound_statement.children
+    for index in range(len(doc.statements) - doc.reparsed,
+                       len(doc.statements)):
+        assert cache.dump_tree(doc.statements[index]) == \
+            cache.dump_tree(expected[index])
+    # the token records carry the line and column
+    assert (5, 3) in [record[3:] for record in cache.dump_tree(expected[-1])]
+
+
+def test_empty_text_is_a_parser_error():
+    for text in ('', '   \n\t\n', '-- only a comment\n'):
+        for parse in (full_parse, incremental.IncrementalParser):
+            try:
+                parse(text)
+            except lx.ParserError as e:
+                assert e.message == 'ParserError: Invalid syntax'
+            else:
+                raise AssertionError((text, parse))
+
+
+def test_edit_to_empty_text():
+    doc = incremental.IncrementalParser('a = 1\n')
+    try:
+        doc.edit(0, len('a = 1'), ' ')
+    except lx.ParserError:
+        pass
+    else:
+        raise AssertionError('expected a ParserError')
+    doc.edit(0, 0, 'b = 2')
+    assert shape(doc.parse()) == shape(full_parse(doc.text))
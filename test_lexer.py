@@ -1,6 +1,66 @@
+import io
+import os
+
 import lexer as lx
 
 
+CODE = os.path.join(os.path.dirname(os.path.abspath(__file__)), 'code.txt')
+
+SAMPLE = ('-- a comment\n'
+          'x = 0x1F + 3.25\n'
+          '--[[ a long\ncomment --]]\n'
+          's = "a\\tb" .. \'c\'\n'
+          'if x >= 2 and not y ~= 3 then z = x // 2 end\n')
+
+
+def tokens(lexer):
+    """(type, value, lineno, column) of every token up to and with EOF."""
+    result = []
+    while True:
+        tok = lexer.get_next_token()
+        result.append((tok.type, tok.value, tok.lineno, tok.column))
+        if tok.kind == lx.Kind.EOF:
+            return result
+
+
+def sources():
+    with open(CODE) as f:
+        yield f.read()
+    yield SAMPLE
+
+
+def test_lexers_agree():
+    for text in sources():
+        expected = tokens(lx.Lexer(text))
+        assert tokens(lx.FastLexer(text)) == expected
+
+
+def test_token_stream_agrees():
+    for text in sources():
+        expected = tokens(lx.Lexer(text))
+        assert tokens(lx.TokenStream(text).cursor()) == expected
+
+
+def test_lazy_positions_agree():
+    for text in sources():
+        expected = tokens(lx.Lexer(text))
+        assert tokens(lx.FastLexer(text, lazy_positions=True)) == expected
+
+
+def test_bytes_agree():
+    for text in sources():
+        expected = tokens(lx.Lexer(text))
+        assert tokens(lx.FastLexer(text.encode())) == expected
+
+
+def test_stream_lexer_agrees_across_chunks():
+    for text in sources():
+        expected = tokens(lx.Lexer(text))
+        for chunk_size in (1, 7, 1 << 16):
+            lexer = lx.StreamLexer(io.StringIO(text), chunk_size)
+            assert tokens(lexer) == expected
+
+
 def main():
     with open('test_lexer.txt', 'r') as f:
         text = f.read()
@@ -0,0 +1,144 @@
+import asyncio
+
+import lexer as lx
+import astt
+import smt
+import aio
+import bench
+import iterative
+import limits
+
+from test_engines import programs
+
+
+LOOP = 'i = 0\nwhile true do\n    i = i + 1\nend\n'
+
+
+def interpreter(text, budget, engine=smt.Semantiff):
+    interpreter = engine(astt.Parser(lx.FastLexer(text)))
+    interpreter.set_budget(budget)
+    return interpreter
+
+
+def limit_exceeded(interpreter):
+    try:
+        interpreter.find()
+    except lx.LimitExceeded as e:
+        return e
+    raise AssertionError('expected LimitExceeded')
+
+
+def test_steps():
+    budget = limits.Budget(max_steps=100)
+    e = limit_exceeded(interpreter(LOOP, budget))
+    assert (e.limit, e.allowed) == ('steps', 100)
+    assert e.used == 101
+    assert e.lineno is not None
+
+
+def test_seconds():
+    ticks = iter(range(1000000))
+    budget = limits.Budget(max_seconds=50, timer=lambda: next(ticks))
+    e = limit_exceeded(interpreter(LOOP, budget))
+    assert (e.limit, e.allowed) == ('seconds', 50)
+    assert e.used > 50
+
+
+def test_memory():
+    text = 'x = 7\nwhile true do\n    x = x * x\nend\n'
+    budget = limits.Budget(max_memory=10000)
+    e = limit_exceeded(interpreter(text, budget))
+    assert (e.limit, e.allowed) == ('memory', 10000)
+
+
+def test_exponent_refused_before_computing():
+    budget = limits.Budget(max_memory=10000)
+    e = limit_exceeded(interpreter('x = 3 ^ 100000000000', budget))
+    assert e.limit == 'memory'
+
+
+def test_within_budget():
+    budget = limits.Budget(max_steps=1000, max_seconds=60, max_memory=10000)
+    run = interpreter('i = 0\nwhile i < 10 do i = i + 1 end\n', budget)
+    run.find()
+    assert run.symtab == {'i': 10}
+    # two statements, eleven tests of the loop and ten of its body
+    assert budget.steps == 23
+
+
+def test_stepping_engines_count_the_same_steps():
+    for name, text in programs():
+        counts = []
+        for engine in (smt.Semantiff, iterative.IterativeSemantiff):
+            budget = limits.Budget(max_steps=10 ** 9)
+            run = interpreter(text, budget, engine)
+            run.find()
+            counts.append(budget.steps)
+        assert counts[0] == counts[1], name
+
+
+def test_iterative_steps_and_seconds():
+    for engine in (smt.Semantiff, iterative.IterativeSemantiff):
+        budget = limits.Budget(max_steps=100)
+        e = limit_exceeded(interpreter(LOOP, budget, engine))
+        assert (e.limit, e.used, e.allowed) == ('steps', 101, 100)
+        assert e.lineno is not None
+        ticks = iter(range(1000000))
+        budget = limits.Budget(max_seconds=50, timer=lambda: next(ticks))
+        e = limit_exceeded(interpreter(LOOP, budget, engine))
+        assert e.limit == 'seconds'
+
+
+def test_async_engine_under_budget():
+    run = interpreter(LOOP, limits.Budget(max_steps=1000),
+                      aio.AsyncSemantiff)
+    try:
+        asyncio.run(run.find_async())
+    except lx.LimitExceeded as e:
+        assert (e.limit, e.allowed) == ('steps', 1000)
+    else:
+        raise AssertionError('expected LimitExceeded')
+
+
+def test_unsupported_budgets_are_refused():
+    for name in ('closure', 'python', 'vm'):
+        run = bench.ENGINES[name](None)
+        try:
+            run.set_budget(limits.Budget(max_steps=100))
+        except TypeError:
+            pass
+        else:
+            raise AssertionError(name)
+        run.set_budget(None)
+    run = iterative.IterativeSemantiff(None)
+    try:
+        run.set_budget(limits.Budget(max_memory=10000))
+    except TypeError:
+        pass
+    else:
+        raise AssertionError('iterative')
+    assert run.budget is None
+
+
+def test_budget_governs_one_interpreter():
+    for engine in (smt.Semantiff, iterative.IterativeSemantiff):
+        budget = limits.Budget(max_steps=100)
+        first = engine(bench.ParsedProgram(astt.Parser(
+            lx.FastLexer(LOOP)).parse()))
+        second = engine(bench.ParsedProgram(astt.Parser(
+            lx.FastLexer(LOOP)).parse()))
+        first.set_budget(budget)
+        try:
+            second.set_budget(budget)
+        except ValueError:
+            pass
+        else:
+            raise AssertionError(engine.__name__)
+        assert second.budget is None
+        assert limit_exceeded(first).used == 101
+        # set again on the same interpreter, then handed over
+        first.set_budget(budget)
+        assert limit_exceeded(first).used == 101
+        first.set_budget(None)
+        second.set_budget(budget)
+        assert limit_exceeded(second).used == 101
@@ -0,0 +1,84 @@
+import lexer as lx
+import astt
+import bench
+import optimize
+
+from test_engines import programs, run
+
+
+def optimized(text, redundancy=True):
+    parser = optimize.OptimizingParser(astt.Parser(lx.FastLexer(text)),
+                                       redundancy)
+    return parser.parse()
+
+
+CONSTANT = ('a = 2 * 3 + 4\n'
+            'b = 0\n'
+            'while b < a * 2 - 1 do\n'
+            '    c = a * a + b\n'
+            '    d = (a * a + b) * 2\n'
+            '    b = b + 1\n'
+            'end\n'
+            'if 1 < 2 then e = 1 else e = 2 end\n'
+            'if false then f = 1 end\n'
+            'while false do g = 1 end\n')
+
+
+def test_optimizer_keeps_results():
+    for name, text in list(programs()) + [('constant', CONSTANT)]:
+        expected = run(bench.ENGINES['tree'], astt.Parser(
+            lx.FastLexer(text)).parse())
+        for redundancy in (False, True):
+            for engine_name, engine in bench.ENGINES.items():
+                program = optimized(text, redundancy)
+                assert run(engine, program) == expected, \
+                    (name, redundancy, engine_name)
+
+
+def test_optimizer_reports_changes():
+    parser = optimize.OptimizingParser(astt.Parser(lx.FastLexer(CONSTANT)))
+    parser.parse()
+    assert parser.changes
+    assert all(type(lineno) is int for lineno, _ in parser.changes)
+
+
+def test_folded_if_arm_keeps_its_scope():
+    for text, expected in (
+            ('x = 1\nif true then local x = 5 end\ny = x\n',
+             {'x': 1, 'y': 1}),
+            ('if false then a = 1 else local x = 5 end\nx = 7\n',
+             {'x': 7}),
+            ('local x = 1\nif 2 > 1 then local x = 5 y = x end\nz = x\n',
+             {'y': 5, 'z': 1})):
+        for engine_name, engine in bench.ENGINES.items():
+            assert run(engine, optimized(text, False)) == expected, \
+                (text, engine_name)
+            assert run(engine, optimized(text)) == expected, \
+                (text, engine_name)
+
+
+def test_no_overflow_from_moved_arithmetic():
+    # an integer beyond the float range: moving 'big * f' or 'big / 3'
+    # where it would not have run raises OverflowError
+    prelude = ('big = 1\n'
+               'k = 0\n'
+               'while k < 1100 do big = big * 2 k = k + 1 end\n'
+               'f = 1.5\n'
+               'n = 0\n')
+    for body in ('while n > 0 do x = big * f end\n',
+                 'while n > 0 do x = big / 3 end\n',
+                 'while n < 3 do\n'
+                 '    if n > 5 then x = big - f end\n'
+                 '    n = n + 1\n'
+                 'end\n'):
+        text = prelude + body
+        expected = run(bench.ENGINES['tree'], astt.Parser(
+            lx.FastLexer(text)).parse())
+        assert run(bench.ENGINES['tree'], optimized(text)) == expected, body
+
+
+def test_integer_invariants_are_still_hoisted():
+    parser = optimize.OptimizingParser(astt.Parser(lx.FastLexer(
+        'a = 3\nb = 0\nwhile b < 10 do c = a * a + b b = b + 1 end\n')))
+    parser.parse()
+    assert any('hoisted' in message for _, message in parser.changes)
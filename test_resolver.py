@@ -0,0 +1,35 @@
+import collections.abc
+import copy
+import json
+
+import bench
+import resolver
+import smt
+
+from test_engines import parse
+
+
+def test_globals_view_is_a_mapping():
+    interpreter = smt.Semantiff(bench.ParsedProgram(
+        parse('a = 1\nb = 2.5\nc = a\nc = undefined\n')))
+    interpreter.find()
+    symtab = interpreter.symtab
+    assert type(symtab) is resolver.GlobalsView
+    symtab['d'] = 4
+    del symtab['d']
+    assert isinstance(symtab, collections.abc.MutableMapping)
+    assert json.loads(json.dumps(dict(symtab))) == {'a': 1, 'b': 2.5}
+    assert dict(**symtab) == {'a': 1, 'b': 2.5}
+    assert symtab == {'a': 1, 'b': 2.5} and symtab != {'a': 1}
+    assert list(symtab.keys()) == ['a', 'b']
+    assert list(symtab.values()) == [1, 2.5]
+    assert list(symtab.items()) == [('a', 1), ('b', 2.5)]
+    assert len(symtab) == 2 and 'a' in symtab and 'c' not in symtab
+    assert symtab.get('c', 0) == 0 and symtab.pop('c', 0) == 0
+    other = copy.copy(symtab)
+    other['a'] = 10
+    other.update(e=5)
+    assert symtab == {'a': 1, 'b': 2.5}
+    assert other == {'a': 10, 'b': 2.5, 'e': 5}
+    assert other.setdefault('b', 0) == 2.5
+    assert repr(symtab) == "{'a': 1, 'b': 2.5}"
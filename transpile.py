@@ -0,0 +1,328 @@
+# Translate a parsed program into Python source and run it at bytecode speed.
+# Run: python transpile.py [FILE]   (prints the generated source)
+
+import functools
+import sys
+
+import lexer as lx
+import astt
+import smt
+import closures
+import resolver
+
+
+NIL = lx.TokenType.NIL
+
+# Python spelling of the operators, by token kind
+_ARITHMETIC = {
+    lx.Kind.PLUS: '+',
+    lx.Kind.MINUS: '-',
+    lx.Kind.MUL: '*',
+    lx.Kind.FLOAT_DIV: '/',
+    lx.Kind.DSLASH: '//',
+    lx.Kind.PERCENT: '%',
+    lx.Kind.EXP: '**',
+}
+
+_COMPARE = {
+    lx.Kind.GT: '>',
+    lx.Kind.LT: '<',
+    lx.Kind.GEQ: '>=',
+    lx.Kind.LEQ: '<=',
+    lx.Kind.EQUAL: '==',
+    lx.Kind.NOTEQUAL: '!=',
+}
+
+_UNARY = {
+    lx.Kind.PLUS: '+',
+    lx.Kind.MINUS: '-',
+}
+
+_INDENT = '    '
+
+
+class Transpiler:
+    """Writes the Python source of a function that runs an astt program.
+
+    The generated function takes the symtab dict. Every Lua variable is
+    a local of the function named v_<name>: it is loaded from the symtab
+    on entry (nil if missing) and written back on exit, with nil values
+    removed, as Semantiff would have left them. Lua locals (see
+    resolver.py) are plain locals of the function named l<slot>_<name>,
+    never seen by the symtab. The results of
+    Semantiff are kept exactly: arithmetic and comparisons with a nil
+    operand are nil, both operands are evaluated before that check, and
+    conditions are truthy as smt.bool decides (nil and false are false).
+    """
+
+    def __init__(self, name='chunk'):
+        self.name = name
+        self._lines = []
+        self._temps = 0
+        # Lua variable names in order of first appearance
+        self._names = {}
+
+    def transpile(self, program):
+        """Python source defining a function `self.name`(symtab)."""
+        body = []
+        self._lines = body
+        resolver.resolve(program)
+        self._statement(program, 2)
+        names = list(self._names)
+
+        lines = ['def {}(symtab, NIL=NIL):'.format(self.name)]
+        for name in names:
+            lines.append('{}v_{} = symtab.get({!r}, NIL)'.format(
+                _INDENT, name, name))
+        lines.append(_INDENT + 'try:')
+        lines.extend(body)
+        lines.append(_INDENT + 'finally:')
+        lines.append(_INDENT * 2 + 'for name, value in ({}):'.format(
+            ''.join('({!r}, v_{}), '.format(name, name) for name in names)))
+        lines.append(_INDENT * 3 + 'if value is NIL:')
+        lines.append(_INDENT * 4 + 'symtab.pop(name, None)')
+        lines.append(_INDENT * 3 + 'else:')
+        lines.append(_INDENT * 4 + 'symtab[name] = value')
+        return '\n'.join(lines) + '\n'
+
+    def _emit(self, depth, line):
+        self._lines.append(_INDENT * depth + line)
+
+    def _temp(self):
+        self._temps += 1
+        return '_t{}'.format(self._temps)
+
+    def _variable(self, var):
+        if var.local:
+            return 'l{}_{}'.format(var.slot, var.value)
+        self._names.setdefault(var.value, None)
+        return 'v_' + var.value
+
+    ####################################
+    ############ STATEMENTS ############
+    ####################################
+
+    def _statement(self, node, depth):
+        kind = type(node)
+        if kind is astt.Program:
+            self._statement(node.block, depth)
+        elif kind is astt.Block:
+            self._statement(node.compound_statement, depth)
+        elif kind is astt.Compound or kind is list:
+            for child in (node.children if kind is astt.Compound else node):
+                self._statement(child, depth)
+        elif kind is astt.Assign or kind is astt.Local:
+            target = self._variable(node.left)
+            self._emit(depth, '{} = {}'.format(target,
+                                                self._expression(node.right)))
+        elif kind is astt.While:
+            self._emit(depth, 'while {}:'.format(self._condition(node.test)))
+            self._statement(node.body, depth + 1)
+        elif kind is astt.If:
+            self._if(node, depth)
+        elif kind is astt.NoOp or node is None:
+            self._emit(depth, 'pass')
+        else:
+            # an expression used as a statement is evaluated and dropped
+            self._emit(depth, self._expression(node))
+
+    def _if(self, node, depth):
+        keyword = 'if'
+        while True:
+            self._emit(depth, '{} {}:'.format(keyword,
+                                              self._condition(node.test)))
+            self._statement(node.body, depth + 1)
+            alt = node.alt
+            if type(alt) is astt.If:
+                # an elseif chain is a chain of nested If nodes
+                keyword = 'elif'
+                node = alt
+                continue
+            if alt is not None:
+                self._emit(depth, 'else:')
+                self._statement(alt, depth + 1)
+            return
+
+    def _condition(self, node):
+        """Python expression that is true where smt.bool(node) is."""
+        if type(node) is astt.Compare:
+            # a comparison gives True, False or nil
+            return '({}) is True'.format(self._expression(node))
+        return self._truthy(self._expression(node))
+
+    def _truthy(self, source):
+        temp = self._temp()
+        return '(({} := {}) is not NIL and {})'.format(temp, source, temp)
+
+    ####################################
+    ########### EXPRESSIONS ############
+    ####################################
+
+    def _expression(self, node):
+        return self._expr(node)[0]
+
+    def _expr(self, node):
+        """(source, nilable): Python source of expression `node`, and
+        whether its value can be nil."""
+        kind = type(node)
+        if kind is astt.Num or kind is astt.BoolVal:
+            return self._constant(node.value), False
+        if kind is int or kind is float:
+            return self._constant(node), False
+        if kind is astt.Var:
+            return self._variable(node), True
+        if kind is astt.BinOp:
+            return self._binop(node)
+        if kind is astt.Compare:
+            op = _COMPARE.get(node.op.kind)
+            if op is None:
+                return self._raise(
+                    "Unrecognised compare operator: " + str(node.op))
+            return self._strict(node, op)
+        if kind is astt.UnaryOp:
+            return self._unary(node)
+        if node is None:
+            return 'NIL', True
+        raise Exception("Unexpected token error: " + str(kind))
+
+    @staticmethod
+    def _constant(value):
+        if type(value) is float and value - value != 0:
+            # inf and nan have no literal
+            return 'float({!r})'.format(repr(value))
+        return repr(value)
+
+    @staticmethod
+    def _raise(message):
+        # Semantiff only complains about a bad operator once it runs it
+        return '_fail({!r})'.format(message), False
+
+    def _binop(self, node):
+        kind = node.op.kind
+        if kind == lx.Kind.OR or kind == lx.Kind.AND:
+            temp = self._temp()
+            left, left_nilable = self._expr(node.left)
+            right, right_nilable = self._expr(node.right)
+            test = '({} := {}) is not NIL and {}'.format(temp, left, temp)
+            if kind == lx.Kind.OR:
+                source = '({} if {} else {})'.format(temp, test, right)
+            else:
+                source = '({} if {} else {})'.format(right, test, temp)
+            return source, left_nilable or right_nilable
+        op = _ARITHMETIC.get(kind)
+        if op is None:
+            return self._raise(
+                "Unrecognised binary operator: " + str(node.op.type))
+        return self._strict(node, op)
+
+    def _strict(self, node, op):
+        """Binary operation that is nil when either operand is nil."""
+        left = self._expr(node.left)
+        right = self._expr(node.right)
+        if not left[1] and not right[1]:
+            return '({} {} {})'.format(left[0], op, right[0]), False
+        operands = []
+        checks = []
+        for operand, (source, nilable) in ((node.left, left),
+                                           (node.right, right)):
+            if _is_constant(operand):
+                operands.append(source)
+            elif type(operand) is astt.Var:
+                # reading a local twice is cheaper than saving it
+                checks.append('({} is NIL)'.format(source))
+                operands.append(source)
+            else:
+                # also when it cannot be nil, so that it is evaluated
+                # (and may raise) before the other operand is checked
+                temp = self._temp()
+                checks.append('(({} := {}) is NIL)'.format(temp, source))
+                operands.append(temp)
+        result = '{} {} {}'.format(operands[0], op, operands[1])
+        # '|' rather than 'or', so that both operands are always evaluated
+        return '(NIL if {} else {})'.format(' | '.join(checks), result), True
+
+    def _unary(self, node):
+        kind = node.op.kind
+        operand = self._expression(node.expr)
+        if kind == lx.Kind.NOT:
+            return '(not {})'.format(self._truthy(operand)), False
+        op = _UNARY.get(kind)
+        if op is None:
+            return self._raise(
+                "Unrecognised unary operator: " + str(node.token))
+        # negating nil raises, so the result is never nil
+        return '({}{})'.format(op, operand), False
+
+
+def _is_constant(node):
+    return type(node) in (astt.Num, astt.BoolVal, int, float)
+
+
+def _fail(message):
+    raise Exception(message)
+
+
+@functools.lru_cache(maxsize=256)
+def compile_source(source, name='chunk'):
+    """The function defined by generated `source`, compiled once.
+
+    Programs that translate to the same source share one code object.
+    """
+    namespace = {'NIL': NIL, '_fail': _fail}
+    exec(compile(source, '<lua {}>'.format(name), 'exec'), namespace)
+    return namespace[name]
+
+
+def transpile(program):
+    """Python source of a chunk(symtab) function running `program`."""
+    return Transpiler().transpile(program)
+
+
+class TranspiledSemantiff(smt.Semantiff):
+    """Semantiff that runs the program as compiled Python code.
+
+    find() leaves the same symtab as Semantiff.find(). The generated
+    source is kept in self.source, and printed to `dump` (a file, or
+    sys.stdout when dump is True) before running. Programs nested too
+    deeply for the Python compiler run as closures instead.
+    """
+
+    supports_budget = False
+
+    def __init__(self, parser, dump=None):
+        super().__init__(parser)
+        self.dump = sys.stdout if dump is True else dump
+        self.source = None
+        self.code = None
+
+    def find(self):
+        self.astt = self.parser.parse()
+        try:
+            self.source = transpile(self.astt)
+            if self.dump:
+                self.dump.write(self.source)
+            function = compile_source(self.source)
+        except (SyntaxError, RecursionError, MemoryError):
+            # e.g. more than 20 nested while/if blocks
+            self.code = closures.ClosureCompiler(self.symtab).compile(self.astt)
+            return self.code()
+        symtab = self.symtab
+        self.code = lambda: function(symtab)
+        return self.code()
+
+    def run(self):
+        return self.code()
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else 'code.txt'
+    with open(path) as f:
+        text = f.read()
+    interpreter = TranspiledSemantiff(astt.Parser(lx.FastLexer(text)),
+                                      dump=True)
+    interpreter.find()
+    print(interpreter.symtab)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,503 @@
+# Register-based bytecode for astt programs, and the loop that runs it.
+# Run: python vm.py [FILE]   (prints the disassembly and the result)
+
+from array import array
+import operator
+import sys
+
+import lexer as lx
+import astt
+import smt
+import resolver
+
+
+NIL = lx.TokenType.NIL
+
+# Opcodes. Every instruction is four ints: opcode, A, B, C. The opcodes
+# are numbered in groups so that the dispatch loop can pick the group
+# with one range test and take the operation from a table.
+OPCODES = (
+    # R[A] = R[B] op R[C], nil if either is nil
+    'ADD', 'SUB', 'MUL', 'DIV', 'IDIV', 'MOD', 'POW',
+    # unless R[A] op R[B] holds, jump to C (a nil operand does not hold)
+    'JNEQ', 'JNNE', 'JNLT', 'JNLE', 'JNGT', 'JNGE',
+    'JMP',      # jump to A
+    'MOVE',     # R[A] = R[B]
+    # R[A] = R[B] op R[C]: True, False, or nil if either is nil
+    'EQ', 'NE', 'LT', 'LE', 'GT', 'GE',
+    'JF',       # jump to B if R[A] is false or nil
+    'JT',       # jump to B if R[A] is neither
+    'UNM',      # R[A] = -R[B]
+    'UPLUS',    # R[A] = +R[B]
+    'NOT',      # R[A] = not R[B]
+    'FAIL',     # raise Exception(messages[A])
+    'HALT',
+)
+(ADD, SUB, MUL, DIV, IDIV, MOD, POW,
+ JNEQ, JNNE, JNLT, JNLE, JNGT, JNGE,
+ JMP, MOVE,
+ EQ, NE, LT, LE, GT, GE,
+ JF, JT, UNM, UPLUS, NOT, FAIL, HALT) = range(len(OPCODES))
+
+_ARITHMETIC = (operator.add, operator.sub, operator.mul, operator.truediv,
+               operator.floordiv, operator.mod, operator.pow)
+_COMPARISONS = (operator.eq, operator.ne, operator.lt, operator.le,
+                operator.gt, operator.ge)
+
+_ARITHMETIC_OPCODES = {
+    lx.Kind.PLUS: ADD,
+    lx.Kind.MINUS: SUB,
+    lx.Kind.MUL: MUL,
+    lx.Kind.FLOAT_DIV: DIV,
+    lx.Kind.DSLASH: IDIV,
+    lx.Kind.PERCENT: MOD,
+    lx.Kind.EXP: POW,
+}
+
+# compare kind -> offset of its opcode within the EQ and JNEQ groups
+_COMPARE_OFFSETS = {
+    lx.Kind.EQUAL: 0,
+    lx.Kind.NOTEQUAL: 1,
+    lx.Kind.LT: 2,
+    lx.Kind.LEQ: 3,
+    lx.Kind.GT: 4,
+    lx.Kind.GEQ: 5,
+}
+
+_UNARY_OPCODES = {
+    lx.Kind.MINUS: UNM,
+    lx.Kind.PLUS: UPLUS,
+    lx.Kind.NOT: NOT,
+}
+
+
+class Chunk:
+    """A compiled program.
+
+    `code` holds the instructions, four ints each. The register file
+    starts with one register per global variable (named by `names`), then
+    one per local (named by `local_names`, see resolver.py), then one per
+    entry of the constant pool `constants`, then `temporaries` scratch
+    registers. Constant registers are filled before the program
+    runs, so instructions never tell registers and constants apart.
+    `messages` are the errors FAIL instructions raise.
+    """
+
+    def __init__(self, code, names, constants, temporaries, messages,
+                 local_names=()):
+        self.code = code
+        self.names = names
+        self.local_names = list(local_names)
+        self.constants = constants
+        self.temporaries = temporaries
+        self.messages = messages
+        self._instructions = None
+
+    @property
+    def instructions(self):
+        """The code as a list of (opcode, A, B, C) tuples, for the VM."""
+        if self._instructions is None:
+            words = iter(self.code)
+            self._instructions = list(zip(words, words, words, words))
+        return self._instructions
+
+    def __len__(self):
+        return len(self.code) // 4
+
+    def register_name(self, register):
+        if register < len(self.names):
+            return self.names[register]
+        register -= len(self.names)
+        if register < len(self.local_names):
+            return 'local {}'.format(self.local_names[register])
+        register -= len(self.local_names)
+        if register < len(self.constants):
+            return repr(self.constants[register])
+        return 't{}'.format(register - len(self.constants))
+
+    def opcode_counts(self):
+        """Number of instructions of each opcode in the code."""
+        counts = {}
+        for instruction in self.instructions:
+            name = OPCODES[instruction[0]]
+            counts[name] = counts.get(name, 0) + 1
+        return counts
+
+
+####################################
+############# COMPILER #############
+####################################
+
+class Compiler:
+    """Compiles an astt program into a Chunk."""
+
+    def __init__(self):
+        self.code = array('i')
+        self.names = []
+        self.local_names = []
+        self.constants = []
+        self._constant_index = {}
+        self.messages = []
+        # first free temporary, and the most ever in use at once
+        self._top = 0
+        self._temporaries = 0
+
+    def compile(self, program):
+        self._collect(program)
+        self._statement(program)
+        self._emit(HALT)
+        return Chunk(self.code, self.names, self.constants, self._temporaries,
+                     self.messages, self.local_names)
+
+    def _collect(self, program):
+        """Give every variable and constant of the program a register.
+
+        All of them are known before any code is emitted, so that the
+        temporaries can start right after them.
+        """
+        resolution = resolver.resolve(program)
+        self.names = resolution.global_names
+        self.local_names = resolution.local_names
+        self._constant(NIL)
+        pending = [program]
+        while pending:
+            node = pending.pop()
+            kind = type(node)
+            if kind is astt.Num or kind is astt.BoolVal:
+                self._constant(node.value)
+            elif kind is int or kind is float:
+                self._constant(node)
+            elif kind is list:
+                pending.extend(reversed(node))
+            elif kind is astt.Compound:
+                pending.extend(reversed(node.children))
+            elif node is not None and kind is not astt.NoOp:
+                pending.extend(getattr(node, field) for field in
+                               reversed(_CHILD_FIELDS.get(kind, ())))
+
+    def _constant(self, value):
+        # 1, 1.0 and True are equal as dict keys but not as Lua values
+        key = (type(value), value)
+        index = self._constant_index.get(key)
+        if index is None:
+            index = self._constant_index[key] = len(self.constants)
+            self.constants.append(value)
+        return index
+
+    def _variable(self, var):
+        if var.local:
+            return len(self.names) + var.slot
+        return var.slot
+
+    def _const_register(self, value):
+        return len(self.names) + len(self.local_names) + self._constant(value)
+
+    def _emit(self, opcode, a=0, b=0, c=0):
+        self.code.extend((opcode, a, b, c))
+        return len(self.code) // 4 - 1
+
+    def _patch(self, index, field, target):
+        self.code[index * 4 + field] = target
+
+    @property
+    def _here(self):
+        return len(self.code) // 4
+
+    def _alloc(self):
+        register = (len(self.names) + len(self.local_names)
+                    + len(self.constants) + self._top)
+        self._top += 1
+        self._temporaries = max(self._temporaries, self._top)
+        return register
+
+    ####################################
+    ############ STATEMENTS ############
+    ####################################
+
+    def _statement(self, node):
+        kind = type(node)
+        if kind is astt.Program:
+            self._statement(node.block)
+        elif kind is astt.Block:
+            self._statement(node.compound_statement)
+        elif kind is astt.Compound or kind is list:
+            for child in (node.children if kind is astt.Compound else node):
+                self._statement(child)
+        elif kind is astt.Assign or kind is astt.Local:
+            self._assign(node)
+        elif kind is astt.While:
+            top = self._here
+            exit_jumps = self._branch_if_false(node.test)
+            self._statement(node.body)
+            self._emit(JMP, top)
+            for jump, field in exit_jumps:
+                self._patch(jump, field, self._here)
+        elif kind is astt.If:
+            self._if(node)
+        elif kind is astt.NoOp or node is None:
+            pass
+        else:
+            # an expression used as a statement is evaluated and dropped
+            saved = self._top
+            self._expression(node, self._alloc())
+            self._top = saved
+
+    def _assign(self, node):
+        target = self._variable(node.left)
+        right = node.right
+        if type(right) is astt.BinOp and right.op.kind in (lx.Kind.AND,
+                                                            lx.Kind.OR):
+            # 'a = b or a' must not clobber a before the right side runs
+            saved = self._top
+            temp = self._alloc()
+            self._expression(right, temp)
+            self._emit(MOVE, target, temp)
+            self._top = saved
+        else:
+            self._expression(right, target)
+
+    def _if(self, node):
+        end_jumps = []
+        while True:
+            false_jumps = self._branch_if_false(node.test)
+            self._statement(node.body)
+            alt = node.alt
+            if alt is not None:
+                end_jumps.append(self._emit(JMP))
+            for jump, field in false_jumps:
+                self._patch(jump, field, self._here)
+            if type(alt) is astt.If:
+                # an elseif chain is a chain of nested If nodes
+                node = alt
+                continue
+            if alt is not None:
+                self._statement(alt)
+            break
+        for jump in end_jumps:
+            self._patch(jump, 1, self._here)
+
+    def _branch_if_false(self, test):
+        """Emit a jump taken when `test` is false or nil. Returns the
+        (instruction, field) pairs to patch with the jump target."""
+        saved = self._top
+        if type(test) is astt.Compare and test.op.kind in _COMPARE_OFFSETS:
+            # the comparison and the branch are one instruction
+            left = self._operand(test.left)
+            right = self._operand(test.right)
+            jump = self._emit(JNEQ + _COMPARE_OFFSETS[test.op.kind],
+                              left, right)
+            field = 3
+        else:
+            jump = self._emit(JF, self._operand(test))
+            field = 2
+        self._top = saved
+        return [(jump, field)]
+
+    ####################################
+    ########### EXPRESSIONS ############
+    ####################################
+
+    def _operand(self, node):
+        """Register holding the value of `node`, computing it into a new
+        temporary unless it is a variable or a constant."""
+        kind = type(node)
+        if kind is astt.Var:
+            return self._variable(node)
+        if kind is astt.Num or kind is astt.BoolVal:
+            return self._const_register(node.value)
+        if kind is int or kind is float:
+            return self._const_register(node)
+        register = self._alloc()
+        self._expression(node, register)
+        return register
+
+    def _expression(self, node, target):
+        """Emit code leaving the value of `node` in register `target`."""
+        kind = type(node)
+        saved = self._top
+        if kind is astt.BinOp:
+            op = node.op.kind
+            if op == lx.Kind.OR or op == lx.Kind.AND:
+                self._expression(node.left, target)
+                jump = self._emit(JT if op == lx.Kind.OR else JF, target)
+                self._expression(node.right, target)
+                self._patch(jump, 2, self._here)
+            elif op in _ARITHMETIC_OPCODES:
+                left = self._operand(node.left)
+                right = self._operand(node.right)
+                self._emit(_ARITHMETIC_OPCODES[op], target, left, right)
+            else:
+                self._fail("Unrecognised binary operator: " + str(node.op.type))
+        elif kind is astt.Compare:
+            if node.op.kind in _COMPARE_OFFSETS:
+                left = self._operand(node.left)
+                right = self._operand(node.right)
+                self._emit(EQ + _COMPARE_OFFSETS[node.op.kind],
+                           target, left, right)
+            else:
+                self._fail("Unrecognised compare operator: " + str(node.op))
+        elif kind is astt.UnaryOp:
+            opcode = _UNARY_OPCODES.get(node.op.kind)
+            if opcode is None:
+                self._fail("Unrecognised unary operator: " + str(node.token))
+            else:
+                self._emit(opcode, target, self._operand(node.expr))
+        elif node is None:
+            self._emit(MOVE, target, self._const_register(NIL))
+        elif kind in (astt.Var, astt.Num, astt.BoolVal, int, float):
+            self._emit(MOVE, target, self._operand(node))
+        else:
+            raise Exception("Unexpected token error: " + str(kind))
+        self._top = saved
+
+    def _fail(self, message):
+        # Semantiff only complains about a bad operator once it runs it
+        self.messages.append(message)
+        self._emit(FAIL, len(self.messages) - 1)
+
+
+# child fields of the nodes _collect() looks through
+_CHILD_FIELDS = {
+    astt.Program: ('block',),
+    astt.Block: ('compound_statement',),
+    astt.While: ('test', 'body'),
+    astt.If: ('test', 'body', 'alt'),
+    astt.Assign: ('left', 'right'),
+    astt.Local: ('left', 'right'),
+    astt.BinOp: ('left', 'right'),
+    astt.Compare: ('left', 'right'),
+    astt.UnaryOp: ('expr',),
+}
+
+
+def compile_program(program):
+    return Compiler().compile(program)
+
+
+####################################
+########## VIRTUAL MACHINE #########
+####################################
+
+def execute(chunk, symtab):
+    """Run `chunk` against `symtab` and return the number of instructions
+    executed. Variables are read from symtab first and written back at the
+    end, with nil ones removed, also when the program raises."""
+    names = chunk.names
+    registers = [symtab.get(name, NIL) for name in names]
+    registers.extend([NIL] * len(chunk.local_names))
+    registers.extend(chunk.constants)
+    registers.extend([NIL] * chunk.temporaries)
+    code = chunk.instructions
+    arithmetic = _ARITHMETIC
+    comparisons = _COMPARISONS
+    pc = 0
+    executed = 0
+    try:
+        while True:
+            op, a, b, c = code[pc]
+            pc += 1
+            executed += 1
+            if op <= POW:
+                x = registers[b]
+                y = registers[c]
+                if x is NIL or y is NIL:
+                    registers[a] = NIL
+                else:
+                    registers[a] = arithmetic[op](x, y)
+            elif op <= JNGE:
+                x = registers[a]
+                y = registers[b]
+                if x is NIL or y is NIL or not comparisons[op - JNEQ](x, y):
+                    pc = c
+            elif op == JMP:
+                pc = a
+            elif op == MOVE:
+                registers[a] = registers[b]
+            elif op <= GE:
+                x = registers[b]
+                y = registers[c]
+                if x is NIL or y is NIL:
+                    registers[a] = NIL
+                else:
+                    registers[a] = comparisons[op - EQ](x, y)
+            elif op == JF:
+                x = registers[a]
+                if x is NIL or x == False:
+                    pc = b
+            elif op == JT:
+                x = registers[a]
+                if x is not NIL and x != False:
+                    pc = b
+            elif op == UNM:
+                registers[a] = -registers[b]
+            elif op == UPLUS:
+                registers[a] = +registers[b]
+            elif op == NOT:
+                registers[a] = not smt.bool(registers[b])
+            elif op == FAIL:
+                raise Exception(chunk.messages[a])
+            else:
+                return executed
+    finally:
+        for name, value in zip(names, registers):
+            if value is NIL:
+                symtab.pop(name, None)
+            else:
+                symtab[name] = value
+
+
+def disassemble(chunk):
+    """Readable listing of `chunk`, one instruction per line."""
+    name = chunk.register_name
+    lines = []
+    for index, (op, a, b, c) in enumerate(chunk.instructions):
+        if op <= POW or EQ <= op <= GE:
+            operands = '{} {} {}'.format(name(a), name(b), name(c))
+        elif op <= JNGE:
+            operands = '{} {} -> {}'.format(name(a), name(b), c)
+        elif op == JMP:
+            operands = '-> {}'.format(a)
+        elif op in (JF, JT):
+            operands = '{} -> {}'.format(name(a), b)
+        elif op == FAIL:
+            operands = repr(chunk.messages[a])
+        elif op == HALT:
+            operands = ''
+        else:
+            operands = '{} {}'.format(name(a), name(b))
+        lines.append('{:>5}  {:<6} {}'.format(index, OPCODES[op], operands))
+    return '\n'.join(lines)
+
+
+class VMSemantiff(smt.Semantiff):
+    """Semantiff that compiles the program to register bytecode and runs
+    it on the VM. find() leaves the same symtab as Semantiff.find(); the
+    compiled Chunk is kept in self.chunk and the number of instructions
+    the last run executed in self.executed."""
+
+    supports_budget = False
+
+    def find(self):
+        self.astt = self.parser.parse()
+        self.chunk = compile_program(self.astt)
+        return self.run()
+
+    def run(self):
+        self.executed = execute(self.chunk, self.symtab)
+        return lx.TokenType.NIL
+
+
+def main():
+    path = sys.argv[1] if len(sys.argv) > 1 else 'code.txt'
+    with open(path) as f:
+        text = f.read()
+    interpreter = VMSemantiff(astt.Parser(lx.FastLexer(text)))
+    interpreter.find()
+    print(disassemble(interpreter.chunk))
+    print('{} instructions, {} executed'.format(len(interpreter.chunk),
+                                               interpreter.executed))
+    print(interpreter.symtab)
+
+
+if __name__ == '__main__':
+    main()